@@ -0,0 +1,173 @@
+# Benchmark of the rf and fitting hot paths on synthetic CST sweeps (see synthetic.py). For every sweep size, the
+# files are written once, then loading, parameter parsing, S-data extraction, truncation, fitting, and plotting are
+# timed. The results are printed (and optionally saved) as JSON, and compared against a stored baseline: a stage whose
+# time per item grew by more than the tolerance factor counts as a regression and fails the run.
+#
+# Usage: python benchmarks/hot_paths.py [--sizes 10,100,1000] [--baseline benchmarks/baseline.json]
+#                                       [--save-baseline] [--output results.json]
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ethanalysis.rf import (get_networks, get_params_dict_from_touchstone, get_s_data, get_freq, plot_s_parameters,
+                            plot_s11_and_impedance)
+from ethanalysis.fitting import fit_s11_resonance_dip
+from ethanalysis.utils.main import truncate_data
+from synthetic import write_synthetic_sweep
+
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Function to time a callable, best of repeat runs
+def best_time(function, repeat: int = 1) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+# Function to run every stage on one sweep
+def run_sweep(filepaths: list[str],
+              repeat: int = 3,
+              max_fits: int = 1000,
+              max_plot: int = 100) -> dict:
+    """
+    Time the hot paths on the files of one sweep. Fitting and plotting only use the first max_fits and max_plot
+    networks, so the largest sweeps don't take hours; the time per item is what gets compared.
+
+    Returns
+    -------
+    dict
+        Dictionary mapping each stage to {'seconds', 'items', 'per_item'}.
+    """
+    results = {}
+    def record(stage, seconds, items):
+        results[stage] = {'seconds': seconds, 'items': items, 'per_item': seconds / max(items, 1)}
+
+    networks = []
+    def load():
+        networks[:] = get_networks(filepaths)
+    record('get_networks', best_time(load, 1), len(filepaths))
+    record('get_params_dict_from_touchstone',
+           best_time(lambda: [get_params_dict_from_touchstone(filepath) for filepath in filepaths], repeat),
+           len(filepaths))
+    record('get_s_data', best_time(lambda: [get_s_data(net, '11') for net in networks], repeat), len(networks))
+
+    freqs = [get_freq(net) for net in networks]
+    s11s = [get_s_data(net, '11') for net in networks]
+    fit_range = [float(freqs[0][0] + 0.1 * (freqs[0][-1] - freqs[0][0])), float(freqs[0][-1])]
+    record('truncate_data',
+           best_time(lambda: [truncate_data(x, y, fit_range, assume_sorted=True) for x, y in zip(freqs, s11s)], repeat),
+           len(networks))
+
+    # Fit one trace before timing, so that the imports of the first fit are not counted
+    fit_s11_resonance_dip(freqs[0], s11s[0], fit_range='auto')
+    n_fits = min(max_fits, len(networks))
+    nfev = []
+    def fit():
+        nfev[:] = [fit_s11_resonance_dip(x, y, fit_range='auto')[0].nfev for x, y in zip(freqs[:n_fits], s11s[:n_fits])]
+    record('fit_s11_resonance_dip', best_time(fit, 1), n_fits)
+    results['fit_s11_resonance_dip']['mean_nfev'] = float(np.mean(nfev))
+
+    n_plot = min(max_plot, len(networks))
+    def plot(function, n_networks, **kwargs):
+        def render():
+            fig = function(networks[:n_networks], **kwargs)[0]
+            fig.canvas.draw()
+            plt.close(fig)
+        return render
+    # One color per network, like a caller plotting a sweep would pass
+    colors = [f'C{i % 10}' for i in range(n_plot)]
+    record('plot_s_parameters',
+           best_time(plot(plot_s_parameters, n_plot, colors=colors, show_plot=False, show_legend=False), 1), n_plot)
+    record('plot_s_parameters_fast',
+           best_time(plot(plot_s_parameters, n_plot, show_plot=False, show_legend=False, fast=True), 1), n_plot)
+    # The three panel figure is timed with five networks, one per main color, as in the baseline
+    n_small = min(5, n_plot)
+    plot(plot_s11_and_impedance, 1)()  # warm-up
+    record('plot_s11_and_impedance', best_time(plot(plot_s11_and_impedance, n_small, nets_to_fit='all'), 1), n_small)
+    return results
+
+# Function to compare results against a baseline
+def compare(results: dict,
+            baseline: dict,
+            tolerance: float = 1.5,
+            min_seconds: float = 0.01) -> list[str]:
+    """
+    Compare the time per item of every stage and size that is in both the results and the baseline. Stages that took
+    less than min_seconds in total are too noisy to compare and are skipped.
+
+    Returns
+    -------
+    list[str]
+        One message per regression, a stage and size more than tolerance times slower than the baseline.
+    """
+    regressions = []
+    for size, stages in results['sizes'].items():
+        for stage, result in stages.items():
+            reference = baseline.get('sizes', {}).get(size, {}).get(stage)
+            if reference is None or max(result['seconds'], reference['seconds']) < min_seconds:
+                continue
+            ratio = result['per_item'] / max(reference['per_item'], 1e-12)
+            result['baseline_ratio'] = ratio
+            if ratio > tolerance:
+                regressions.append(f'{stage} at {size} files: {ratio:.2f}x slower than the baseline '
+                                   f'({result["per_item"]*1e3:.3f} ms vs {reference["per_item"]*1e3:.3f} ms per item)')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the rf and fitting hot paths on synthetic sweeps')
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help='Comma separated numbers of files, up to 10000 (default 10,100,1000)')
+    parser.add_argument('--n-points', type=int, default=2001, help='Number of frequency points (default 2001)')
+    parser.add_argument('--n-ports', type=int, default=2, help='Number of ports (default 2)')
+    parser.add_argument('--n-resonances', type=int, default=1, help='Number of resonances per file (default 1)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of the cheap stages, the best is kept (default 3)')
+    parser.add_argument('--max-fits', type=int, default=1000, help='Largest number of fits per size (default 1000)')
+    parser.add_argument('--max-plot', type=int, default=100, help='Largest number of plotted networks (default 100)')
+    parser.add_argument('--baseline', default=default_baseline, help='Baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='Slowdown factor per item that counts as a regression (default 1.5)')
+    parser.add_argument('--min-seconds', type=float, default=0.01,
+                        help='Stages faster than this in total are not compared (default 0.01)')
+    parser.add_argument('--save-baseline', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--output', help='Also write the results JSON to this file')
+    args = parser.parse_args()
+
+    results = {'meta': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                        'n_points': args.n_points, 'n_ports': args.n_ports, 'n_resonances': args.n_resonances},
+               'sizes': {}}
+    for size in [int(size) for size in args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as directory:
+            filepaths = write_synthetic_sweep(directory, size, n_ports=args.n_ports, n_points=args.n_points,
+                                              n_resonances=args.n_resonances)
+            results['sizes'][str(size)] = run_sweep(filepaths, repeat=args.repeat, max_fits=args.max_fits,
+                                                    max_plot=args.max_plot)
+
+    regressions = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance, args.min_seconds)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'Saved the baseline to {args.baseline}')
+    for message in regressions:
+        print(f'FAIL: {message}')
+    if not regressions:
+        print('OK: no stage is slower than the baseline' if os.path.exists(args.baseline) else 'OK: no baseline to compare')
+    sys.exit(1 if regressions else 0)
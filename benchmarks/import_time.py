@@ -0,0 +1,69 @@
+# Benchmark for the cold import time of the numeric API of ethanalysis. Each run imports the package in a fresh
+# interpreter (like a process pool worker would) and the best of several runs is compared against a time budget.
+# The benchmark also fails if importing the numeric API loads matplotlib, pandas, or lmfit.
+#
+# Usage: python benchmarks/import_time.py [--budget SECONDS] [--repeat N]
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Modules that make up the numeric API used by batch workers
+numeric_modules = ['ethanalysis.utils.main', 'ethanalysis.fitting', 'ethanalysis.rf']
+# Modules that should only be loaded when plotting, making tables, or fitting with lmfit
+lazy_modules = ['matplotlib', 'pandas', 'lmfit']
+
+# Code run in the fresh interpreter
+_probe = f"""
+import json, sys, time
+start = time.perf_counter()
+for module in {numeric_modules!r}:
+    __import__(module)
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {lazy_modules!r} if m in sys.modules]}}))
+"""
+
+def measure_import_time(repeat: int = 5) -> dict:
+    """
+    Import the numeric API in repeat fresh interpreters.
+
+    Parameters
+    ----------
+    repeat : int, optional
+        Number of fresh interpreters to time, by default 5
+
+    Returns
+    -------
+    dict
+        Dictionary with the 'best' and all 'runs' times in seconds, and the lazy modules that were 'loaded'.
+    """
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=repo_dir + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    runs, loaded = [], set()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _probe], env=env, check=True, capture_output=True, text=True)
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        runs.append(result['seconds'])
+        loaded.update(result['loaded'])
+    return {'best': min(runs), 'runs': runs, 'loaded': sorted(loaded)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cold import time benchmark for the ethanalysis numeric API')
+    parser.add_argument('--budget', type=float, default=0.5, help='Maximum cold import time in seconds (default 0.5)')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of fresh interpreters to time (default 5)')
+    args = parser.parse_args()
+
+    result = measure_import_time(args.repeat)
+    result['budget'] = args.budget
+    print(json.dumps(result, indent=2))
+    failed = False
+    if result['loaded']:
+        print(f'FAIL: importing the numeric API loaded {", ".join(result["loaded"])}')
+        failed = True
+    if result['best'] > args.budget:
+        print(f'FAIL: cold import took {result["best"]:.3f} s, over the budget of {args.budget:.3f} s')
+        failed = True
+    if not failed:
+        print(f'OK: cold import took {result["best"]:.3f} s (budget {args.budget:.3f} s)')
+    sys.exit(1 if failed else 0)
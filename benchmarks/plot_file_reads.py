@@ -0,0 +1,80 @@
+# Regression benchmark for the number of touchstone file reads per figure. plot_s11_and_impedance is given file
+# paths, and every open() of one of those files is counted while the figure is made. The figure should not open the
+# files more often than loading them once with get_networks does.
+#
+# Usage: python benchmarks/plot_file_reads.py [--n-files N] [--n-points F]
+import argparse
+import builtins
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import skrf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ethanalysis.rf import get_networks, plot_s11_and_impedance
+
+# Function to write simple 2-port touchstone files with one S11 dip each
+def write_touchstone_files(directory: str,
+                           n_files: int,
+                           n_points: int) -> list[str]:
+    frequency = skrf.Frequency(6, 11, n_points, unit='GHz')
+    filepaths = []
+    for i in range(n_files):
+        f_ghz = frequency.f / 1e9
+        center = 7.5 + 2 * i / max(n_files - 1, 1)
+        s = np.zeros((n_points, 2, 2), dtype=complex)
+        s[:, 0, 0] = s[:, 1, 1] = 1 - 0.9 / (1 + ((f_ghz - center) / 0.05)**2)
+        s[:, 0, 1] = s[:, 1, 0] = 0.1
+        network = skrf.Network(frequency=frequency, s=s, name=f'net_{i:03d}')
+        network.write_touchstone(dir=directory)
+        filepaths.append(os.path.join(directory, f'net_{i:03d}.s2p'))
+    return filepaths
+
+# Function to count the opens of the given files while calling a function
+def count_file_reads(filepaths: list[str], function, *args, **kwargs) -> tuple[dict, object]:
+    watched = {os.path.abspath(filepath) for filepath in filepaths}
+    counts = dict.fromkeys(watched, 0)
+    original_open, original_io_open = builtins.open, io.open
+
+    def counting_open(file, *open_args, **open_kwargs):
+        if isinstance(file, (str, os.PathLike)) and os.path.abspath(file) in watched:
+            counts[os.path.abspath(file)] += 1
+        return original_open(file, *open_args, **open_kwargs)
+
+    builtins.open = io.open = counting_open
+    try:
+        output = function(*args, **kwargs)
+    finally:
+        builtins.open, io.open = original_open, original_io_open
+    return counts, output
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Count touchstone file reads per plot_s11_and_impedance figure')
+    parser.add_argument('--n-files', type=int, default=5, help='Number of touchstone files (default 5)')
+    parser.add_argument('--n-points', type=int, default=2001, help='Number of frequency points (default 2001)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filepaths = write_touchstone_files(directory, args.n_files, args.n_points)
+        reference_counts, _ = count_file_reads(filepaths, get_networks, filepaths)
+        start = time.perf_counter()
+        counts, (fig, ax) = count_file_reads(filepaths, plot_s11_and_impedance, filepaths, nets_to_fit='all',
+                                             fit_range=[6.5, 10.5])
+        elapsed = time.perf_counter() - start
+        plt.close(fig)
+
+    reads, reference_reads = sum(counts.values()), sum(reference_counts.values())
+    result = {'n_files': args.n_files, 'n_points': args.n_points, 'file_reads': reads,
+              'file_reads_loading_once': reference_reads, 'seconds': elapsed}
+    print(json.dumps(result, indent=2))
+    if reads > reference_reads:
+        print(f'FAIL: {reads} file opens per figure, loading the {args.n_files} files once takes {reference_reads}')
+        sys.exit(1)
+    print(f'OK: the files were loaded once ({reads} file opens, {elapsed:.2f} s per figure)')
@@ -0,0 +1,153 @@
+# Generator of synthetic CST-style touchstone files for the benchmarks. Each file has the CST comment header with the
+# design parameters (on the fourth comment line, like CST writes it), an option line, and S-parameters in RI format
+# with one or more resonance dips in S11 whose frequencies depend on the design parameters.
+#
+# Usage: python benchmarks/synthetic.py DIRECTORY [--n-files N] [--n-ports P] [--n-points F] [--n-resonances K]
+import argparse
+import os
+import numpy as np
+
+# Function to make the S-parameters of one synthetic resonator
+def synthetic_s_parameters(f_ghz: np.ndarray,
+                           n_ports: int = 2,
+                           centers: list[float] = (8.0,),
+                           q_factors: list[float] = (150.0,),
+                           depths: list[float] = (0.9,)) -> np.ndarray:
+    """
+    S-parameters of a resonator with one dip per resonance. S11 is 1 - sum_k depth_k / (1 + 2jQ_k (f/f_k - 1)), the
+    other reflections are the same with a different phase, and the transmissions are a small copy of the resonances.
+
+    Parameters
+    ----------
+    f_ghz : np.ndarray
+        Frequencies in GHz, shape (F,).
+    n_ports : int, optional
+        Number of ports, by default 2
+    centers, q_factors, depths : list[float], optional
+        Center (GHz), loaded Q and linear depth of each resonance, by default one resonance at 8 GHz.
+
+    Returns
+    -------
+    np.ndarray
+        Complex S-parameters, shape (F, P, P).
+    """
+    resonances = sum(depth / (1 + 2j * q * (f_ghz / center - 1)) for center, q, depth in zip(centers, q_factors, depths))
+    s = np.empty((len(f_ghz), n_ports, n_ports), dtype=complex)
+    for i in range(n_ports):
+        for j in range(n_ports):
+            if i == j:
+                s[:, i, j] = (1 - resonances) * np.exp(1j * np.pi * i / n_ports)
+            else:
+                s[:, i, j] = 0.1 * resonances * np.exp(-1j * np.pi * (i + j) / n_ports)
+    return s
+
+# Function to write one CST-style touchstone file
+def write_cst_touchstone(filepath: str,
+                         f_ghz: np.ndarray,
+                         s: np.ndarray,
+                         params: dict) -> str:
+    """
+    Write S-parameters as a touchstone file with a CST comment header, in GHz and RI format with a 50 Ohm reference.
+    One and two port files have one line per frequency (in the 11 21 12 22 order of two port files), files with more
+    ports have one line per row of the S-matrix with at most 4 values per line.
+
+    Parameters
+    ----------
+    filepath : str
+        Filepath to write, the extension should be .sNp.
+    f_ghz : np.ndarray
+        Frequencies in GHz, shape (F,).
+    s : np.ndarray
+        Complex S-parameters, shape (F, P, P).
+    params : dict
+        Design parameters written to the header.
+
+    Returns
+    -------
+    str
+        The filepath.
+    """
+    n_ports = s.shape[1]
+    parameters = '; '.join(f'{name}={value}' for name, value in params.items())
+    header = ('! TOUCHSTONE file generated by CST Studio Suite\n!\n! Date and Time: synthetic\n'
+              f'! Parameters = {{{parameters}}}\n!\n# GHz S RI R 50\n')
+    if n_ports <= 2:
+        # Two port files list the columns of the S-matrix (11 21 12 22)
+        values = s.transpose(0, 2, 1).reshape(len(f_ghz), -1)
+        table = np.column_stack([f_ghz, np.stack([values.real, values.imag], axis=-1).reshape(len(f_ghz), -1)])
+        with open(filepath, 'w') as file:
+            file.write(header)
+            np.savetxt(file, table, fmt='%.10g')
+        return filepath
+    lines = [header]
+    for k, f in enumerate(f_ghz):
+        for i in range(n_ports):
+            row = s[k, i]
+            for start in range(0, n_ports, 4):
+                numbers = ' '.join(f'{value.real:.10g} {value.imag:.10g}' for value in row[start:start + 4])
+                lines.append(f'{f:.10g} {numbers}\n' if i == 0 and start == 0 else f'{numbers}\n')
+    with open(filepath, 'w') as file:
+        file.writelines(lines)
+    return filepath
+
+# Function to write a whole synthetic sweep
+def write_synthetic_sweep(directory: str,
+                          n_files: int,
+                          n_ports: int = 2,
+                          n_points: int = 2001,
+                          n_resonances: int = 1,
+                          f_range: tuple[float, float] = (6.0, 11.0),
+                          seed: int = 0) -> list[str]:
+    """
+    Write n_files touchstone files of a synthetic CST sweep over the parameters L, W and gap. The first resonance
+    moves across the band with L, and the other resonances sit at random offsets above it.
+
+    Parameters
+    ----------
+    directory : str
+        Directory to write the files in, created if it doesn't exist.
+    n_files : int
+        Number of files.
+    n_ports : int, optional
+        Number of ports, by default 2
+    n_points : int, optional
+        Number of frequency points, by default 2001
+    n_resonances : int, optional
+        Number of resonances per file, by default 1
+    f_range : tuple[float, float], optional
+        Frequency band in GHz, by default (6.0, 11.0)
+    seed : int, optional
+        Seed of the random Q factors, depths and offsets, by default 0
+
+    Returns
+    -------
+    list[str]
+        Filepaths of the files, in the order of the sweep.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    f_ghz = np.linspace(f_range[0], f_range[1], n_points)
+    band = f_range[1] - f_range[0]
+    filepaths = []
+    for i in range(n_files):
+        position = i / max(n_files - 1, 1)
+        params = {'L': round(10 + 2 * position, 6), 'W': 3, 'gap': round(0.1 + 0.1 * (i % 5), 3)}
+        first = f_range[0] + band * (0.2 + 0.3 * position)
+        centers = [first] + list(first + band * rng.uniform(0.1, 0.4, n_resonances - 1).cumsum())
+        s = synthetic_s_parameters(f_ghz, n_ports, centers=centers, q_factors=rng.uniform(100, 400, n_resonances),
+                                   depths=rng.uniform(0.6, 0.95, n_resonances))
+        filepaths.append(write_cst_touchstone(os.path.join(directory, f'run_{i:05d}.s{n_ports}p'), f_ghz, s, params))
+    return filepaths
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic CST sweep of touchstone files')
+    parser.add_argument('directory', help='Directory to write the files in')
+    parser.add_argument('--n-files', type=int, default=100, help='Number of files (default 100)')
+    parser.add_argument('--n-ports', type=int, default=2, help='Number of ports (default 2)')
+    parser.add_argument('--n-points', type=int, default=2001, help='Number of frequency points (default 2001)')
+    parser.add_argument('--n-resonances', type=int, default=1, help='Number of resonances per file (default 1)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default 0)')
+    args = parser.parse_args()
+    filepaths = write_synthetic_sweep(args.directory, args.n_files, n_ports=args.n_ports, n_points=args.n_points,
+                                      n_resonances=args.n_resonances, seed=args.seed)
+    print(f'Wrote {len(filepaths)} files to {args.directory}')
@@ -1,2 +1,4 @@
 from ethanalysis.fitting.main import *
-from ethanalysis.fitting.models import *
\ No newline at end of file
+from ethanalysis.fitting.models import *
+from ethanalysis.fitting.batch import *
+from ethanalysis.fitting.multi import *
\ No newline at end of file
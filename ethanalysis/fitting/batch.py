@@ -0,0 +1,211 @@
+# Module for fitting many S11 traces at once. Instead of running one lmfit fit per network, the Lorentzian on a
+# constant background is fit to every trace of a sweep at the same time with a vectorized Levenberg-Marquardt solver.
+import numpy as np
+from ethanalysis.fitting.models import lorentzian_const_bg, lorentzian_const_bg_jacobian
+from ethanalysis.fitting.main import guess_fit_range
+from ethanalysis.utils.instrument import instrumented, add_nfev
+
+# Function to build the mask of points that are inside the fit range of each trace
+def _fit_range_mask(freq_data: np.ndarray,
+                    n_traces: int,
+                    fit_range: list|str|np.ndarray) -> np.ndarray:
+    if isinstance(fit_range, str):
+        if fit_range != 'all':
+            raise ValueError('The fit range is not valid. The only string allowed is \'all\'.')
+        return np.ones((n_traces, freq_data.shape[-1]), dtype=bool)
+    fit_range = np.asarray(fit_range, dtype=float)
+    if fit_range.shape == (2,):
+        fit_range = np.broadcast_to(fit_range, (n_traces, 2))
+    elif fit_range.shape != (n_traces, 2):
+        raise ValueError('The fit range is not valid. Use \'all\', [min, max], or an (N, 2) array of [min, max] rows.')
+    mask = (freq_data >= fit_range[:, :1]) & (freq_data <= fit_range[:, 1:])
+    if not np.all(mask.sum(axis=1) >= 4):
+        raise ValueError('The fit range is not valid. Every trace needs at least 4 points inside its fit range.')
+    return mask
+
+# Function to get starting values for every trace without any fitting
+def estimate_lorentzian_dips(freq_data: np.ndarray,
+                             s11_data: np.ndarray,
+                             mask: np.ndarray = None) -> np.ndarray:
+    """
+    Closed-form starting values of the Lorentzian on a constant background for many S11 dips at once. The center is
+    the location of the minimum, the background is the largest value, the width comes from the number of points below
+    half of the dip depth, and the amplitude is set so that the model reaches the minimum at the center.
+
+    Parameters
+    ----------
+    freq_data : np.ndarray
+        Frequency data, shape (F,) shared by every trace or (N, F).
+    s11_data : np.ndarray
+        S11 data (in dB), shape (N, F).
+    mask : np.ndarray, optional
+        Boolean array of shape (N, F) of the points to use, by default None which uses every point.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (N, 4) with the (amplitude, center, sigma, c) starting values of each trace.
+    """
+    freq_data = np.broadcast_to(freq_data, s11_data.shape)
+    if mask is None:
+        mask = np.ones(s11_data.shape, dtype=bool)
+    rows = np.arange(s11_data.shape[0])
+    # Minimum and background of the points in the fit range
+    min_index = np.argmin(np.where(mask, s11_data, np.inf), axis=1)
+    y_min = s11_data[rows, min_index]
+    center = freq_data[rows, min_index]
+    background = np.max(np.where(mask, s11_data, -np.inf), axis=1)
+    # Full width at half depth from the number of points below the half depth level times the point spacing
+    half_depth = (background + y_min) / 2
+    n_below = np.sum(mask & (s11_data <= half_depth[:, None]), axis=1)
+    x_min = np.min(np.where(mask, freq_data, np.inf), axis=1)
+    x_max = np.max(np.where(mask, freq_data, -np.inf), axis=1)
+    spacing = (x_max - x_min) / np.maximum(mask.sum(axis=1) - 1, 1)
+    sigma = np.maximum(n_below * spacing / 2, spacing)
+    amplitude = (y_min - background) * np.pi * sigma
+    return np.stack([amplitude, center, sigma, background], axis=1)
+
+# Function to fit the S11 resonance dips of many traces at once
+@instrumented('fit')
+def fit_s11_resonance_dips(freq_data: np.ndarray,
+                           s11_data: np.ndarray,
+                           fit_range: list|str|np.ndarray = 'all',
+                           max_iterations: int = 100,
+                           tolerance: float = 1e-10,
+                           method: str = 'vectorized') -> dict[str, np.ndarray]:
+    """
+    Fit the S11 resonance dips of many traces to the Lorentzian on a constant background model (the same model as
+    fit_s11_resonance_dip). The fits of all traces run together: each Levenberg-Marquardt step is a handful of numpy
+    operations over the (N, F) data, with the analytic Jacobian and a batched 4x4 solve, so the cost per trace is
+    tiny compared to calling lmfit once per network.
+
+    Parameters
+    ----------
+    freq_data : np.ndarray
+        Frequency data, shape (F,) shared by every trace or (N, F).
+    s11_data : np.ndarray
+        S11 data (in dB), shape (N, F).
+    fit_range : list|str|np.ndarray, optional
+        Range of data to fit. Default is 'all'. Either a list of the form [min, max] used for every trace, an array
+        of shape (N, 2) with one [min, max] row per trace, or 'auto' which picks the range of each trace around its
+        dip (see guess_fit_range).
+    max_iterations : int, optional
+        Maximum number of Levenberg-Marquardt steps, by default 100
+    tolerance : float, optional
+        Relative change of the sum of squared residuals below which a trace counts as converged, by default 1e-10
+    method : str, optional
+        Either 'vectorized' or 'lmfit', by default 'vectorized'. 'lmfit' runs fit_s11_resonance_dip on each trace
+        one after another. It is much slower and meant for checking the vectorized results.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        Dictionary of arrays with one value per trace: 'center', 'sigma', 'amplitude', 'background', 'q_factor'
+        (center/sigma, like fit_s11_resonance_dip), 'chisqr' (sum of squared residuals), 'residual' (root mean square
+        residual), 'n_points', 'iterations', and 'success'.
+    """
+    s11_data = np.atleast_2d(np.asarray(s11_data, dtype=float))
+    freq_data = np.asarray(freq_data, dtype=float)
+    n_traces = s11_data.shape[0]
+    if method == 'lmfit':
+        return _fit_s11_resonance_dips_lmfit(freq_data, s11_data, fit_range)
+    elif method != 'vectorized':
+        raise ValueError('Invalid method string input! Try "vectorized" or "lmfit"')
+
+    x = np.broadcast_to(freq_data, s11_data.shape)
+    if isinstance(fit_range, str) and fit_range == 'auto':
+        fit_range = guess_fit_range(x, s11_data)
+    mask = _fit_range_mask(x, n_traces, fit_range)
+    n_points = mask.sum(axis=1)
+    x_lo = np.min(np.where(mask, x, np.inf), axis=1)
+    x_hi = np.max(np.where(mask, x, -np.inf), axis=1)
+
+    # Start from the closed-form estimates
+    params = estimate_lorentzian_dips(x, s11_data, mask)
+    residuals = _residuals(params, x, s11_data, mask)
+    cost = np.sum(residuals**2, axis=1)
+    damping = np.full(n_traces, 1e-3)
+    active = np.ones(n_traces, dtype=bool)
+    iterations = np.zeros(n_traces, dtype=int)
+
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        idx = np.flatnonzero(active)
+        p = params[idx]
+        jac = lorentzian_const_bg_jacobian(x[idx], *(p[:, k, None] for k in range(4))) * mask[idx, :, None]
+        jtj = np.einsum('nfi,nfj->nij', jac, jac)
+        jtr = np.einsum('nfi,nf->ni', jac, residuals[idx])
+        # Levenberg-Marquardt step with the damping scaled by the diagonal of J^T J
+        diag = np.einsum('nii->ni', jtj)
+        lhs = jtj + (damping[idx, None] * np.maximum(diag, 1e-30))[:, :, None] * np.eye(4)
+        try:
+            step = np.linalg.solve(lhs, jtr[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            step = np.einsum('nij,nj->ni', np.linalg.pinv(lhs), jtr)
+        trial = p + step
+        # Keep the width positive and the center inside the fit range
+        trial[:, 2] = np.abs(trial[:, 2])
+        trial[:, 1] = np.clip(trial[:, 1], x_lo[idx], x_hi[idx])
+        trial_residuals = _residuals(trial, x[idx], s11_data[idx], mask[idx])
+        trial_cost = np.sum(trial_residuals**2, axis=1)
+
+        improved = np.isfinite(trial_cost) & (trial_cost < cost[idx])
+        converged = improved & (cost[idx] - trial_cost <= tolerance * np.maximum(cost[idx], 1e-300))
+        # Accept the improved steps and relax the damping, otherwise increase the damping
+        accepted = idx[improved]
+        params[accepted] = trial[improved]
+        residuals[accepted] = trial_residuals[improved]
+        cost[accepted] = trial_cost[improved]
+        damping[idx] = np.where(improved, damping[idx] / 3, damping[idx] * 4)
+        iterations[idx] += 1
+        # Stop the traces that converged or where the damping blew up (no step can improve the fit)
+        active[idx[converged | (damping[idx] > 1e12)]] = False
+
+    # One evaluation of the model per Levenberg-Marquardt step of each trace, plus the starting point
+    add_nfev(np.sum(iterations) + n_traces)
+    amplitude, center, sigma, background = params.T
+    return {'center': center,
+            'sigma': sigma,
+            'amplitude': amplitude,
+            'background': background,
+            'q_factor': center / sigma,
+            'chisqr': cost,
+            'residual': np.sqrt(cost / n_points),
+            'n_points': n_points,
+            'iterations': iterations,
+            'success': ~active & np.all(np.isfinite(params), axis=1)}
+
+# Residuals of the model inside the fit range of each trace (zero outside)
+def _residuals(params: np.ndarray,
+               x: np.ndarray,
+               y: np.ndarray,
+               mask: np.ndarray) -> np.ndarray:
+    return np.where(mask, y - lorentzian_const_bg(x, *(params[:, k, None] for k in range(4))), 0.0)
+
+# Slow path that runs lmfit on each trace, for validating the vectorized fits
+def _fit_s11_resonance_dips_lmfit(freq_data: np.ndarray,
+                                  s11_data: np.ndarray,
+                                  fit_range: list|str|np.ndarray) -> dict[str, np.ndarray]:
+    from ethanalysis.fitting.main import fit_s11_resonance_dip
+    n_traces = s11_data.shape[0]
+    x = np.broadcast_to(freq_data, s11_data.shape)
+    if not isinstance(fit_range, str):
+        fit_range = np.broadcast_to(np.asarray(fit_range, dtype=float), (n_traces, 2))
+    keys = ['center', 'sigma', 'amplitude', 'background', 'q_factor', 'chisqr', 'residual', 'n_points', 'iterations',
+            'success']
+    results = {key: [] for key in keys}
+    for i in range(n_traces):
+        trace_range = fit_range if isinstance(fit_range, str) else list(fit_range[i])
+        result, q_factor, fit_plotting_data = fit_s11_resonance_dip(x[i], s11_data[i], fit_range=trace_range)
+        results['center'].append(result.params['l_center'].value)
+        results['sigma'].append(result.params['l_sigma'].value)
+        results['amplitude'].append(result.params['l_amplitude'].value)
+        results['background'].append(result.params['bg_c'].value)
+        results['q_factor'].append(float(q_factor))
+        results['chisqr'].append(result.chisqr)
+        results['residual'].append(np.sqrt(result.chisqr / result.ndata))
+        results['n_points'].append(result.ndata)
+        results['iterations'].append(result.nfev)
+        results['success'].append(result.success)
+    return {key: np.array(values) for key, values in results.items()}
@@ -1,13 +1,69 @@
-import lmfit
+# lmfit (through the models) and pandas are only loaded when a fit or table is made, to keep this module cheap to import
+import os
 import numpy as np
-from ethanalysis.fitting.models import LorentzianConstBG
+from concurrent.futures import ProcessPoolExecutor
+from ethanalysis.fitting.models import LorentzianConstBG, AnalyticLorentzianConstBG, lorentzian_const_bg_seed, lorentzian_const_bg_fit_kws
 from ethanalysis.utils.main import truncate_data
+from ethanalysis.utils.instrument import instrumented, add_nfev
 
+# Function to find the center and the full width at half depth of the S11 dip of each trace
+def _dip_center_and_linewidth(x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    n_points = y.shape[1]
+    rows = np.arange(y.shape[0])
+    index = np.arange(n_points)
+    min_index = np.argmin(y, axis=1)
+    # Walk out from the minimum to the first points above the half depth level on each side
+    half_depth = (np.median(y, axis=1) + y[rows, min_index]) / 2
+    above = y > half_depth[:, None]
+    left = np.max(np.where(above & (index < min_index[:, None]), index, 0), axis=1)
+    right = np.min(np.where(above & (index > min_index[:, None]), index, n_points - 1), axis=1)
+    return x[rows, min_index], x[rows, right] - x[rows, left]
+
+# Function to pick the fit range around the S11 resonance dip
+def guess_fit_range(freq_data: np.ndarray,
+                    s11_data: np.ndarray,
+                    n_widths: float = 3,
+                    min_points: int = 20) -> list|np.ndarray:
+    """
+    Choose a fit range around the S11 resonance dip from the data alone. The center is the minimum of the trace, and
+    the linewidth is the full width of the dip at half of its depth below the background (the median of the trace),
+    which for the Lorentzian model is 2*sigma. The window extends n_widths linewidths on each side of the minimum, so
+    the fit sees the whole dip and enough of the background, but not the rest of the band.
+
+    Parameters
+    ----------
+    freq_data : np.ndarray
+        Frequency data sorted in ascending order, shape (F,) shared by every trace or the same shape as s11_data.
+    s11_data : np.ndarray
+        S11 data (in dB), shape (F,) for one trace or (N, F) for many traces.
+    n_widths : float, optional
+        Number of linewidths on each side of the minimum, by default 3
+    min_points : int, optional
+        Smallest number of points in the window, for very narrow dips. By default 20
+
+    Returns
+    -------
+    list|np.ndarray
+        A list of the form [min, max] for one trace, or an array of shape (N, 2) with one [min, max] row per trace.
+        The window never goes past the ends of the data.
+    """
+    y = np.atleast_2d(np.asarray(s11_data, dtype=float))
+    x = np.broadcast_to(np.asarray(freq_data, dtype=float), y.shape)
+    center, linewidth = _dip_center_and_linewidth(x, y)
+    # Keep at least min_points points in the window
+    spacing = (x[:, -1] - x[:, 0]) / max(y.shape[1] - 1, 1)
+    half_window = np.maximum(n_widths * linewidth, min_points / 2 * spacing)
+    fit_range = np.stack([np.maximum(center - half_window, x[:, 0]), np.minimum(center + half_window, x[:, -1])], axis=1)
+    if np.ndim(s11_data) == 1:
+        return fit_range[0].tolist()
+    return fit_range
 
 # Create a function to fit the S11 resonance dip's to a lorentzian model
+@instrumented('fit')
 def fit_s11_resonance_dip(freq_data: np.ndarray,
                           s11_data: np.ndarray,
-                          fit_range: list|str = 'all')-> lmfit.model.ModelResult:
+                          fit_range: list|str = 'all',
+                          model: str = 'analytic')-> 'lmfit.model.ModelResult':
     # Write the docstrings for the function
     """
     Fit the S11 resonance dip to a Lorentzian model.
@@ -19,45 +75,68 @@ def fit_s11_resonance_dip(freq_data: np.ndarray,
     s11_data : np.ndarray
 
     fit_range : list|str, optional
-        Range of data to fit. Default is 'all'. To choose a range, input a list of the form [min, max].
+        Range of data to fit. Default is 'all'. To choose a range, input a list of the form [min, max]. The frequency
+        data must be sorted in ascending order, and both ends of the range are included. 'auto' fits a few linewidths
+        around the dip, see guess_fit_range.
+    model : str, optional
+        Either 'analytic' or 'lmfit', by default 'analytic'. 'analytic' uses AnalyticLorentzianConstBG with its
+        analytic Jacobian, started from the closed-form estimates of lorentzian_const_bg_seed. 'lmfit' uses
+        LorentzianConstBG with finite differences, started from the minimum, the largest value, and a fixed width.
+        Both fit the same model with the same parameter names. The number of function evaluations of the fit is
+        result.nfev.
         
     Returns
     -------
     lmfit.ModelResult
         Result of the fit.
     """
+    # Pick the fit range around the dip, and start the width from the measured linewidth
+    guess_sigma = 0.1
+    if isinstance(fit_range, str) and fit_range == 'auto':
+        fit_range = guess_fit_range(freq_data, s11_data)
+        guess_sigma = float(np.clip(_dip_center_and_linewidth(np.atleast_2d(freq_data), np.atleast_2d(s11_data))[1][0] / 2,
+                                    0.001, 1))
     # Truncate the data to the fit range if input is not 'all'
     if isinstance(fit_range, list):
         try:
-            x_fitting_data, y_fitting_data = truncate_data(freq_data, s11_data, fit_range)
+            x_fitting_data, y_fitting_data = truncate_data(freq_data, s11_data, fit_range, assume_sorted=True)
         except ValueError:
             raise ValueError('The fit range is not valid. Improperly formatted list.')
     elif isinstance(fit_range, str):
         if fit_range == 'all':
             x_fitting_data, y_fitting_data = freq_data, s11_data
         else:
-            raise ValueError('The fit range is not valid. The only string allowed is \'all\'.')
-        #TODO: Add an option to 'guess' the fit range. This will choose the min value as a center and set a width
+            raise ValueError('The fit range is not valid. The only strings allowed are \'all\' and \'auto\'.')
     else:
         raise ValueError('The fit range is not valid.')
     
     # Create a model for the S11 resonance dip
-    model = LorentzianConstBG()
+    if model == 'analytic':
+        fit_model, fit_kws = AnalyticLorentzianConstBG(), lorentzian_const_bg_fit_kws()
+    elif model == 'lmfit':
+        fit_model, fit_kws = LorentzianConstBG(), None
+    else:
+        raise ValueError('Invalid model string input! Try "analytic" or "lmfit"')
     
     # Create a parameters object for the model
-    params = model.make_params()
+    params = fit_model.make_params()
     
     # Create the initial guesses for the parameters
-    guess_center = x_fitting_data[np.argmin(y_fitting_data)]
-    guess_background = max(y_fitting_data)
-    # Set the initial guesses for the parameters
-    params['l_center'].set(value=guess_center, min=x_fitting_data[0], max=x_fitting_data[-1])
+    if model == 'analytic':
+        guess_amplitude, guess_center, guess_sigma, guess_background = lorentzian_const_bg_seed(x_fitting_data, y_fitting_data)
+        params['l_amplitude'].set(value=guess_amplitude)
+    else:
+        guess_center = x_fitting_data[np.argmin(y_fitting_data)]
+        guess_background = max(y_fitting_data)
+    # Set the initial guesses for the parameters, keeping them inside the bounds
+    params['l_center'].set(value=np.clip(guess_center, x_fitting_data[0], x_fitting_data[-1]), min=x_fitting_data[0], max=x_fitting_data[-1])
     # params['l_amplitude'].set(value=-data[s11_col].min(), min=-data[s11_col].max(), max=-data[s11_col].min())
-    params['l_sigma'].set(value=0.1, min=0.001, max=1)
-    params['bg_c'].set(value=guess_background, min=min(y_fitting_data)/2, max=0)
+    params['l_sigma'].set(value=np.clip(guess_sigma, 0.001, 1), min=0.001, max=1)
+    params['bg_c'].set(value=np.clip(guess_background, min(y_fitting_data)/2, 0), min=min(y_fitting_data)/2, max=0)
     
     # Perform the fit
-    result = model.fit(y_fitting_data, params, x=x_fitting_data)
+    result = fit_model.fit(y_fitting_data, params, x=x_fitting_data, fit_kws=fit_kws)
+    add_nfev(result.nfev)
     # calculate the Q factor
     q_factor = result.params['l_center'] / result.params['l_sigma']
     
@@ -65,4 +144,95 @@ def fit_s11_resonance_dip(freq_data: np.ndarray,
     
     # Return the result
     #TODO: Return the Q factor and the plot fitting data. 
-    return result, q_factor, fit_plotting_data
\ No newline at end of file
+    return result, q_factor, fit_plotting_data
+
+# Worker for fit_s11_resonance_dips_parallel. Needs to live at the module level so it can be pickled for a process pool.
+def _fit_s11_worker(task: tuple) -> dict:
+    freq_data, s11_data, model = task
+    try:
+        result, q_factor, fit_plotting_data = fit_s11_resonance_dip(freq_data, s11_data, fit_range='all', model=model)
+        return {'center': result.params['l_center'].value,
+                'sigma': result.params['l_sigma'].value,
+                'q_factor': float(q_factor),
+                'chisqr': result.chisqr,
+                'nfev': result.nfev,
+                'success': result.success,
+                'error': None,
+                'fit_plotting_data': fit_plotting_data}
+    except Exception as e:
+        return {'center': np.nan, 'sigma': np.nan, 'q_factor': np.nan, 'chisqr': np.nan, 'nfev': 0,
+                'success': False, 'error': f'{type(e).__name__}: {e}', 'fit_plotting_data': None}
+
+# Function to run fit_s11_resonance_dip on many traces across multiple cores
+def fit_s11_resonance_dips_parallel(freq_data: list[np.ndarray],
+                                    s11_data: list[np.ndarray],
+                                    fit_range: list|str = 'all',
+                                    names: list = None,
+                                    max_workers: int = None,
+                                    return_fit_data: bool = False,
+                                    model: str = 'lmfit') -> 'pd.DataFrame':
+    """
+    Run fit_s11_resonance_dip on many S11 traces with a process pool, keeping the exact lmfit fits by default. Each trace is
+    truncated to the fit range before it is sent to a worker, so only the small frequency and S11 arrays are passed
+    between processes. For a faster, approximate fit of a whole sweep see fit_s11_resonance_dips.
+
+    Parameters
+    ----------
+    freq_data : list[np.ndarray]
+        Frequency data of each trace.
+    s11_data : list[np.ndarray]
+        S11 data (in dB) of each trace.
+    fit_range : list|str, optional
+        Range of data to fit, used for every trace. Default is 'all'. To choose a range, input a list of the form
+        [min, max]. 'auto' picks the range of each trace around its dip, see guess_fit_range.
+    names : list, optional
+        Name of each trace, used as the index of the table, by default None which uses the position.
+    max_workers : int, optional
+        Number of worker processes, by default None which uses os.cpu_count(). A value of 1 fits the traces one after
+        another in the current process.
+    return_fit_data : bool, optional
+        Add a 'fit_plotting_data' column with the [x, best_fit] arrays of each fit, by default False
+    model : str, optional
+        Model of each fit, either 'lmfit' or 'analytic', see fit_s11_resonance_dip. By default 'lmfit'
+
+    Returns
+    -------
+    pd.DataFrame
+        Table with one row per trace and the columns 'center', 'sigma', 'q_factor', 'chisqr', 'nfev', 'success', and
+        'error' (None, or the message if the fit raised an exception).
+    """
+    if len(freq_data) != len(s11_data):
+        raise ValueError('The number of frequency arrays does not match the number of S11 arrays.')
+    if names is None:
+        names = list(range(len(s11_data)))
+    elif len(names) != len(s11_data):
+        raise ValueError('The length of the names array does not match the number of traces.')
+    
+    # Truncate the data here so that the workers only get the points they fit
+    tasks = []
+    for x_data, y_data in zip(freq_data, s11_data):
+        if isinstance(fit_range, str) and fit_range == 'auto':
+            x_data, y_data = truncate_data(x_data, y_data, guess_fit_range(x_data, y_data), assume_sorted=True)
+        elif isinstance(fit_range, list):
+            try:
+                x_data, y_data = truncate_data(x_data, y_data, fit_range, assume_sorted=True)
+            except ValueError:
+                raise ValueError('The fit range is not valid. Improperly formatted list.')
+        elif fit_range != 'all':
+            raise ValueError('The fit range is not valid. The only strings allowed are \'all\' and \'auto\'.')
+        tasks.append((np.ascontiguousarray(x_data), np.ascontiguousarray(y_data), model))
+    
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(tasks)))
+    if max_workers == 1:
+        rows = [_fit_s11_worker(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            rows = list(pool.map(_fit_s11_worker, tasks, chunksize=max(1, len(tasks) // (4 * max_workers))))
+    
+    import pandas as pd
+    table = pd.DataFrame(rows, index=names)
+    if not return_fit_data:
+        table = table.drop(columns='fit_plotting_data')
+    return table
@@ -1,12 +1,12 @@
 # Module that contains the models used for fitting data. Add the docstrings here to make 
 # These will be functions that output the desired models if I have to make additional ones not provided by lmfit. 
 # sure that they are included in the documentation and are easy to understand. 
-from lmfit.models import LorentzianModel, ConstantModel
-import lmfit
+# lmfit is imported inside the model functions, so that the numpy models can be used without loading it.
+import numpy as np
 
 # Lorentzian on constant background
 def LorentzianConstBG(lorentzian_prefix: str='l_',
-                      bg_prefix: str='bg_')-> lmfit.Model:
+                      bg_prefix: str='bg_')-> 'lmfit.Model':
     """
     Lorentzian model on constant background.
     The Lorentzian model has three paramters: center, amplitude, and sigma.
@@ -24,4 +24,229 @@ def LorentzianConstBG(lorentzian_prefix: str='l_',
     lmfit.Model
         Lorentzian model on constant background.
     """
+    from lmfit.models import LorentzianModel, ConstantModel
     return LorentzianModel(prefix=lorentzian_prefix) + ConstantModel(prefix=bg_prefix)
+
+# Lorentzian on constant background as a plain numpy function. It broadcasts, so the parameters can be arrays with
+# one value per trace (shape (N, 1)) to evaluate many traces at once.
+def lorentzian_const_bg(x: np.ndarray,
+                        amplitude: float|np.ndarray,
+                        center: float|np.ndarray,
+                        sigma: float|np.ndarray,
+                        c: float|np.ndarray) -> np.ndarray:
+    """
+    Evaluate the Lorentzian on a constant background, using the same definition as LorentzianConstBG:
+    c + amplitude/pi * sigma/((x - center)**2 + sigma**2).
+    
+    Parameters
+    ----------
+    x : np.ndarray
+        x data.
+    amplitude : float|np.ndarray
+        Area under the Lorentzian (negative for a dip).
+    center : float|np.ndarray
+        Center of the Lorentzian.
+    sigma : float|np.ndarray
+        Half width at half maximum of the Lorentzian.
+    c : float|np.ndarray
+        Constant background.
+        
+    Returns
+    -------
+    np.ndarray
+        Model evaluated at x.
+    """
+    return c + amplitude / np.pi * sigma / ((x - center)**2 + sigma**2)
+
+# Analytic Jacobian of the Lorentzian on a constant background
+def lorentzian_const_bg_jacobian(x: np.ndarray,
+                                 amplitude: float|np.ndarray,
+                                 center: float|np.ndarray,
+                                 sigma: float|np.ndarray,
+                                 c: float|np.ndarray) -> np.ndarray:
+    """
+    Analytic Jacobian of lorentzian_const_bg with respect to (amplitude, center, sigma, c).
+    
+    Parameters
+    ----------
+    x : np.ndarray
+        x data.
+    amplitude, center, sigma, c : float|np.ndarray
+        Model parameters, see lorentzian_const_bg.
+        
+    Returns
+    -------
+    np.ndarray
+        Array with the derivatives stacked on the last axis, shape x.shape + (4,) (after broadcasting).
+    """
+    dx = x - center
+    denom = dx**2 + sigma**2
+    d_amplitude = sigma / (np.pi * denom)
+    d_center = 2 * amplitude * sigma * dx / (np.pi * denom**2)
+    d_sigma = amplitude * (dx**2 - sigma**2) / (np.pi * denom**2)
+    d_c = np.ones_like(d_amplitude)
+    return np.stack(np.broadcast_arrays(d_amplitude, d_center, d_sigma, d_c), axis=-1)
+
+# Lorentzian on constant background with the parameter names of LorentzianConstBG, for AnalyticLorentzianConstBG
+def _s11_dip(x: np.ndarray,
+             l_amplitude: float = -1.0,
+             l_center: float = 0.0,
+             l_sigma: float = 1.0,
+             bg_c: float = 0.0) -> np.ndarray:
+    return lorentzian_const_bg(x, l_amplitude, l_center, l_sigma, bg_c)
+
+# Lorentzian on constant background with an analytic Jacobian
+def AnalyticLorentzianConstBG()-> 'lmfit.Model':
+    """
+    Lorentzian model on constant background, the same model with the same parameter names ('l_amplitude',
+    'l_center', 'l_sigma', 'bg_c') as LorentzianConstBG, but built from lorentzian_const_bg as one function so that
+    its analytic Jacobian can be given to the fit. Fit it with fit_kws=lorentzian_const_bg_fit_kws() to use the
+    Jacobian instead of finite differences, which saves 4 function evaluations per Levenberg-Marquardt step.
+        
+    Returns
+    -------
+    lmfit.Model
+        Lorentzian model on constant background.
+    """
+    from lmfit import Model
+    return Model(_s11_dip, independent_vars=['x'])
+
+# Jacobian of the residual of AnalyticLorentzianConstBG, in the form lmfit passes to scipy's leastsq
+def lorentzian_const_bg_dfun(params: 'lmfit.Parameters',
+                             data: np.ndarray,
+                             weights: np.ndarray,
+                             x: np.ndarray,
+                             **kwargs) -> np.ndarray:
+    """
+    Analytic Jacobian of the residual (data - model, times the weights) of AnalyticLorentzianConstBG with respect to
+    the varying parameters, one row per parameter (col_deriv=True).
+    """
+    names = ['l_amplitude', 'l_center', 'l_sigma', 'bg_c']
+    jac = -lorentzian_const_bg_jacobian(x, *(params[name].value for name in names))
+    if weights is not None:
+        jac = jac * np.asarray(weights)[..., None]
+    varying = [k for k, name in enumerate(names) if params[name].vary and not params[name].expr]
+    return jac[:, varying].T
+
+def lorentzian_const_bg_fit_kws() -> dict:
+    """fit_kws for AnalyticLorentzianConstBG.fit that make lmfit's leastsq use the analytic Jacobian."""
+    return {'Dfun': lorentzian_const_bg_dfun, 'col_deriv': True}
+
+# Closed-form starting values of the Lorentzian on a constant background
+def lorentzian_const_bg_seed(x: np.ndarray,
+                             y: np.ndarray,
+                             n_iterations: int = 2) -> tuple[float, float, float, float]:
+    """
+    Starting values of (amplitude, center, sigma, c) for one dip, from linear least squares only. Below the
+    background, 1/(y - c) of the Lorentzian is a parabola in x, so a weighted quadratic fit to the points of the dip
+    (deeper than 20% of its depth, weighted by (y - c)**2 to undo the 1/(y - c) error scaling) gives the center and
+    width. With those fixed the model is linear in (c, amplitude), which is then solved exactly. The background
+    starts at the 90th percentile of y and is refined n_iterations times.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        x data.
+    y : np.ndarray
+        y data with one dip (in dB).
+    n_iterations : int, optional
+        Number of refinements of the background, at least 1, by default 2
+
+    Returns
+    -------
+    tuple[float, float, float, float]
+        Starting values of amplitude, center, sigma, and c.
+    """
+    if n_iterations < 1:
+        raise ValueError('n_iterations must be at least 1')
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    min_index = np.argmin(y)
+    # Center the x data on the minimum so the quadratic is well conditioned
+    x_ref = x[min_index]
+    dx = x - x_ref
+    c = np.percentile(y, 90)
+    center, sigma = x_ref, max(abs(dx).max() / 10, np.finfo(float).tiny)
+    for _ in range(n_iterations):
+        d = y - c
+        if d[min_index] >= 0:
+            break
+        use = d < 0.2 * d[min_index]
+        if use.sum() < 3:
+            use = d < 0
+        if use.sum() < 3:
+            break
+        a, b, e = np.polyfit(dx[use], 1 / d[use], 2, w=d[use]**2)
+        if a >= 0:
+            break
+        dip_center = -b / (2 * a)
+        sigma_squared = e / a - dip_center**2
+        if not np.isfinite(dip_center) or sigma_squared <= 0:
+            break
+        center, sigma = x_ref + dip_center, np.sqrt(sigma_squared)
+        # Exact linear solve for the background and amplitude with the center and width fixed
+        shape = lorentzian_const_bg(x, 1.0, center, sigma, 0.0)
+        (c, amplitude), *_ = np.linalg.lstsq(np.stack([np.ones_like(x), shape], axis=1), y, rcond=None)
+    else:
+        return float(amplitude), float(center), float(sigma), float(c)
+    # Fall back to the depth of the minimum if the quadratic fit didn't work out
+    amplitude = (y[min_index] - c) * np.pi * sigma
+    return float(amplitude), float(center), float(sigma), float(c)
+
+# Sum of K Lorentzians on a constant background, for resonators with more than one mode
+def MultiLorentzianConstBG(n_dips: int,
+                           lorentzian_prefix: str='l',
+                           bg_prefix: str='bg_')-> 'lmfit.Model':
+    """
+    Sum of n_dips Lorentzian models on one constant background.
+    Each Lorentzian has the parameters center, amplitude, and sigma, with the prefix lorentzian_prefix followed by
+    its index, so the first one is 'l0_center', 'l0_amplitude', 'l0_sigma'.
+    The constant background has one parameter: c.
+    
+    Parameters
+    ----------
+    n_dips : int
+        Number of Lorentzians.
+    lorentzian_prefix : str
+        Start of the prefix of the Lorentzian model parameters. Default is 'l'.
+    bg_prefix : str
+        Prefix for the constant background parameters. Default is 'bg_'.
+        
+    Returns
+    -------
+    lmfit.Model
+        Sum of Lorentzian models on constant background.
+    """
+    from lmfit.models import LorentzianModel, ConstantModel
+    model = ConstantModel(prefix=bg_prefix)
+    for k in range(n_dips):
+        model = model + LorentzianModel(prefix=f'{lorentzian_prefix}{k}_')
+    return model
+
+# Sum of Lorentzians on a constant background as a plain numpy function
+def multi_lorentzian_const_bg(x: np.ndarray,
+                              amplitudes: np.ndarray,
+                              centers: np.ndarray,
+                              sigmas: np.ndarray,
+                              c: float|np.ndarray) -> np.ndarray:
+    """
+    Evaluate the sum of Lorentzians on a constant background, using the same definition as MultiLorentzianConstBG.
+    
+    Parameters
+    ----------
+    x : np.ndarray
+        x data, shape (F,) or (N, F).
+    amplitudes, centers, sigmas : np.ndarray
+        Parameters of each Lorentzian (see lorentzian_const_bg), shape (K,) or (N, K). NaN entries are skipped, so
+        traces with fewer modes can be padded.
+    c : float|np.ndarray
+        Constant background, a float or shape (N,).
+        
+    Returns
+    -------
+    np.ndarray
+        Model evaluated at x, with the shape of x.
+    """
+    amplitudes, centers, sigmas = (np.asarray(p, dtype=float)[..., None, :] for p in (amplitudes, centers, sigmas))
+    dips = lorentzian_const_bg(np.asarray(x)[..., None], amplitudes, centers, sigmas, 0)
+    return np.asarray(c)[..., None] + np.nansum(dips, axis=-1)
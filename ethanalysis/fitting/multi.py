@@ -0,0 +1,187 @@
+# Module for finding and fitting the S11 dips of resonators with more than one mode. The dips of every trace are
+# found in one vectorized pass, and the dips are then either fit all at once in their own windows with the batch
+# solver of fit_s11_resonance_dips, or together with a composite lmfit model of K Lorentzians.
+import numpy as np
+from ethanalysis.fitting.models import MultiLorentzianConstBG
+from ethanalysis.fitting.batch import fit_s11_resonance_dips
+from ethanalysis.utils.main import truncate_data
+
+# Function to find the S11 dips of many traces at once
+def find_resonance_dips(freq_data: np.ndarray,
+                        s11_data: np.ndarray,
+                        max_dips: int = 5,
+                        min_depth: float = 3.0) -> dict[str, np.ndarray]:
+    """
+    Find up to max_dips resonance dips in each S11 trace. A dip is a local minimum at least min_depth below the
+    background (the median of the trace). The deepest dip is taken first, and every other local minimum between the
+    points where that dip rises back above half of its depth is dropped, then the next deepest dip is taken, and so
+    on. This works on smooth (simulated) traces; noisy measurements should be smoothed first, since every noise
+    minimum on the side of a dip counts as a local minimum.
+
+    Parameters
+    ----------
+    freq_data : np.ndarray
+        Frequency data sorted in ascending order, shape (F,) shared by every trace or the same shape as s11_data.
+    s11_data : np.ndarray
+        S11 data (in dB), shape (F,) for one trace or (N, F) for many traces.
+    max_dips : int, optional
+        Largest number of dips per trace, by default 5
+    min_depth : float, optional
+        Smallest depth of a dip below the background in dB, by default 3.0
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        Dictionary of arrays of shape (N, max_dips) (or (max_dips,) for one trace), with the dips of each trace
+        sorted by frequency and padded with -1 or NaN: 'index' (of the minimum), 'center', 'depth' (dB below the
+        background), and 'linewidth' (full width at half depth). 'background' and 'n_dips' have one value per trace.
+    """
+    y = np.atleast_2d(np.asarray(s11_data, dtype=float))
+    x = np.broadcast_to(np.asarray(freq_data, dtype=float), y.shape)
+    n_traces, n_points = y.shape
+    rows = np.arange(n_traces)
+    index = np.arange(n_points)
+    background = np.median(y, axis=1)
+
+    # Local minima (the end points are not resolved dips) that are deep enough
+    is_min = np.zeros(y.shape, dtype=bool)
+    is_min[:, 1:-1] = (y[:, 1:-1] <= y[:, :-2]) & (y[:, 1:-1] < y[:, 2:])
+    score = np.where(is_min & (background[:, None] - y >= min_depth), y, np.inf)
+
+    dip_index = np.full((n_traces, max_dips), -1)
+    linewidth = np.full((n_traces, max_dips), np.nan)
+    for k in range(max_dips):
+        min_index = np.argmin(score, axis=1)
+        found = np.isfinite(score[rows, min_index])
+        if not found.any():
+            break
+        # Extent of this dip down to half of its depth, every minimum inside it belongs to this dip
+        half_depth = (background + y[rows, min_index]) / 2
+        above = y > half_depth[:, None]
+        left = np.max(np.where(above & (index < min_index[:, None]), index, 0), axis=1)
+        right = np.min(np.where(above & (index > min_index[:, None]), index, n_points - 1), axis=1)
+        dip_index[found, k] = min_index[found]
+        linewidth[found, k] = (x[rows, right] - x[rows, left])[found]
+        inside = (index >= left[:, None]) & (index <= right[:, None]) & found[:, None]
+        score[inside] = np.inf
+
+    # Sort the dips of each trace by frequency, keeping the padding at the end
+    found = dip_index >= 0
+    center = np.where(found, x[rows[:, None], np.maximum(dip_index, 0)], np.nan)
+    order = np.argsort(np.where(found, center, np.inf), axis=1, kind='stable')
+    dip_index, center, linewidth = (np.take_along_axis(a, order, axis=1) for a in (dip_index, center, linewidth))
+    found = dip_index >= 0
+    depth = np.where(found, background[:, None] - y[rows[:, None], np.maximum(dip_index, 0)], np.nan)
+    dips = {'index': dip_index, 'center': center, 'depth': depth, 'linewidth': linewidth,
+            'background': background, 'n_dips': found.sum(axis=1)}
+    if np.ndim(s11_data) == 1:
+        return {key: value[0] for key, value in dips.items()}
+    return dips
+
+# Function to turn the found dips into one fit window per dip
+def _dip_windows(x: np.ndarray,
+                 dips: dict[str, np.ndarray],
+                 n_widths: float) -> tuple[np.ndarray, np.ndarray]:
+    center, linewidth = dips['center'], dips['linewidth']
+    lo = center - n_widths * linewidth
+    hi = center + n_widths * linewidth
+    # Stop each window halfway to the neighbouring dips, so a window only holds one dip
+    midpoints = (center[:, 1:] + center[:, :-1]) / 2
+    lo[:, 1:] = np.fmax(lo[:, 1:], midpoints)
+    hi[:, :-1] = np.fmin(hi[:, :-1], midpoints)
+    return np.maximum(lo, x[:, :1]), np.minimum(hi, x[:, -1:])
+
+# Function to find and fit every S11 dip of many traces
+def fit_s11_resonances(freq_data: np.ndarray,
+                       s11_data: np.ndarray,
+                       max_dips: int = 5,
+                       min_depth: float = 3.0,
+                       n_widths: float = 3,
+                       method: str = 'windows',
+                       max_iterations: int = 100) -> dict[str, np.ndarray]:
+    """
+    Find the resonance dips of each S11 trace (see find_resonance_dips) and fit every dip with the Lorentzian model,
+    so that the modes of a multimode resonator are fit in one call instead of one full-band fit per mode.
+
+    Parameters
+    ----------
+    freq_data : np.ndarray
+        Frequency data sorted in ascending order, shape (F,) shared by every trace or the same shape as s11_data.
+    s11_data : np.ndarray
+        S11 data (in dB), shape (F,) for one trace or (N, F) for many traces.
+    max_dips : int, optional
+        Largest number of dips per trace, by default 5
+    min_depth : float, optional
+        Smallest depth of a dip below the background in dB, by default 3.0
+    n_widths : float, optional
+        Number of linewidths on each side of each dip to fit, by default 3. The windows of neighbouring dips are
+        stopped halfway between them.
+    method : str, optional
+        Either 'windows' or 'composite', by default 'windows'. 'windows' fits every dip of every trace in its own
+        window at the same time with the vectorized solver of fit_s11_resonance_dips. 'composite' fits each trace
+        with one lmfit model of all of its Lorentzians on a shared background (MultiLorentzianConstBG), which is
+        slower but better for dips that overlap.
+    max_iterations : int, optional
+        Maximum number of Levenberg-Marquardt steps of the 'windows' method, by default 100
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        Dictionary of arrays of shape (N, max_dips) (or (max_dips,) for one trace), with the modes of each trace
+        sorted by frequency and padded with NaN: 'center', 'sigma', 'q_factor' (center/sigma), 'depth' (depth of the
+        fitted dip below its background in dB), 'amplitude', 'background', and 'success'. 'n_dips' has one value per
+        trace.
+    """
+    y = np.atleast_2d(np.asarray(s11_data, dtype=float))
+    x = np.broadcast_to(np.asarray(freq_data, dtype=float), y.shape)
+    dips = find_resonance_dips(x, y, max_dips=max_dips, min_depth=min_depth)
+    found = dips['index'] >= 0
+    lo, hi = _dip_windows(x, dips, n_widths)
+    keys = ['center', 'sigma', 'amplitude', 'background']
+    results = {key: np.full(found.shape, np.nan) for key in keys}
+    results['success'] = np.zeros(found.shape, dtype=bool)
+
+    if method == 'windows':
+        trace_index, mode_index = np.nonzero(found)
+        if len(trace_index):
+            # Only pass the points of each window to the solver: every window becomes a row of the same length
+            # (the longest window), and the points of a row outside its window are masked by its fit range
+            x_rows = x[trace_index]
+            start = np.array([np.searchsorted(row, edge) for row, edge in zip(x_rows, lo[found])])
+            stop = np.array([np.searchsorted(row, edge, side='right') for row, edge in zip(x_rows, hi[found])])
+            length = max(int(np.max(stop - start)), 4)
+            columns = np.minimum(start, x.shape[1] - length)[:, None] + np.arange(length)
+            fit = fit_s11_resonance_dips(np.take_along_axis(x_rows, columns, axis=1),
+                                         y[trace_index[:, None], columns],
+                                         fit_range=np.stack([lo[found], hi[found]], axis=1),
+                                         max_iterations=max_iterations)
+            for key in keys + ['success']:
+                results[key][trace_index, mode_index] = fit[key]
+    elif method == 'composite':
+        for i in np.flatnonzero(dips['n_dips']):
+            n_dips = dips['n_dips'][i]
+            x_fit, y_fit = truncate_data(x[i], y[i], [lo[i, 0], hi[i, n_dips - 1]], assume_sorted=True)
+            model = MultiLorentzianConstBG(n_dips)
+            params = model.make_params()
+            params['bg_c'].set(value=dips['background'][i], max=0)
+            for k in range(n_dips):
+                sigma = max(dips['linewidth'][i, k] / 2, x_fit[1] - x_fit[0])
+                params[f'l{k}_center'].set(value=dips['center'][i, k], min=lo[i, k], max=hi[i, k])
+                params[f'l{k}_sigma'].set(value=sigma, min=0)
+                params[f'l{k}_amplitude'].set(value=-dips['depth'][i, k] * np.pi * sigma, max=0)
+            result = model.fit(y_fit, params, x=x_fit)
+            for k in range(n_dips):
+                results['center'][i, k] = result.params[f'l{k}_center'].value
+                results['sigma'][i, k] = result.params[f'l{k}_sigma'].value
+                results['amplitude'][i, k] = result.params[f'l{k}_amplitude'].value
+            results['background'][i, :n_dips] = result.params['bg_c'].value
+            results['success'][i, :n_dips] = result.success
+    else:
+        raise ValueError('Invalid method string input! Try "windows" or "composite"')
+
+    results['q_factor'] = results['center'] / results['sigma']
+    results['depth'] = -results['amplitude'] / (np.pi * results['sigma'])
+    results['n_dips'] = dips['n_dips']
+    if np.ndim(s11_data) == 1:
+        return {key: value[0] for key, value in results.items()}
+    return results
@@ -1 +1,9 @@
-from ethanalysis.rf.rf import *
\ No newline at end of file
+from ethanalysis.rf.rf import *
+from ethanalysis.rf.touchstone import *
+from ethanalysis.rf.cache import *
+from ethanalysis.rf.sweep import *
+from ethanalysis.rf.pipeline import *
+from ethanalysis.rf.results import *
+from ethanalysis.rf.archive import *
+from ethanalysis.rf.report import *
+from ethanalysis.rf.watch import *
@@ -0,0 +1,263 @@
+# Module for a single-file binary archive of a whole sweep. The archive holds the shared frequency axis, the stacked
+# S-parameters of every network, and the sweep parameters, laid out so that the S-parameters can be memory-mapped
+# and only the networks and frequency window that are needed get read from disk.
+#
+# File layout (little endian):
+#   8 bytes   magic b'ETHSWEEP'
+#   4 bytes   format version (uint32)
+#   8 bytes   length of the JSON header in bytes (uint64)
+#   JSON header with the shapes, dtypes, byte offsets, names, and parameter columns
+#   frequency array (float64, shape (F,)) at header['f_offset']
+#   S-parameter block (complex64 or complex128, shape (N, F, P, P)) at header['s_offset']
+# Both data blocks start on a 64 byte boundary.
+import os
+import json
+import struct
+import numpy as np
+import skrf
+from ethanalysis.rf.rf import get_networks, get_params_dict_from_touchstone, get_s_indices, complex_to_db, impedance_from_s
+from ethanalysis.rf.cache import NetworkCache
+from ethanalysis.rf.sweep import SweepDataset, params_to_columns, _freq_units, _check_s_dtype, _fill_s
+from ethanalysis.utils.main import get_range_slice
+
+_magic = b'ETHSWEEP'
+_version = 1
+_prefix = struct.Struct('<8sIQ')
+_alignment = 64
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _alignment) * _alignment
+
+# Function to write the archive header and reserve space for the data blocks
+def _write_header(path: str,
+                  n_networks: int,
+                  f: np.ndarray,
+                  n_ports: int,
+                  dtype: np.dtype,
+                  params: dict[str, np.ndarray],
+                  names: list) -> tuple[int, int]:
+    header = {'n_networks': n_networks, 'n_freq': len(f), 'n_ports': n_ports, 'dtype': np.dtype(dtype).str,
+              'names': [str(name) for name in names],
+              'params': {name: col.tolist() for name, col in params.items()},
+              'param_kinds': {name: col.dtype.kind for name, col in params.items()}}
+    # The offsets depend on the header length, so make room for them before encoding the final header
+    header['f_offset'] = header['s_offset'] = 0
+    header_length = len(json.dumps(header).encode()) + 64
+    f_offset = _aligned(_prefix.size + header_length)
+    s_offset = _aligned(f_offset + len(f) * 8)
+    header['f_offset'], header['s_offset'] = f_offset, s_offset
+    encoded = json.dumps(header).encode().ljust(header_length)
+    s_bytes = n_networks * len(f) * n_ports * n_ports * np.dtype(dtype).itemsize
+    with open(path, 'wb') as file:
+        file.write(_prefix.pack(_magic, _version, header_length))
+        file.write(encoded)
+        file.seek(f_offset)
+        file.write(np.ascontiguousarray(f, dtype='<f8').tobytes())
+        # Extend the file to its full size, the S-parameter block is then filled through a memory map
+        file.truncate(s_offset + s_bytes)
+    return f_offset, s_offset
+
+# Function to write a sweep archive
+def write_sweep_archive(networks: str|skrf.network.Network|list[str|skrf.network.Network]|SweepDataset,
+                        path: str,
+                        dtype: type = None,
+                        params: list[dict]|dict[str, np.ndarray] = None,
+                        names: list = None,
+                        chunk_size: int = 256,
+                        max_workers: int = None,
+                        cache: NetworkCache = None) -> 'SweepArchive':
+    """
+    Write a whole sweep into a single archive file. The networks are loaded through get_networks chunk_size at a time
+    and written straight into the memory-mapped file, so the sweep never has to fit in memory. All of the networks
+    must share a frequency grid and port count. For filepaths, the CST parameters are read from the file headers.
+
+    Parameters
+    ----------
+    networks : str|skrf.network.Network|list[str|skrf.network.Network]|SweepDataset
+        Anything get_networks accepts, or a SweepDataset.
+    path : str
+        Filepath of the archive to write.
+    dtype : type, optional
+        Either np.complex128 or np.complex64 for the S-parameters, by default None which keeps the dtype of a
+        SweepDataset and uses np.complex128 otherwise.
+    params : list[dict]|dict[str, np.ndarray], optional
+        Parameters of each network, either one dictionary per network or columns. By default None, which reads the
+        CST parameters of the filepaths (or uses the columns of a SweepDataset).
+    names : list, optional
+        Name of each network, by default None which uses the network names (or the file names).
+    chunk_size : int, optional
+        Number of networks loaded at a time, by default 256
+    max_workers : int, optional
+        Number of worker processes to load each chunk with, see get_networks. By default None
+    cache : NetworkCache, optional
+        Cache to load the files through, see get_networks. By default None
+
+    Returns
+    -------
+    SweepArchive
+        The archive, opened for reading.
+    """
+    if dtype is None:
+        dtype = networks.s.dtype if isinstance(networks, SweepDataset) else np.complex128
+    dtype = _check_s_dtype(dtype)
+    if isinstance(networks, SweepDataset):
+        params = networks.params if params is None else params
+        names = networks.names if names is None else names
+        networks, f, n_ports = [networks], networks.f, networks.n_ports
+        n_networks = len(networks[0])
+    else:
+        if not isinstance(networks, list):
+            networks = [networks]
+        first = get_networks(networks[:1], cache=cache)
+        if len(first) != 1:
+            raise ValueError('The first network could not be loaded.')
+        f, n_ports, n_networks = first[0].f, first[0].nports, len(networks)
+        if params is None:
+            params = []
+            for net in networks:
+                try:
+                    params.append(get_params_dict_from_touchstone(net, cache=cache) if isinstance(net, str) else {})
+                except (IndexError, ValueError):
+                    params.append({})
+        if names is None:
+            names = [os.path.splitext(os.path.basename(net))[0] if isinstance(net, str) else net.name for net in networks]
+    if isinstance(params, list):
+        params = params_to_columns(params)
+    params = {} if params is None else {name: np.asarray(col) for name, col in params.items()}
+    names = list(range(n_networks)) if names is None else list(names)
+    if len(names) != n_networks:
+        raise ValueError('The length of the names array does not match the number of networks!')
+
+    _, s_offset = _write_header(path, n_networks, f, n_ports, dtype, params, names)
+    s_block = np.memmap(path, dtype=dtype.newbyteorder('<'), mode='r+', offset=s_offset,
+                        shape=(n_networks, len(f), n_ports, n_ports))
+    if len(networks) == 1 and isinstance(networks[0], SweepDataset):
+        s_block[:] = networks[0].s
+    else:
+        for start in range(0, n_networks, chunk_size):
+            chunk = get_networks(networks[start:start + chunk_size], max_workers=max_workers, cache=cache)
+            if len(chunk) != len(networks[start:start + chunk_size]):
+                raise ValueError(f'Some of the networks {start} to {start + chunk_size - 1} could not be loaded.')
+            _fill_s(chunk, f, s_block[start:start + len(chunk)], start=start)
+    s_block.flush()
+    del s_block
+    return SweepArchive(path)
+
+class SweepArchive:
+    """
+    Read access to a sweep archive written by write_sweep_archive. The S-parameter block is memory-mapped, so opening
+    the archive only reads the header and the frequency axis, and every method only reads the networks and frequency
+    window it is asked for.
+
+    Parameters
+    ----------
+    path : str
+        Filepath of the archive.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            magic, version, header_length = _prefix.unpack(file.read(_prefix.size))
+            if magic != _magic:
+                raise ValueError(f'{path} is not a sweep archive.')
+            if version > _version:
+                raise ValueError(f'{path} was written by a newer version of ethanalysis (format {version}).')
+            header = json.loads(file.read(header_length).decode())
+        self.header = header
+        self.names = header['names']
+        self.params = {name: np.array(values, dtype=float if header['param_kinds'][name] in 'fiub' else str)
+                       for name, values in header['params'].items()}
+        self.f = np.fromfile(path, dtype='<f8', count=header['n_freq'], offset=header['f_offset'])
+        self.s = np.memmap(path, dtype=np.dtype(header['dtype']), mode='r', offset=header['s_offset'],
+                           shape=(header['n_networks'], header['n_freq'], header['n_ports'], header['n_ports']))
+
+    def __len__(self) -> int:
+        return self.header['n_networks']
+
+    def __repr__(self) -> str:
+        return (f'SweepArchive({self.path!r}: {len(self)} networks, {self.n_ports} ports, {len(self.f)} points, '
+                f'{self.s.dtype}, parameters: {list(self.params)})')
+
+    @property
+    def n_ports(self) -> int:
+        return self.header['n_ports']
+
+    def _freq_slice(self, freq_range: list = None, units: str = 'GHz') -> slice:
+        if freq_range is None:
+            return slice(None)
+        return get_range_slice(self.f, [edge * _freq_units[units] for edge in freq_range])
+
+    def freq(self,
+             units: str = 'GHz',
+             freq_range: list = None) -> np.ndarray:
+        """
+        Return the shared frequency array in the desired units, optionally only inside freq_range (given in the same
+        units, of the form [min, max]).
+        """
+        if units not in _freq_units:
+            raise Exception('Invalid units string input! Try "Hz", "kHz", "MHz", or "GHz"')
+        return self.f[self._freq_slice(freq_range, units)] / _freq_units[units]
+
+    def s_data(self,
+               s_to_get: str = '11',
+               scale: str = 'dB',
+               index: int|slice|list|np.ndarray = slice(None),
+               freq_range: list = None,
+               units: str = 'GHz') -> np.ndarray:
+        """
+        Read one S-parameter for the selected networks and frequency window.
+
+        Parameters
+        ----------
+        s_to_get : str, optional
+            S-parameter to get, for example '11' or '21', by default '11'
+        scale : str, optional
+            Either 'dB' or 'linear', by default 'dB'
+        index : int|slice|list|np.ndarray, optional
+            Networks to read, by default all of them.
+        freq_range : list, optional
+            Frequency window of the form [min, max] in units, by default None which reads every frequency.
+        units : str, optional
+            Units of freq_range, by default 'GHz'
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (n, F') for the selected networks and frequencies (1D if index is an int).
+        """
+        i, j = get_s_indices(s_to_get, self.n_ports)
+        s_params = np.asarray(self.s[index, self._freq_slice(freq_range, units), i, j])
+        if scale == 'dB':
+            return complex_to_db(s_params)
+        elif scale == 'linear':
+            return s_params
+        else:
+            raise Exception('Invalid scale string input! Try "dB" or "linear"')
+
+    def impedance(self,
+                  s_to_get: str = '11',
+                  index: int|slice|list|np.ndarray = slice(None),
+                  freq_range: list = None,
+                  units: str = 'GHz') -> np.ndarray:
+        """Normalized impedance from one S-parameter for the selected networks and frequency window, see s_data."""
+        return impedance_from_s(self.s_data(s_to_get, scale='linear', index=index, freq_range=freq_range, units=units))
+
+    def to_dataset(self,
+                   index: int|slice|list|np.ndarray = slice(None),
+                   freq_range: list = None,
+                   units: str = 'GHz') -> SweepDataset:
+        """Load the selected networks and frequency window into memory as a SweepDataset."""
+        if isinstance(index, (int, np.integer)):
+            index = [index]
+        freq_slice = self._freq_slice(freq_range, units)
+        rows = np.arange(len(self))[index]
+        return SweepDataset(self.f[freq_slice], np.array(self.s[index, freq_slice]),
+                            params={name: col[index] for name, col in self.params.items()},
+                            names=[self.names[i] for i in rows])
+
+    def to_networks(self,
+                    index: int|slice|list|np.ndarray = slice(None),
+                    freq_range: list = None,
+                    units: str = 'GHz') -> list[skrf.network.Network]:
+        """Load the selected networks and frequency window as skrf networks, for example for plot_s_parameters."""
+        return self.to_dataset(index, freq_range, units).to_networks()
@@ -0,0 +1,360 @@
+# Module for an on-disk cache of parsed touchstone files, so that notebooks don't re-parse the same sweep every session.
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import skrf
+from ethanalysis.rf.touchstone import read_touchstone_comments, parse_cst_parameters, load_touchstone_network
+from ethanalysis.utils.instrument import add_bytes
+
+# Function to hash the contents of a file
+def hash_file(filepath: str,
+              chunk_size: int = 1 << 20) -> str:
+    """
+    Hash the contents of a file with blake2b.
+
+    Parameters
+    ----------
+    filepath : str
+        Filepath of the file to hash.
+    chunk_size : int, optional
+        Number of bytes to read at a time, by default 1 MiB
+
+    Returns
+    -------
+    str
+        Hex digest of the file contents.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+class NetworkCache:
+    """
+    Persistent on-disk cache of parsed touchstone files. For every file the frequency array (Hz), the complex S-matrix,
+    the port impedances and the CST parameter dictionary are stored. The arrays go into one uncompressed .npz file
+    per entry, and an index.json in the cache directory maps each filepath to its entry.
+
+    A lookup first compares the filepath, size and modification time of the file against the index, which only needs
+    an os.stat call. If those don't match, the contents are hashed, and a stored entry with the same hash is reused
+    (for example a copied or touched file). Only files whose contents are new get parsed. When the total
+    size of the stored entries goes over max_bytes, the least recently used entries are removed. get_params only reads
+    the header of a new file, its arrays are parsed the first time they are asked for.
+
+    The index is written to disk whenever a single get, get_params or load_network call adds or removes an entry, and
+    once at the end of get_many and load_networks. Entry files that are not in the index (left behind by a process
+    that stopped before writing it) are deleted when the cache is opened, but only once they are older than
+    orphan_seconds, since another process sharing the directory may be in the middle of a batch whose index is not
+    written yet. An entry whose file is missing counts as a miss and the touchstone file is parsed again.
+
+    With dtype=np.complex64 the S-matrices of new entries are stored in single precision, which halves the size of
+    the entries (so twice as many files fit in max_bytes), and get returns complex64 S-matrices. Every entry records
+    the precision it was stored in: a complex64 cache reuses complex128 entries and converts them when read, but a
+    complex128 cache parses the file again and replaces a complex64 entry, so it never returns data that only has
+    single precision. The frequency arrays stay float64.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory to store the cache in, by default '~/.cache/ethanalysis/networks'
+    max_bytes : int, optional
+        Maximum total size of the stored entries in bytes, by default 2 GiB
+    dtype : type, optional
+        Either np.complex128 or np.complex64 for the S-matrices, by default np.complex128
+    orphan_seconds : float, optional
+        Age in seconds after which entry files that are not in the index are deleted, by default one day. None never
+        deletes them.
+    """
+    def __init__(self,
+                 cache_dir: str = None,
+                 max_bytes: int = 2 << 30,
+                 dtype: type = np.complex128,
+                 orphan_seconds: float = 86400.0):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'ethanalysis', 'networks')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.complex64, np.complex128):
+            raise ValueError('dtype must be np.complex64 or np.complex128')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._index_path = os.path.join(self.cache_dir, 'index.json')
+        self._load_index()
+        if orphan_seconds is not None:
+            self._remove_orphans(orphan_seconds)
+        self._dirty = False
+        # Entries or filepaths were added or removed since the last save, and the nesting depth of get_many and
+        # load_networks, which save once at the end instead of after every file
+        self._changed = False
+        self._batch_depth = 0
+
+    # Index handling
+    def _load_index(self):
+        try:
+            with open(self._index_path, 'r') as file:
+                index = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+        # 'files' maps filepath -> (size, mtime_ns, hash), 'entries' maps hash -> entry info
+        self._files = index.get('files', {})
+        self._entries = index.get('entries', {})
+        self._total_bytes = sum(entry['bytes'] for entry in self._entries.values())
+
+    def _remove_orphans(self, orphan_seconds: float):
+        """Delete old entry files that are not in the index, they would never be evicted otherwise."""
+        # Only one process cleans up at a time, a lock file left behind by a crash is given up after orphan_seconds
+        lock_path = os.path.join(self.cache_dir, 'cleanup.lock')
+        try:
+            lock = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > orphan_seconds:
+                    os.remove(lock_path)
+            except OSError:
+                pass
+            return
+        try:
+            now = time.time()
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.npz') and entry.name[:-4] not in self._entries:
+                    try:
+                        if now - entry.stat().st_mtime > orphan_seconds:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
+        finally:
+            os.close(lock)
+            os.remove(lock_path)
+
+    def save(self):
+        """Write the index to disk if anything changed. This is called automatically by get_many and load_networks."""
+        if not self._dirty:
+            return
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'files': self._files, 'entries': self._entries}, file)
+        os.replace(tmp_path, self._index_path)
+        self._dirty = False
+        self._changed = False
+
+    def _save_if_changed(self):
+        if self._batch_depth == 0 and self._changed:
+            self.save()
+
+    def _entry_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, f'{content_hash}.npz')
+
+    @property
+    def size_bytes(self) -> int:
+        """Total size of the stored entries in bytes."""
+        return self._total_bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        for content_hash in list(self._entries):
+            self._remove_entry(content_hash)
+        self._files = {}
+        self._dirty = True
+        self.save()
+
+    # Entry handling
+    def _remove_entry(self, content_hash: str):
+        entry = self._entries.pop(content_hash, None)
+        if entry is not None:
+            self._total_bytes -= entry['bytes']
+        try:
+            os.remove(self._entry_path(content_hash))
+        except FileNotFoundError:
+            pass
+        self._dirty = True
+        self._changed = True
+
+    def _evict(self, keep: str = None):
+        if self._total_bytes <= self.max_bytes:
+            return
+        # remove the least recently used entries first, but never the entry that was just accessed
+        for content_hash in sorted(self._entries, key=lambda h: self._entries[h]['last_access']):
+            # entries with only the parameters take no space
+            if content_hash == keep or self._entries[content_hash]['bytes'] == 0:
+                continue
+            self._remove_entry(content_hash)
+            if self._total_bytes <= self.max_bytes:
+                break
+        self._files = {path: key for path, key in self._files.items() if key[2] in self._entries}
+
+    def _store_params(self, filepath: str, content_hash: str):
+        try:
+            params = parse_cst_parameters(read_touchstone_comments(filepath))
+        except (IndexError, ValueError):
+            params = {}
+        # An entry without arrays, only the header was read
+        self._entries[content_hash] = {'bytes': 0, 'last_access': time.time(), 'params': params, 'arrays': False}
+        self._changed = True
+
+    def _store(self, filepath: str, content_hash: str):
+        network = load_touchstone_network(filepath)
+        try:
+            params = parse_cst_parameters(read_touchstone_comments(filepath))
+        except (IndexError, ValueError):
+            params = {}
+        entry_path = self._entry_path(content_hash)
+        with open(entry_path, 'wb') as file:
+            np.savez(file, f=network.f, s=network.s.astype(self.dtype, copy=False), z0=network.z0)
+        self._entries[content_hash] = {'bytes': os.path.getsize(entry_path),
+                                       'last_access': time.time(),
+                                       'params': params,
+                                       'name': network.name,
+                                       'unit': network.frequency.unit,
+                                       'dtype': self.dtype.str}
+        self._total_bytes += self._entries[content_hash]['bytes']
+        self._changed = True
+
+    def _has_arrays(self, entry: dict) -> bool:
+        """Return True if entry has arrays at least as precise as the dtype of the cache."""
+        if not entry.get('arrays', True):
+            return False
+        # Entries from before the precision was recorded may be complex64
+        return np.dtype(entry.get('dtype', '<c8')).itemsize >= self.dtype.itemsize
+
+    def _lookup(self, filepath: str, arrays: bool = True) -> str:
+        """
+        Return the content hash of the cache entry for filepath, parsing and storing the file if needed. With
+        arrays=False a new file only gets its header read.
+        """
+        filepath = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        key = self._files.get(filepath)
+        if key is not None and key[0] == stat.st_size and key[1] == stat.st_mtime_ns and key[2] in self._entries:
+            content_hash = key[2]
+        else:
+            content_hash = hash_file(filepath)
+            self._files[filepath] = [stat.st_size, stat.st_mtime_ns, content_hash]
+            self._changed = True
+        entry = self._entries.get(content_hash)
+        if entry is None and not arrays:
+            self._store_params(filepath, content_hash)
+        elif entry is None or (arrays and (not self._has_arrays(entry)
+                                           or not os.path.exists(self._entry_path(content_hash)))):
+            if entry is not None:
+                self._remove_entry(content_hash)
+            self._store(filepath, content_hash)
+        self._entries[content_hash]['last_access'] = time.time()
+        self._dirty = True
+        return content_hash
+
+    # Public access
+    def get(self, filepath: str) -> tuple[np.ndarray, np.ndarray, dict]:
+        """
+        Get the parsed data of a touchstone file, parsing it only if it is not already in the cache.
+
+        Parameters
+        ----------
+        filepath : str
+            Filepath of the touchstone file.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray, dict]
+            Frequency array in Hz, complex S-matrix of shape (F, P, P) in the dtype of the cache, and the CST parameter
+            dictionary (empty if the file has no CST parameters).
+        """
+        content_hash = self._lookup(filepath)
+        with np.load(self._entry_path(content_hash)) as data:
+            f, s = data['f'], data['s'].astype(self.dtype, copy=False)
+        add_bytes(f.nbytes + s.nbytes)
+        self._evict(keep=content_hash)
+        self._save_if_changed()
+        return f, s, dict(self._entries[content_hash]['params'])
+
+    def get_params(self, filepath: str) -> dict:
+        """
+        Get the CST parameter dictionary of a touchstone file. On a hit this only reads the index, and on a miss only
+        the header of the file is read.
+
+        Parameters
+        ----------
+        filepath : str
+            Filepath of the touchstone file.
+
+        Returns
+        -------
+        dict
+            Dictionary containing the parameters and their values.
+        """
+        content_hash = self._lookup(filepath, arrays=False)
+        self._evict(keep=content_hash)
+        self._save_if_changed()
+        return dict(self._entries[content_hash]['params'])
+
+    def get_many(self, filepaths: list[str]) -> list[tuple[np.ndarray, np.ndarray, dict]]:
+        """
+        Same as get for a list of filepaths. The index is written to disk once at the end.
+
+        Parameters
+        ----------
+        filepaths : list[str]
+            List of filepaths of the touchstone files.
+
+        Returns
+        -------
+        list[tuple[np.ndarray, np.ndarray, dict]]
+            List of (frequency, S-matrix, parameters) for each file, in the order of the input.
+        """
+        self._batch_depth += 1
+        try:
+            return [self.get(filepath) for filepath in filepaths]
+        finally:
+            self._batch_depth -= 1
+            self.save()
+
+    def load_network(self, filepath: str) -> skrf.network.Network:
+        """
+        Get a skrf.Network for a touchstone file from the cache.
+
+        Parameters
+        ----------
+        filepath : str
+            Filepath of the touchstone file.
+
+        Returns
+        -------
+        skrf.network.Network
+            Network built from the cached arrays.
+        """
+        content_hash = self._lookup(filepath)
+        entry = self._entries[content_hash]
+        with np.load(self._entry_path(content_hash)) as data:
+            frequency = skrf.Frequency.from_f(data['f'], unit='hz')
+            frequency.unit = entry['unit']
+            network = skrf.Network(frequency=frequency, s=data['s'], z0=data['z0'], name=entry['name'])
+        add_bytes(network.f.nbytes + network.s.nbytes)
+        self._evict(keep=content_hash)
+        self._save_if_changed()
+        return network
+
+    def load_networks(self, filepaths: list[str]) -> list[skrf.network.Network]:
+        """
+        Same as load_network for a list of filepaths. The index is written to disk once at the end.
+
+        Parameters
+        ----------
+        filepaths : list[str]
+            List of filepaths of the touchstone files.
+
+        Returns
+        -------
+        list[skrf.network.Network]
+            List of networks in the order of the input.
+        """
+        self._batch_depth += 1
+        try:
+            return [self.load_network(filepath) for filepath in filepaths]
+        finally:
+            self._batch_depth -= 1
+            self.save()
@@ -0,0 +1,173 @@
+# Module for streaming a whole sweep directory through the analysis one file at a time. Nothing is kept in memory
+# except the files currently being processed, so the size of the sweep is only limited by the disk.
+import os
+import glob
+import fnmatch
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+import numpy as np
+import skrf
+from ethanalysis.rf.touchstone import load_touchstone_network
+from ethanalysis.rf.rf import get_freq, get_s_data, get_params_dict_from_touchstone, impedance_from_s
+from ethanalysis.fitting.main import fit_s11_resonance_dip, guess_fit_range
+from ethanalysis.fitting.batch import fit_s11_resonance_dips
+from ethanalysis.utils.main import truncate_data
+
+# Function to list the touchstone files of a sweep
+def iter_touchstone_files(source: str|list[str],
+                          pattern: str = '*.s*p') -> Iterator[str]:
+    """
+    Yield the touchstone filepaths of a sweep, sorted by filepath. Nothing is opened.
+
+    Parameters
+    ----------
+    source : str|list[str]
+        A directory, a glob pattern (like 'sweep/*.s2p'), or a list of filepaths.
+    pattern : str, optional
+        Filename pattern used when source is a directory, by default '*.s*p'
+
+    Yields
+    ------
+    str
+        Filepath of each touchstone file.
+    """
+    if isinstance(source, str):
+        if os.path.isdir(source):
+            yield from sorted(entry.path for entry in os.scandir(source)
+                              if entry.is_file() and fnmatch.fnmatch(entry.name.lower(), pattern.lower()))
+        else:
+            yield from sorted(glob.glob(source))
+    else:
+        yield from source
+
+# Function to analyse a single touchstone file into a result record
+def process_touchstone_file(filepath: str,
+                            fit_range: list|str = 'all',
+                            fit_method: str = 'lmfit',
+                            network: skrf.network.Network = None) -> dict:
+    """
+    Run the per-file analysis of a sweep: read the CST parameters, load the S-data, truncate it to the frequency
+    window, fit the S11 dip, and read the impedance at the fitted resonance. Errors are returned in the record instead
+    of being raised, so that one bad file doesn't stop a whole sweep.
+
+    Parameters
+    ----------
+    filepath : str
+        Filepath of the touchstone file.
+    fit_range : list|str, optional
+        Frequency window (in GHz) to analyse and fit, by default 'all'. Otherwise a list of the form [min, max], or
+        'auto' for a few linewidths around the S11 dip (see guess_fit_range).
+    fit_method : str, optional
+        Either 'lmfit' (fit_s11_resonance_dip) or 'vectorized' (fit_s11_resonance_dips on the single trace), by
+        default 'lmfit'
+    network : skrf.network.Network, optional
+        Already loaded network of the file, by default None which loads it from filepath.
+
+    Returns
+    -------
+    dict
+        Record with the keys 'filepath', 'params' (the CST parameter dictionary), 'center' (GHz), 'sigma', 'q_factor',
+        'chisqr', 'nfev' (number of function evaluations of the fit), 'success', 'min_s11_db', 'min_s11_freq' (GHz),
+        'z_real' and 'z_imag' (normalized impedance at the fitted center), and 'error' (None, or the message if
+        something failed).
+    """
+    record = {'filepath': filepath, 'params': {}, 'center': np.nan, 'sigma': np.nan, 'q_factor': np.nan,
+              'chisqr': np.nan, 'nfev': 0, 'success': False, 'min_s11_db': np.nan, 'min_s11_freq': np.nan,
+              'z_real': np.nan, 'z_imag': np.nan, 'error': None}
+    try:
+        try:
+            record['params'] = get_params_dict_from_touchstone(filepath)
+        except (IndexError, ValueError):
+            pass
+        if network is None:
+            network = load_touchstone_network(filepath)
+        freq = get_freq(network, units='GHz')
+        s11_db = get_s_data(network, '11', scale='dB')
+        if fit_range == 'auto':
+            freq, s11_db = truncate_data(freq, s11_db, guess_fit_range(freq, s11_db), assume_sorted=True)
+        elif isinstance(fit_range, list):
+            freq, s11_db = truncate_data(freq, s11_db, fit_range, assume_sorted=True)
+        elif fit_range != 'all':
+            raise ValueError('The fit range is not valid. The only strings allowed are \'all\' and \'auto\'.')
+        min_index = np.argmin(s11_db)
+        record['min_s11_db'], record['min_s11_freq'] = float(s11_db[min_index]), float(freq[min_index])
+
+        if fit_method == 'lmfit':
+            result, q_factor, _ = fit_s11_resonance_dip(freq, s11_db, fit_range='all')
+            record.update(center=result.params['l_center'].value, sigma=result.params['l_sigma'].value,
+                          q_factor=float(q_factor), chisqr=result.chisqr, nfev=result.nfev, success=bool(result.success))
+        elif fit_method == 'vectorized':
+            result = fit_s11_resonance_dips(freq, s11_db[None, :])
+            record.update({key: result[key][0].item() for key in ('center', 'sigma', 'q_factor', 'chisqr', 'success')})
+            # One evaluation of the model per Levenberg-Marquardt step, plus the starting point
+            record['nfev'] = int(result['iterations'][0]) + 1
+        else:
+            raise ValueError('Invalid fit_method string input! Try "lmfit" or "vectorized"')
+
+        # Impedance at the point of the full trace closest to the fitted center
+        full_freq = get_freq(network, units='GHz')
+        center_index = min(int(np.searchsorted(full_freq, record['center'])), len(full_freq) - 1)
+        if center_index > 0 and abs(full_freq[center_index - 1] - record['center']) < abs(full_freq[center_index] - record['center']):
+            center_index -= 1
+        z = impedance_from_s(get_s_data(network, '11', scale='linear')[center_index])
+        record['z_real'], record['z_imag'] = float(z.real), float(z.imag)
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+    return record
+
+# Worker for stream_sweep. Needs to live at the module level so it can be pickled for a process pool.
+def _process_task(task: tuple) -> dict:
+    return process_touchstone_file(*task)
+
+# Function to stream the analysis of a whole sweep
+def stream_sweep(source: str|list[str],
+                 fit_range: list|str = 'all',
+                 fit_method: str = 'lmfit',
+                 pattern: str = '*.s*p',
+                 max_workers: int = None,
+                 max_in_flight: int = None) -> Iterator[dict]:
+    """
+    Lazily analyse every touchstone file of a sweep and yield one result record per file (see
+    process_touchstone_file), in the order of the files. Files are listed, loaded, fit and dropped one window at a
+    time, so memory is bounded by the number of files in flight, not by the size of the sweep.
+
+    Parameters
+    ----------
+    source : str|list[str]
+        A directory, a glob pattern (like 'sweep/*.s2p'), or a list of filepaths.
+    fit_range : list|str, optional
+        Frequency window (in GHz) to analyse and fit, by default 'all'. Otherwise a list of the form [min, max], or
+        'auto' for a few linewidths around the S11 dip (see guess_fit_range).
+    fit_method : str, optional
+        Either 'lmfit' or 'vectorized', see process_touchstone_file. By default 'lmfit'
+    pattern : str, optional
+        Filename pattern used when source is a directory, by default '*.s*p'
+    max_workers : int, optional
+        Number of worker processes. By default None, which processes the files one after another in this process.
+    max_in_flight : int, optional
+        Maximum number of files submitted to the workers but not yet yielded, by default 2*max_workers
+
+    Yields
+    ------
+    dict
+        Result record of each file.
+    """
+    filepaths = iter_touchstone_files(source, pattern)
+    if max_workers is None or max_workers <= 1:
+        for filepath in filepaths:
+            yield process_touchstone_file(filepath, fit_range, fit_method)
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 2 * max_workers
+    max_in_flight = max(max_in_flight, 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = deque()
+        for filepath in filepaths:
+            in_flight.append(pool.submit(_process_task, (filepath, fit_range, fit_method)))
+            # Wait for the oldest file before submitting more, which keeps the output in order
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
@@ -0,0 +1,203 @@
+# Module for rendering the summary figures of many network groups (for example one figure per design of a sweep)
+# straight to disk. The figures are rendered with the non-interactive Agg backend in worker processes, and every
+# figure is closed as soon as it is saved so that long runs don't keep thousands of figures in memory.
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import skrf
+from ethanalysis.rf.rf import get_networks, get_params_dict_from_touchstone, plot_s11_and_impedance, plot_s_parameters
+from ethanalysis.rf.pipeline import iter_touchstone_files
+
+# Function to group the touchstone files of a sweep by their CST parameters
+def group_touchstone_files(source: str|list[str],
+                           by: str|list[str],
+                           pattern: str = '*.s*p') -> dict:
+    """
+    Group the touchstone files of a sweep by the value of one or more CST parameters, for example to make one figure
+    per design. Files without the parameter(s) are skipped.
+
+    Parameters
+    ----------
+    source : str|list[str]
+        A directory, a glob pattern (like 'sweep/*.s2p'), or a list of filepaths.
+    by : str|list[str]
+        Name of the parameter to group by, or a list of names.
+    pattern : str, optional
+        Filename pattern used when source is a directory, by default '*.s*p'
+
+    Returns
+    -------
+    dict
+        Dictionary mapping each parameter value (a tuple of values if by is a list) to the list of its filepaths.
+    """
+    groups = {}
+    for filepath in iter_touchstone_files(source, pattern):
+        try:
+            params = get_params_dict_from_touchstone(filepath)
+        except (IndexError, ValueError):
+            continue
+        if isinstance(by, str):
+            if by not in params:
+                continue
+            key = params[by]
+        else:
+            if any(name not in params for name in by):
+                continue
+            key = tuple(params[name] for name in by)
+        groups.setdefault(key, []).append(filepath)
+    return groups
+
+# Function to render one figure to disk
+def render_figure(networks: str|skrf.network.Network|list[str|skrf.network.Network],
+                  paths: str|list[str],
+                  kind: str = 's11_and_impedance',
+                  dpi: int = 150,
+                  **plot_kwargs) -> list[str]:
+    """
+    Make one figure with plot_s11_and_impedance or plot_s_parameters, save it, and close it. Nothing is shown.
+
+    Parameters
+    ----------
+    networks : str|skrf.network.Network|list[str|skrf.network.Network]
+        Networks of the figure, anything get_networks accepts.
+    paths : str|list[str]
+        Filepath(s) to save the figure to, the format is picked from the extension (for example .png or .pdf).
+    kind : str, optional
+        Either 's11_and_impedance' or 's_parameters', by default 's11_and_impedance'
+    dpi : int, optional
+        Resolution of raster formats, by default 150
+    **plot_kwargs
+        Passed through to the plotting function.
+
+    Returns
+    -------
+    list[str]
+        Filepaths of the saved figure.
+    """
+    import matplotlib.pyplot as plt
+    if isinstance(paths, str):
+        paths = [paths]
+    networks = get_networks(networks)
+    if len(networks) == 0:
+        raise ValueError('None of the networks of the figure could be loaded.')
+    if kind == 's11_and_impedance':
+        fig, _ = plot_s11_and_impedance(networks, **plot_kwargs)
+    elif kind == 's_parameters':
+        fig = plot_s_parameters(networks, show_plot=False, **plot_kwargs)[0]
+    else:
+        raise ValueError('Invalid kind string input! Try "s11_and_impedance" or "s_parameters"')
+    try:
+        for path in paths:
+            # The legends are drawn outside of the axes, so let the saved figure grow to fit them
+            fig.savefig(path, dpi=dpi, bbox_inches='tight')
+    finally:
+        plt.close(fig)
+    return paths
+
+# Worker setup and task for render_report. Need to live at the module level so they can be pickled for a process pool.
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+def _render_task(task: tuple) -> dict:
+    name, networks, paths, kind, dpi, plot_kwargs = task
+    start = time.perf_counter()
+    record = {'name': name, 'files': [], 'error': None, 'elapsed': 0.0}
+    try:
+        record['files'] = render_figure(networks, paths, kind=kind, dpi=dpi, **plot_kwargs)
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+    record['elapsed'] = time.perf_counter() - start
+    return record
+
+# Function to turn a group name into a filename
+def _figure_filename(name) -> str:
+    if isinstance(name, tuple):
+        name = '_'.join(str(value) for value in name)
+    return re.sub(r'[^\w.=-]+', '_', str(name)).strip('_') or 'figure'
+
+# Function to render the figures of many network groups
+def render_report(groups: dict|list,
+                  output_dir: str,
+                  kind: str = 's11_and_impedance',
+                  formats: str|list[str] = 'png',
+                  dpi: int = 150,
+                  max_workers: int = None,
+                  max_in_flight: int = None,
+                  max_tasks_per_child: int = 50,
+                  verbose: bool = False,
+                  **plot_kwargs) -> list[dict]:
+    """
+    Render one figure per group of networks (see render_figure) into output_dir, in parallel worker processes that use
+    the non-interactive Agg backend. A figure that fails to render is reported in its record instead of stopping the
+    run.
+
+    Parameters
+    ----------
+    groups : dict|list
+        Dictionary mapping each figure name to its networks (for example from group_touchstone_files), or a list of
+        network groups that are named by their index. Filepaths are cheaper to send to the workers than networks.
+    output_dir : str
+        Directory to save the figures in, created if it doesn't exist. The files are named after the groups.
+    kind : str, optional
+        Either 's11_and_impedance' or 's_parameters', by default 's11_and_impedance'
+    formats : str|list[str], optional
+        File format(s) of each figure, for example 'png' or ['png', 'pdf']. By default 'png'
+    dpi : int, optional
+        Resolution of raster formats, by default 150
+    max_workers : int, optional
+        Number of worker processes. By default None, which renders the figures one after another in this process,
+        after switching it to the Agg backend (which closes any open figures).
+    max_in_flight : int, optional
+        Maximum number of figures submitted to the workers but not yet finished, by default 2*max_workers
+    max_tasks_per_child : int, optional
+        Number of figures a worker renders before it is replaced by a fresh one, by default 50. This keeps any memory
+        that matplotlib holds on to from building up over long runs. None keeps the workers for the whole run.
+    verbose : bool, optional
+        Print a line for every finished figure, by default False
+    **plot_kwargs
+        Passed through to the plotting function, for example nets_to_fit='all' or fast=True.
+
+    Returns
+    -------
+    list[dict]
+        One record per group, in order, with the keys 'name', 'files' (the saved filepaths), 'error' (None, or the
+        message if it failed), and 'elapsed' (seconds).
+    """
+    if not isinstance(groups, dict):
+        groups = dict(enumerate(groups))
+    if isinstance(formats, str):
+        formats = [formats]
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(name, networks, [os.path.join(output_dir, f'{_figure_filename(name)}.{format}') for format in formats],
+              kind, dpi, plot_kwargs) for name, networks in groups.items()]
+
+    records = []
+    def finish(record):
+        records.append(record)
+        if verbose:
+            status = 'failed: ' + record['error'] if record['error'] else f'{record["elapsed"]:.2f} s'
+            print(f'{len(records)}/{len(tasks)} {record["name"]} {status}')
+
+    if max_workers is None or max_workers <= 1:
+        _use_agg()
+        for task in tasks:
+            finish(_render_task(task))
+        return records
+
+    if max_in_flight is None:
+        max_in_flight = 2 * max_workers
+    max_in_flight = max(max_in_flight, 1)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_use_agg,
+                             max_tasks_per_child=max_tasks_per_child) as pool:
+        in_flight = deque()
+        for task in tasks:
+            in_flight.append(pool.submit(_render_task, task))
+            # Wait for the oldest figure before submitting more, which keeps the records in order
+            if len(in_flight) >= max_in_flight:
+                finish(in_flight.popleft().result())
+        while in_flight:
+            finish(in_flight.popleft().result())
+    return records
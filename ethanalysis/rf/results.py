@@ -0,0 +1,196 @@
+# Module for collecting the results of a sweep into one columnar table and saving it, so that the results can be
+# looked at (or put in a dashboard) without parsing the touchstone files again.
+# pandas (and pyarrow, which pandas uses for parquet and feather files) are imported when a table is made.
+import os
+from typing import Iterable
+from ethanalysis.rf.pipeline import stream_sweep
+
+# Result columns of the records from process_touchstone_file, in the order they go in the table
+result_columns = ['filepath', 'center', 'sigma', 'q_factor', 'chisqr', 'nfev', 'success', 'min_s11_db', 'min_s11_freq',
+                  'z_real', 'z_imag', 'error']
+
+# Function to turn sweep records into a table
+def records_to_table(records: Iterable[dict]) -> 'pd.DataFrame':
+    """
+    Turn result records (from stream_sweep or process_touchstone_file) into a table with one row per file. The CST
+    parameters become their own columns, converted to numbers where possible. A parameter that has the same name as
+    a result column gets the prefix 'param_'.
+
+    Parameters
+    ----------
+    records : Iterable[dict]
+        Result records, see process_touchstone_file.
+
+    Returns
+    -------
+    pd.DataFrame
+        Table with the result columns followed by one column per CST parameter.
+    """
+    import pandas as pd
+    rows = []
+    for record in records:
+        row = {key: record.get(key) for key in result_columns}
+        for name, value in record.get('params', {}).items():
+            row[f'param_{name}' if name in result_columns else name] = value
+        rows.append(row)
+    table = pd.DataFrame(rows, columns=None if rows else result_columns)
+    for column in table.columns[len(result_columns):]:
+        try:
+            table[column] = pd.to_numeric(table[column])
+        except (ValueError, TypeError):
+            pass
+    return table
+
+# Function to get the format of a results file
+def _results_format(path: str,
+                    format: str = None) -> str:
+    if format is None:
+        extension = os.path.splitext(path)[1].lower()
+        format = {'.feather': 'feather', '.arrow': 'feather', '.parquet': 'parquet', '': 'parquet'}.get(extension)
+        if format is None:
+            raise ValueError(f'Cannot tell the format of {path}. Use a .parquet or .feather path, or pass format.')
+    if format not in ('parquet', 'feather'):
+        raise ValueError('Invalid format string input! Try "parquet" or "feather"')
+    return format
+
+# Function to get the numbered part files of a parquet results directory
+def _parquet_parts(path: str) -> dict[int, str]:
+    parts = {}
+    for name in os.listdir(path):
+        if name.startswith('part-') and name.endswith('.parquet'):
+            try:
+                parts[int(name[len('part-'):-len('.parquet')])] = name
+            except ValueError:
+                continue
+    return dict(sorted(parts.items()))
+
+# Function to save a results table
+def write_results_table(table: 'pd.DataFrame',
+                        path: str,
+                        format: str = None,
+                        append: bool = True) -> str:
+    """
+    Save a results table in a columnar format. Parquet tables are stored as a directory of part files: appending
+    writes a new part file next to the existing ones, so it costs time proportional to the new rows only. Feather is
+    a single file, so appending to it reads and rewrites the whole table.
+
+    Parameters
+    ----------
+    table : pd.DataFrame
+        Results table, see records_to_table.
+    path : str
+        Directory of the parquet dataset, or the .feather file. A path ending in .parquet or without an extension is
+        a parquet directory.
+    format : str, optional
+        Either 'parquet' or 'feather', by default None which picks it from the extension of path.
+    append : bool, optional
+        Add the rows to an existing table at path, by default True. Otherwise the existing table is replaced.
+
+    Returns
+    -------
+    str
+        Filepath of the file that was written.
+    """
+    import pandas as pd
+    format = _results_format(path, format)
+    table = table.reset_index(drop=True)
+    if format == 'parquet':
+        if not append and os.path.isdir(path):
+            for name in _parquet_parts(path).values():
+                os.remove(os.path.join(path, name))
+        os.makedirs(path, exist_ok=True)
+        # Number the new part after the highest existing one, so a gap in the numbering never overwrites a part
+        parts = _parquet_parts(path)
+        filepath = os.path.join(path, f'part-{max(parts, default=-1) + 1:05d}.parquet')
+        table.to_parquet(filepath, index=False)
+    else:
+        if append and os.path.exists(path):
+            table = pd.concat([pd.read_feather(path), table], ignore_index=True)
+        filepath = path
+        table.to_feather(filepath)
+    return filepath
+
+# Function to read a saved results table
+def read_results_table(path: str,
+                       format: str = None,
+                       columns: list[str] = None) -> 'pd.DataFrame':
+    """
+    Read a results table saved with write_results_table.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the parquet dataset, or the .feather file.
+    format : str, optional
+        Either 'parquet' or 'feather', by default None which picks it from the extension of path.
+    columns : list[str], optional
+        Only read these columns, by default None which reads all of them.
+
+    Returns
+    -------
+    pd.DataFrame
+        The results table.
+    """
+    import pandas as pd
+    format = _results_format(path, format)
+    if format == 'parquet':
+        parts = [os.path.join(path, name) for name in _parquet_parts(path).values()]
+        if not parts:
+            return pd.DataFrame(columns=columns if columns is not None else result_columns)
+        return pd.concat([pd.read_parquet(part, columns=columns) for part in parts], ignore_index=True)
+    return pd.read_feather(path, columns=columns)
+
+# Function to analyse a whole sweep into one table
+def sweep_results_table(source: str|list[str],
+                        fit_range: list|str = 'all',
+                        fit_method: str = 'lmfit',
+                        path: str = None,
+                        format: str = None,
+                        chunk_size: int = 500,
+                        max_workers: int = None,
+                        pattern: str = '*.s*p') -> 'pd.DataFrame':
+    """
+    Analyse every touchstone file of a sweep (see stream_sweep) and collect the results into one table with one row
+    per file: the CST parameters, the fitted center and Q, the minimum S11, and the impedance at resonance. If a path
+    is given, the rows are appended to the saved table every chunk_size files while the sweep is processed.
+
+    Parameters
+    ----------
+    source : str|list[str]
+        A directory, a glob pattern (like 'sweep/*.s2p'), or a list of filepaths.
+    fit_range : list|str, optional
+        Frequency window (in GHz) to analyse and fit, by default 'all'. Otherwise a list of the form [min, max], or
+        'auto' for a few linewidths around the S11 dip (see guess_fit_range).
+    fit_method : str, optional
+        Either 'lmfit' or 'vectorized', see process_touchstone_file. By default 'lmfit'
+    path : str, optional
+        Where to append the table, see write_results_table. By default None, which doesn't save it.
+    format : str, optional
+        Either 'parquet' or 'feather', by default None which picks it from the extension of path.
+    chunk_size : int, optional
+        Number of files between appends to the saved table, by default 500
+    max_workers : int, optional
+        Number of worker processes, see stream_sweep. By default None
+    pattern : str, optional
+        Filename pattern used when source is a directory, by default '*.s*p'
+
+    Returns
+    -------
+    pd.DataFrame
+        Table of the results of the sweep.
+    """
+    import pandas as pd
+    tables, chunk = [], []
+    for record in stream_sweep(source, fit_range=fit_range, fit_method=fit_method, pattern=pattern,
+                               max_workers=max_workers):
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            tables.append(records_to_table(chunk))
+            if path is not None:
+                write_results_table(tables[-1], path, format=format)
+            chunk = []
+    if chunk or not tables:
+        tables.append(records_to_table(chunk))
+        if path is not None and chunk:
+            write_results_table(tables[-1], path, format=format)
+    return pd.concat(tables, ignore_index=True)
@@ -1,13 +1,21 @@
 # importing necessary modules
+# matplotlib is imported inside the plotting functions so that importing this module for the numeric helpers (for
+# example in process pool workers) doesn't pay for loading it
 import skrf
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.axes
-import pandas as pd
+import os
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from typing import Callable, Any, Iterable
-from ethanalysis.fitting.main import fit_s11_resonance_dip
+from ethanalysis.fitting.main import fit_s11_resonance_dip, fit_s11_resonance_dips_parallel
 from ethanalysis.utils.colors import get_color_list, get_color
-from matplotlib.lines import Line2D
+from ethanalysis.rf.touchstone import read_touchstone_comments, parse_cst_parameters, load_touchstone_network
+from ethanalysis.rf.cache import NetworkCache
+from ethanalysis.utils.main import minmax_decimate, get_range_slice
+from ethanalysis.utils.instrument import instrumented
 
 #TODO: Move this to the colors library
 colors = ['cyan', 'orange', 'lime', 'violet', 'pink', 'yellow', 'blue', 'grape', 'green', 'gray']
@@ -16,28 +24,29 @@ fitting_colors = get_color_list(colors, 2)
 plot_colors = get_color_list(colors, 4)
 
 # Function to get parameters dictionary from a touchstone file
-def get_params_dict_from_touchstone(filepath: str) -> dict:
+@instrumented('load')
+def get_params_dict_from_touchstone(filepath: str,
+                                    cache: NetworkCache = None) -> dict:
     """
     Get simulation parameters from a touchstone file saved from a CST simulation. CST saves the design parameters in a comment
-    at the top of the file, which is useful to grab if you are performing a parameter sweep!
+    at the top of the file, which is useful to grab if you are performing a parameter sweep! Only the comment block at
+    the top of the file is read, so this is fast even for large files.
     
     Parameters
     ----------
     filepath : str
         String containing the filepath of the touchstone file.
+    cache : NetworkCache, optional
+        Cache to read the parameters from (and store them in), by default None
         
     Returns
     -------
     dict
         Dictionary containing the parameters and their values.
     """
-    test_file = skrf.Touchstone(filepath)
-    parameters = test_file.comments.split('\n')[3].split(' = ')[1][1:-1]
-    par_dict = dict((x.strip(), y.strip())
-                    for x, y in (element.split('=')
-                    for element in parameters.split('; '))
-                    )
-    return par_dict
+    if cache is not None:
+        return cache.get_params(filepath)
+    return parse_cst_parameters(read_touchstone_comments(filepath))
 
 # Function to get an array of a chosen parameter from an array of touchstone filepaths.
 def get_param_array_from_touchstones(filepaths: str|list[str]|np.ndarray,
@@ -67,23 +76,93 @@ def get_param_array_from_touchstones(filepaths: str|list[str]|np.ndarray,
 
     return [float(param[parameter]) for param in [get_params_dict_from_touchstone(file) for file in filepaths]]
 
+# Function to turn an S-parameter string into the port indices of the S matrix
+def get_s_indices(s_to_get: str,
+                  n_ports: int = None) -> tuple[int, int]:
+    """
+    Convert an S-parameter string, like '21', into the zero-based (row, column) indices of the S matrix. For networks
+    with 10 or more ports the two port numbers can be separated by a comma, like '1,10'. A leading 'S' is allowed.
+
+    Parameters
+    ----------
+    s_to_get : str
+        String containing the S-parameter, for example '11', '21', 'S34', or '10,2'.
+    n_ports : int, optional
+        Number of ports of the network, used to check that the indices are valid, by default None
+
+    Returns
+    -------
+    tuple[int, int]
+        Zero-based (row, column) indices of the S-parameter.
+
+    Raises
+    ------
+    Exception
+        s_to_get argument is not a valid S-parameter string.
+    """
+    s_string = str(s_to_get).strip().lstrip('Ss')
+    if ',' in s_string:
+        ports = s_string.split(',')
+    elif len(s_string) == 2:
+        ports = [s_string[0], s_string[1]]
+    else:
+        ports = []
+    try:
+        i, j = (int(port) - 1 for port in ports)
+    except ValueError:
+        i, j = -1, -1
+    if len(ports) != 2 or i < 0 or j < 0 or (n_ports is not None and (i >= n_ports or j >= n_ports)):
+        raise Exception(f'No valid string was passed through s_to_get ({s_to_get}). Try 11, 12, 21, 22, or "i,j" for '
+                        'networks with 10 or more ports')
+    return i, j
+
+# Function to convert complex S data to dB
+def complex_to_db(s_params: np.ndarray,
+                  out: np.ndarray = None) -> np.ndarray:
+    """
+    Convert complex S-parameter data to dB, 20*log10(|s|), the same as skrf's s_db. A magnitude of zero gives -inf.
+
+    Parameters
+    ----------
+    s_params : np.ndarray
+        Complex S-parameter data.
+    out : np.ndarray, optional
+        Preallocated real array with the same shape as s_params to write the result into, by default None
+
+    Returns
+    -------
+    np.ndarray
+        Real array of the data in dB (out, if it was given).
+    """
+    out = np.abs(s_params, out=out)
+    with np.errstate(divide='ignore'):
+        np.log10(out, out=out)
+    out *= 20
+    return out
+
 # Function to get the specific S-data given a string input
+@instrumented('derive')
 def get_s_data(network: skrf.network.Network,
                s_to_get: str = '11',
-               scale: str = 'dB') -> np.ndarray:
+               scale: str = 'dB',
+               out: np.ndarray = None) -> np.ndarray:
     """
     Function to input a network and string of which S-paramter data to grab, '11' for example, and output the numpy
     array corresponding to that s-paramter. This is in terms of dB by default, but can also be given in linear terms via
-    the scale argument.
+    the scale argument. Only the requested port pair is converted, so the cost doesn't grow with the number of ports.
 
     Parameters
     ----------
     network : skrf.network.Network
         Skrf network which has the s data that you want to access.
     s_to_get : str
-        String containing the S-parameter to access, either '11', '12', '21', or '22'.
+        String containing the S-parameter to access, for example '11', '12', '21', or '22'. Any port pair of an N-port
+        network works, see get_s_indices (use 'i,j' for ports 10 and up).
     scale : str, optional
         String denoting the scale you want the data to be in, either 'dB' or 'linear' for now, by default 'dB'
+    out : np.ndarray, optional
+        Preallocated array of shape (F,) to write the data into, real for 'dB' and complex for 'linear'. By default
+        None, in which case the 'linear' data is a view into network.s and the 'dB' data is a new array.
 
     Returns
     -------
@@ -95,29 +174,25 @@ def get_s_data(network: skrf.network.Network,
     Exception
         Argument for scale is not in the list of valid strings. 
     Exception
-        s_to_get argument is not in the list of valid strings.
+        s_to_get argument is not a valid S-parameter for the network.
     """    
+    # Pick out the port pair first, so that only that data is converted
+    i, j = get_s_indices(s_to_get, network.s.shape[1])
+    s_params = network.s[:, i, j]
     # Get s parameters in terms of the scale you want
     if scale == 'dB':
-        s_params = network.s_db
+        return complex_to_db(s_params, out=out)
     elif scale == 'linear':
-        s_params = network.s
+        if out is None:
+            return s_params
+        out[...] = s_params
+        return out
     else:
         raise Exception('Invalid scale string input! Try "dB" or "linear"')
-    # go through all possible options
-    if s_to_get in '11':
-        return s_params[:, 0, 0]
-    elif s_to_get in '21':
-        return s_params[:, 1, 0]
-    elif s_to_get in '12':
-        return s_params[:, 0, 1]
-    elif s_to_get in '22':
-        return s_params[:, 1, 1]
-    else:
-        raise Exception('No valid string was passed through s_to_get. Try 11, 12, 21, 22')
     
     
 # Function to calculate the impedance from the s parameters
+@instrumented('derive')
 def impedance_from_s(s_matrix: np.ndarray) -> np.ndarray:
     """
     This is a simple function that converts an S matrix or S vector into the corresponding impedance parameters that would be plotted
@@ -135,9 +210,151 @@ def impedance_from_s(s_matrix: np.ndarray) -> np.ndarray:
     """    
     return (1 + s_matrix)/(1 - s_matrix)
 
+# Structured error for a touchstone file that could not be loaded
+@dataclass
+class NetworkLoadError:
+    """
+    Record of a touchstone file that failed to load.
+
+    Attributes
+    ----------
+    index : int
+        Position of the file in the input list.
+    filepath : str
+        Filepath of the touchstone file.
+    error_type : str
+        Name of the exception that was raised.
+    message : str
+        Message of the exception that was raised.
+    """
+    index: int
+    filepath: str
+    error_type: str
+    message: str
+
+# Exception for touchstone files that could not be loaded, carrying the structured errors
+class NetworkLoadFailed(ValueError):
+    """
+    Raised by get_networks with max_workers when some of the touchstone files fail to load.
+
+    Attributes
+    ----------
+    errors : list[NetworkLoadError]
+        One entry per file that failed to load, with its position in the list of filepaths.
+    """
+    def __init__(self, errors: list[NetworkLoadError], n_files: int):
+        self.errors = errors
+        details = '; '.join(f'{error.filepath} ({error.error_type}: {error.message})' for error in errors[:5])
+        more = f'; and {len(errors) - 5} more' if len(errors) > 5 else ''
+        super().__init__(f'{len(errors)} of {n_files} touchstone files could not be loaded: {details}{more}')
+
+# Result of loading many touchstone files at once
+@dataclass
+class NetworkLoadResult:
+    """
+    Result of load_networks.
+
+    Attributes
+    ----------
+    networks : list[skrf.network.Network|None]
+        Loaded networks in the same order as the input filepaths. Files that failed to load are None.
+    errors : list[NetworkLoadError]
+        One entry per file that failed to load.
+    elapsed : float
+        Wall time in seconds spent loading.
+    """
+    networks: list = field(default_factory=list)
+    errors: list[NetworkLoadError] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def n_files(self) -> int:
+        return len(self.networks)
+
+    @property
+    def files_per_second(self) -> float:
+        return self.n_files / self.elapsed if self.elapsed > 0 else float('inf')
+
+    def loaded(self) -> list[skrf.network.Network]:
+        """Return only the networks that loaded successfully, in input order."""
+        return [net for net in self.networks if net is not None]
+
+# Worker for load_networks. Needs to live at the module level so it can be pickled for a process pool.
+def _load_network_file(filepath: str) -> tuple:
+    try:
+        return load_touchstone_network(filepath), None
+    except Exception as e:
+        return None, (type(e).__name__, str(e))
+
+# Function to load many touchstone files in parallel
+def load_networks(filepaths: list[str],
+                  max_workers: int = None,
+                  executor: str = 'process',
+                  chunksize: int = None,
+                  verbose: bool = False) -> NetworkLoadResult:
+    """
+    Load many touchstone files into skrf.Network objects in parallel. The networks are returned in the same order as
+    the input filepaths, and files that fail to load are returned as structured errors instead of being printed.
+
+    Parameters
+    ----------
+    filepaths : list[str]
+        List of filepaths of the touchstone files.
+    max_workers : int, optional
+        Number of worker processes or threads. By default None, which uses os.cpu_count(). A value of 1 loads the files
+        one after another in the current process.
+    executor : str, optional
+        Either 'process' or 'thread', by default 'process'. Parsing is mostly Python-level code, so processes scale
+        better with the number of cores, while threads avoid the cost of sending the networks back between processes.
+    chunksize : int, optional
+        Number of files sent to a worker process at a time. By default None, which splits the files into about four
+        chunks per worker.
+    verbose : bool, optional
+        Print the number of files loaded, the number of failures and the files/second when done, by default False
+
+    Returns
+    -------
+    NetworkLoadResult
+        Result containing the networks (None for failed files), the errors, and the timing information.
+    """
+    if isinstance(filepaths, str):
+        filepaths = [filepaths]
+    filepaths = list(filepaths)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(filepaths)))
+    
+    start = time.perf_counter()
+    if max_workers == 1:
+        outputs = [_load_network_file(filepath) for filepath in filepaths]
+    elif executor == 'process':
+        if chunksize is None:
+            chunksize = max(1, len(filepaths) // (4 * max_workers))
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            outputs = list(pool.map(_load_network_file, filepaths, chunksize=chunksize))
+    elif executor == 'thread':
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            outputs = list(pool.map(_load_network_file, filepaths))
+    else:
+        raise ValueError('Invalid executor string input! Try "process" or "thread"')
+    
+    result = NetworkLoadResult(elapsed=time.perf_counter() - start)
+    for i, (filepath, (net, error)) in enumerate(zip(filepaths, outputs)):
+        result.networks.append(net)
+        if error is not None:
+            result.errors.append(NetworkLoadError(i, filepath, *error))
+    if verbose:
+        mode = 'serial' if max_workers == 1 else f'{max_workers} {executor} workers'
+        print(f'Loaded {result.n_files - len(result.errors)}/{result.n_files} files in {result.elapsed:.2f} s '
+              f'({result.files_per_second:.1f} files/s, {mode})')
+    return result
+
 # define function for getting list  of networks out from an input of either, single network or string to filepath
 # or list of networks or strings to filepaths
-def get_networks(network: str|skrf.network.Network|list[str|skrf.network.Network])->list[skrf.network.Network]:
+@instrumented('load')
+def get_networks(network: str|skrf.network.Network|list[str|skrf.network.Network],
+                 max_workers: int = None,
+                 cache: NetworkCache = None)->list[skrf.network.Network]:
     """
     Function to input a network or list of networks and return a list of skrf.Network objects. This is useful for
     when you want to input a single network, or a list of networks, and return a list of skrf.Network objects that
@@ -147,26 +364,54 @@ def get_networks(network: str|skrf.network.Network|list[str|skrf.network.Network
     ----------
     network : str|skrf.network.Network|list[str|skrf.network.Network]
         Either a single network, a list of networks, a single string to a filepath, or a list of strings to filepaths.
+    max_workers : int, optional
+        If given, the filepaths in a list are loaded in parallel with load_networks using this many worker processes.
+        If any of them fail to load, a NetworkLoadFailed is raised with the NetworkLoadError of each failed file, so
+        the returned list always lines up with the input. By default None, which loads the files one after another.
+    cache : NetworkCache, optional
+        If given, filepaths are loaded through this on-disk cache, so files that were already parsed are not parsed
+        again. Takes precedence over max_workers. By default None
 
     Returns
     -------
     list[skrf.network.Network]
         List of skrf.Network objects that can be used for plotting or other analysis.
     """    
+    # Load the filepaths through the cache if one is given
+    if cache is not None and isinstance(network, (str, list)):
+        network = [network] if isinstance(network, str) else network
+        filepaths = [net for net in network if isinstance(net, str)]
+        loaded = iter(cache.load_networks(filepaths))
+        network = [next(loaded) if isinstance(net, str) else net for net in network]
     # Check if the input is a list of networks or a single network that isn't a list (single list of one network is fine)
     if isinstance(network, str):
         #TODO: Add the ability to get the frequency array to and return it as well as freqs
         try:
-            nets = [skrf.Network(file=network)]
+            nets = [load_touchstone_network(network)]
         except: print('Issue importing network from filename.')
     elif isinstance(network, skrf.network.Network):
         nets = [network]
+    elif isinstance(network, list) and max_workers is not None:
+        # Load all of the filepaths at once, then put the networks back in the order of the input list
+        filepaths = [net for net in network if isinstance(net, str)]
+        result = load_networks(filepaths, max_workers=max_workers)
+        if result.errors:
+            raise NetworkLoadFailed(result.errors, len(filepaths))
+        loaded = iter(result.networks)
+        nets = []
+        for net in network:
+            if isinstance(net, str):
+                net = next(loaded)
+            elif not isinstance(net, skrf.network.Network):
+                print('Issue with input list. Check that all entries are either strings to filepaths or skrf.Network objects.')
+                continue
+            nets.append(net)
     elif isinstance(network, list):
         nets = []
         for net in network:
             if isinstance(net, str):
                 try:
-                    nets.append(skrf.Network(file=net))
+                    nets.append(load_touchstone_network(net))
                 except: print('Issue importing network from filename.')
             elif isinstance(net, skrf.network.Network):
                 nets.append(net)
@@ -211,13 +456,102 @@ def get_freq(network: skrf.network.Network,
         raise Exception('Invalid units string input! Try "Hz", "kHz", "MHz", or "GHz"')
 
 
+# Cache for quantities derived from networks (frequency arrays, S-data, impedance)
+class NetworkQuantityCache:
+    """
+    Bounded least-recently-used cache of quantities derived from networks, keyed on (network identity, quantity,
+    S-parameter, scale or units). Each quantity is computed at most once per network while it stays in the cache,
+    which is useful when the same networks are drawn on several panels of a figure. Pass one cache to the plotting
+    functions (derived_cache argument) to share it between them.
+
+    Networks are tracked by identity, so a network that is changed in place after a quantity was cached will still
+    return the old quantity. Call clear() after changing a network. The cached arrays are read-only.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of cached quantities, by default 256
+    """
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        """Remove every cached quantity."""
+        self._entries.clear()
+
+    def _get(self, network: skrf.network.Network, key: tuple, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        key = (id(network),) + key
+        entry = self._entries.get(key)
+        # The weak reference guards against a new network that reuses the id of a deleted one
+        if entry is not None and entry[0]() is network:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        # Freeze a view, not the array itself, which may be network.f or a view into network.s
+        value = compute().view()
+        value.setflags(write=False)
+        self._entries[key] = (weakref.ref(network), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+    def freq(self, network: skrf.network.Network, units: str = 'GHz') -> np.ndarray:
+        """Cached version of get_freq."""
+        return self._get(network, ('freq', units), lambda: get_freq(network, units=units))
+
+    def s_data(self, network: skrf.network.Network, s_to_get: str = '11', scale: str = 'dB') -> np.ndarray:
+        """Cached version of get_s_data."""
+        return self._get(network, ('s', get_s_indices(s_to_get), scale),
+                         lambda: get_s_data(network, s_to_get, scale=scale))
+
+    def impedance(self, network: skrf.network.Network, s_to_get: str = '11') -> np.ndarray:
+        """Cached version of impedance_from_s(get_s_data(network, s_to_get, scale='linear'))."""
+        return self._get(network, ('impedance', get_s_indices(s_to_get)),
+                         lambda: impedance_from_s(self.s_data(network, s_to_get, scale='linear')))
+
+# Function to draw many traces on an axis as a single artist
+def _add_trace_collection(ax,
+                          traces: list[tuple[np.ndarray, np.ndarray]],
+                          colors: list,
+                          linestyles: list,
+                          linewidth: float,
+                          x_range: list = None):
+    """
+    Draw the (x, y) traces as one LineCollection instead of one Line2D per trace. Each trace is first cut to x_range
+    (keeping one point past each edge, so the lines reach the edges of the axis) and then decimated to the pixel width
+    of the axis with minmax_decimate, so dense frequency grids draw quickly but the dips stay sharp, also when zoomed.
+    """
+    from matplotlib.collections import LineCollection
+    n_bins = max(int(ax.get_window_extent().width), 1)
+    segments = []
+    for x, y in traces:
+        if x_range is not None and len(x_range) == 2:
+            window = get_range_slice(x, x_range)
+            window = slice(max(window.start - 1, 0), min(window.stop + 1, len(x)))
+            x, y = x[window], y[window]
+        segments.append(np.column_stack(minmax_decimate(x, y, n_bins)))
+    collection = LineCollection(segments, colors=colors, linestyles=linestyles, linewidths=linewidth)
+    ax.add_collection(collection)
+    ax.autoscale_view()
+    return collection
+
 # Plotting functions
+@instrumented('plot')
 def plot_s_parameters(networks: str|skrf.network.Network|list[str|skrf.network.Network],
                       names = None,
                       nets_to_plot = 'all',
                       s_to_plot: str = '11',
                       nets_to_fit_S11 = None,
                       fit_range: list|str = 'all',
+                      fit_workers: int = None,
                       ax = None,
                       colors = None,
                       fit_colors = None,
@@ -226,19 +560,29 @@ def plot_s_parameters(networks: str|skrf.network.Network|list[str|skrf.network.N
                       font_size = 12,
                       x_range = None,
                       y_range = None,
-                      show_plot: bool = False,
+                      show_plot: bool = None,
                       show_legend: bool = True,
                       x_label: str = 'Frequency (GHz)',
                       y_label: str = 'dB',
-                      label_S_in_legend: bool = False): 
+                      label_S_in_legend: bool = False,
+                      derived_cache: NetworkQuantityCache = None,
+                      fast: bool = False): 
+    import matplotlib.pyplot as plt
+    import matplotlib.axes
+    from matplotlib.lines import Line2D
     #TODO: Figure out a better way to deal with displaying the different datasets and how we color and display them. 
     #TODO: Pick new colors based on the one chart that Nick showed in his slides
     #TODO: Change all of these plotting parameters to be kwargs! Then write, if 'title' in kwargs.keys(). Just document the possible ones well.
     #TODO: add the docstrings for this function
     #TODO: add the default to always have the upper xlim as 0
     #TODO: Pass through the desired plotting units for the frequency axis (Hz, kHz, MHz, GHz) to pass to the get_freq function
+    # fast=True draws all of the traces as one LineCollection, decimated to the pixel width of the axis, for sweeps
+    # with hundreds of networks. The colors are then reused once there are more networks than colors.
     # Get the network(s) from the input
     nets = get_networks(networks)
+    # Cache the frequency and S-data so that each is only computed once per network
+    if derived_cache is None:
+        derived_cache = NetworkQuantityCache()
     # Create the names array if one doesn't exist
     if names is None:
         names = [i for i in range(len(nets))]
@@ -252,9 +596,11 @@ def plot_s_parameters(networks: str|skrf.network.Network|list[str|skrf.network.N
         nets_to_plot = names
     
     # Create the figure if an existing axis was not provided. I will likely just use this for testing. 
-    if ax == None:
-        # Define variable to show the plot at the end
-        show_plot = True
+    new_figure = ax is None
+    if new_figure:
+        # Show the plot at the end, unless show_plot=False was passed (for example when saving figures in a batch)
+        if show_plot is None:
+            show_plot = True
         # Create the figure
         fig, ax = plt.subplots(figsize = (8,6), dpi=150)
     # Raise error if weird ax is passed through 
@@ -285,50 +631,76 @@ def plot_s_parameters(networks: str|skrf.network.Network|list[str|skrf.network.N
         
     # Create array for the custom legend elements
     legend_elements = []    
+    # In fast mode, collect the traces here and draw them all at once after the loop
+    traces, trace_colors, trace_styles = [], [], []
     
     #TODO: Fix so that I can easilly call the frequency and s11 data from the dictionary
     # Now, loop through the parameters to plot, and then plot for each dataset
     for i, name in enumerate(nets_to_plot):
+        color = colors[i % len(colors)]
         for j, s_to_get in enumerate(s_to_plot.split(' ')):
             # Plot the specific data, using my get_s_data function to convert '11' to the corresponding S11 data for example
-            ax.plot(get_freq(nets_dict[name], units='GHz'),
-                    get_s_data(nets_dict[name], s_to_get),
-                    label=f'{name} S{s_to_get}',
-                    color=colors[i],
-                    ls=linestyles[j],
-                    lw=1.5)
+            if fast:
+                traces.append((derived_cache.freq(nets_dict[name], units='GHz'),
+                               derived_cache.s_data(nets_dict[name], s_to_get)))
+                trace_colors.append(color)
+                trace_styles.append(linestyles[j])
+            else:
+                ax.plot(derived_cache.freq(nets_dict[name], units='GHz'),
+                        derived_cache.s_data(nets_dict[name], s_to_get),
+                        label=f'{name} S{s_to_get}',
+                        color=color,
+                        ls=linestyles[j],
+                        lw=1.5)
             # Add to the legend elements
             if label_S_in_legend:
-                legend_elements.append(Line2D([0], [0], color=colors[i], lw=2, label=f'{name} S{s_to_get}'))
+                legend_elements.append(Line2D([0], [0], color=color, lw=2, label=f'{name} S{s_to_get}'))
             else:
-                legend_elements.append(Line2D([0], [0], color=colors[i], lw=2, label=name))
+                legend_elements.append(Line2D([0], [0], color=color, lw=2, label=name))
+    if fast and traces:
+        _add_trace_collection(ax, traces, trace_colors, trace_styles, linewidth=1.5, x_range=x_range)
                 
     # Now to fit the S11 data if desired
     if nets_to_fit_S11 is not None:
         # Create dicts for the centers and Q factors to pass through
         centers_dict = {}
         q_factors_dict = {}
-        for i, name in enumerate(nets_to_fit_S11):
-            # Make sure that each entry is in the names array
+        # Make sure that each entry is in the names array
+        for name in nets_to_fit_S11:
             if name not in names:
                 raise Exception(f'Network {name} is not in the names array!')
-            # run the fit
-            fit_result, q_fact, fit_plotting_data = fit_s11_resonance_dip(freq_data=get_freq(nets_dict[name], units='GHz'),
-                                                                          s11_data=get_s_data(nets_dict[name], s_to_get='11'),
-                                                                          fit_range=fit_range)
-            # add the center and Q factor to the dictionaries
-            centers_dict[name] = fit_result.params['l_center'].value
+        # If workers are given, run all of the fits at once across multiple processes
+        if fit_workers is not None:
+            fit_table = fit_s11_resonance_dips_parallel(freq_data=[derived_cache.freq(nets_dict[name], units='GHz') for name in nets_to_fit_S11],
+                                                        s11_data=[derived_cache.s_data(nets_dict[name], s_to_get='11') for name in nets_to_fit_S11],
+                                                        fit_range=fit_range,
+                                                        max_workers=fit_workers,
+                                                        return_fit_data=True)
+        for i, name in enumerate(nets_to_fit_S11):
+            # run the fit, or get it from the parallel fits
+            if fit_workers is not None:
+                fit_row = fit_table.iloc[i]
+                if not fit_row['success'] and fit_row['error'] is not None:
+                    raise Exception(f'Fit of network {name} failed: {fit_row["error"]}')
+                centers_dict[name], q_fact, fit_plotting_data = float(fit_row['center']), float(fit_row['q_factor']), fit_row['fit_plotting_data']
+            else:
+                fit_result, q_fact, fit_plotting_data = fit_s11_resonance_dip(freq_data=derived_cache.freq(nets_dict[name], units='GHz'),
+                                                                              s11_data=derived_cache.s_data(nets_dict[name], s_to_get='11'),
+                                                                              fit_range=fit_range)
+                centers_dict[name] = fit_result.params['l_center'].value
+            # add the Q factor to the dictionary
             q_factors_dict[name] = q_fact
             # Plot the fit
+            fit_color = fit_colors[i % len(fit_colors)]
             ax.plot(fit_plotting_data[0],
                     fit_plotting_data[1],
                     label=f'Fit {name} S11 \n (Q: {round(q_fact, 2)})\n (Center: {round(centers_dict[name], 2)} GHz)',
-                    color=fit_colors[i],
+                    color=fit_color,
                     ls='--',
                     lw=1.5)
             
             # Add to the legend elements
-            legend_elements.append(Line2D([0], [0], color=fit_colors[i], ls='--', lw=2, label=f'(Fit {name} S11 \nQ={round(q_fact, 0)})\nCenter={round(centers_dict[name], 2)} GHz)'))
+            legend_elements.append(Line2D([0], [0], color=fit_color, ls='--', lw=2, label=f'(Fit {name} S11 \nQ={round(q_fact, 0)})\nCenter={round(centers_dict[name], 2)} GHz)'))
             
     
     # Plot the defined range
@@ -355,6 +727,7 @@ def plot_s_parameters(networks: str|skrf.network.Network|list[str|skrf.network.N
     #TODO: Fix this later so that I am outputing the results in a nicer way
     if show_plot:
         plt.show()
+    if new_figure:
         if nets_to_fit_S11 is not None:
             return fig, ax, centers_dict, q_factors_dict
         else:
@@ -370,6 +743,7 @@ def plot_s_parameters(networks: str|skrf.network.Network|list[str|skrf.network.N
 #TODO: Add the ability to pass a networks class object that already has the preset names, networks, and even range to plot, can be overriden though
 #TODO: Add the option to choose the units for the frequency axis (Hz, kHz, MHz, GHz)
 # # Function to plot the smith chart data from a given s-parameter
+@instrumented('plot')
 def plot_impedance(networks: str|skrf.network.Network|list[str|skrf.network.Network],
                    names = None,
                    s_to_plot: str = '11',
@@ -382,19 +756,30 @@ def plot_impedance(networks: str|skrf.network.Network|list[str|skrf.network.Netw
                    x_range = None,
                    y_range = None,
                    show_legend: bool = True,
-                   show_plot: bool = False,
-                   x_label: str = 'Frequency (GHz)'):
+                   show_plot: bool = None,
+                   x_label: str = 'Frequency (GHz)',
+                   derived_cache: NetworkQuantityCache = None,
+                   fast: bool = False):
+    import matplotlib.pyplot as plt
+    import matplotlib.axes
+    from matplotlib.lines import Line2D
     #TODO: Fix this imag_ax thing. I don't think that I want to use it anymore.
+    # fast=True draws all of the traces as one LineCollection (see plot_s_parameters)
     # Get the network(s) from the input
     nets = get_networks(networks)
+    # Cache the frequency and impedance so that each is only computed once per network
+    if derived_cache is None:
+        derived_cache = NetworkQuantityCache()
     # Create the names array if one doesn't exist
     if names is None:
         names = [i for i in range(len(nets))]
     
     # Create the figure if an existing axis was not provided. I will likely just use this for testing. 
-    if ax == None:
-        # Define variable to show the plot at the end
-        show_plot = True
+    new_figure = ax is None
+    if new_figure:
+        # Show the plot at the end, unless show_plot=False was passed (for example when saving figures in a batch)
+        if show_plot is None:
+            show_plot = True
         # Create the figure
         fig, ax = plt.subplots(figsize = (8,6))
         
@@ -414,23 +799,42 @@ def plot_impedance(networks: str|skrf.network.Network|list[str|skrf.network.Netw
 
     # Set dict to store the impedance data
     imp_dict = {}
+    # In fast mode, collect the traces and their legend entries here and draw them all at once after the loop
+    traces, trace_colors, trace_styles, legend_elements = [], [], [], []
+    if fast and imp_to_plot in ('real', 'imag'):
+        ax.axhline(y=0, color=get_color('gray', 6), alpha=0.5, ls='-', lw=1.5)
+        ax.axhline(y=1, color=get_color('gray', 6), alpha=0.5, ls='-', lw=1.5)
     # Now, loop through the parameters to plot, and then plot for each dataset
     for i, net in enumerate(nets):
     # Now calculate the impedance values and loop over each parameter defined by 
         for j, s_to_get in enumerate(s_to_plot.split(" ")):
             # get the s_data and convert it to impedance data
-            s_data = get_s_data(net, s_to_get, scale='linear')
-            imp_data = impedance_from_s(s_data)
+            imp_data = derived_cache.impedance(net, s_to_get)
             # add the impedance data to the dictionary
             imp_dict[names[i]] = imp_data
+            if fast:
+                if imp_to_plot not in ('real', 'imag', 'both'):
+                    raise Exception('Invalid imp_to_plot string input! Try "real", "imag", or "both"')
+                freq = derived_cache.freq(net, units='GHz')
+                parts = {'real': [('Re', imp_data.real, colors[i % len(colors)])],
+                         'imag': [('Im', imp_data.imag, colors[i % len(colors)])],
+                         'both': [('Re', imp_data.real, colors[2*i % len(colors)]),
+                                  ('Im', imp_data.imag, colors[(2*i+1) % len(colors)])]}[imp_to_plot]
+                for part, values, color in parts:
+                    traces.append((freq, values))
+                    trace_colors.append(color)
+                    trace_styles.append(linestyles[j])
+                    legend_elements.append(Line2D([0], [0], color=color, ls=linestyles[j], lw=2,
+                                                  label=f'{names[i]}: {part}(z) from S{s_to_get}'))
+                continue
             # Plot the real
             if imp_to_plot == 'real':
                 ax.axhline(y=1, color=get_color('gray', 6), alpha=0.5, ls='-', lw=1.5)
                 ax.axhline(y=0, color=get_color('gray', 6), alpha=0.5, ls='-', lw=1.5)
-                ax.plot(get_freq(net, units='GHz'),
+                ax.plot(derived_cache.freq(net, units='GHz'),
                         imp_data.real,
                         label=f'{names[i]}: Re(z) from S{s_to_get}', 
-                        color=colors[i],
+                        color=colors[i % len(colors)],
                         ls=linestyles[j],
                         lw=2)
                 
@@ -439,31 +843,34 @@ def plot_impedance(networks: str|skrf.network.Network|list[str|skrf.network.Netw
             elif imp_to_plot == 'imag':
                 ax.axhline(y=0, color=get_color('gray', 6), alpha=0.5, ls='-', lw=1.5)
                 ax.axhline(y=1, color=get_color('gray', 6), alpha=0.5, ls='-', lw=1.5)
-                ax.plot(get_freq(net, units='GHz'),
+                ax.plot(derived_cache.freq(net, units='GHz'),
                         imp_data.imag,
                         label=f'{names[i]}: Im(z) from S{s_to_get}',
-                        color=colors[i],
+                        color=colors[i % len(colors)],
                         ls=linestyles[j],
                         lw=2)
                 
                 ax.set_ylabel('Im(Z) / (50 $\Omega$)', fontsize=font_size) 
             # Plot both
             elif imp_to_plot == 'both':
-                ax.plot(get_freq(net, units='GHz'),
+                ax.plot(derived_cache.freq(net, units='GHz'),
                         imp_data.real,
                         label=f'{names[i]}: Re(z) from S{s_to_get}', 
-                        color=colors[2*i],
+                        color=colors[2*i % len(colors)],
                         ls=linestyles[j],
                         lw=2)
-                ax.plot(get_freq(net, units='GHz'),
+                ax.plot(derived_cache.freq(net, units='GHz'),
                         imp_data.imag,
                         label=f'{names[i]}: Im(z) from S{s_to_get}',
-                        color=colors[2*i+1],
+                        color=colors[(2*i+1) % len(colors)],
                         ls=linestyles[j],
                         lw=2)
                 ax.set_ylabel('Z / (50 $\Omega$)', fontsize=font_size) 
             else:
                 raise Exception('Invalid imp_to_plot string input! Try "real", "imag", or "both"')
+    if fast and traces:
+        _add_trace_collection(ax, traces, trace_colors, trace_styles, linewidth=2, x_range=x_range)
+        ax.set_ylabel({'real': 'Re(Z)', 'imag': 'Im(Z)', 'both': 'Z'}[imp_to_plot] + ' / (50 $\Omega$)', fontsize=font_size)
     
 
     
@@ -480,11 +887,15 @@ def plot_impedance(networks: str|skrf.network.Network|list[str|skrf.network.Netw
             print('Issue with setting _range, check that you input a proper list')
     # Plot the lengend now but to the right of the figure
     if show_legend:
-        ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
+        if fast:
+            ax.legend(handles=legend_elements, loc='center left', bbox_to_anchor=(1, 0.5))
+        else:
+            ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
     ax.grid(alpha=0.5)
         
     if show_plot:
         plt.show()
+    if new_figure:
         return fig, ax, imp_dict
     else:
         return ax, imp_dict
@@ -495,19 +906,24 @@ def plot_impedance(networks: str|skrf.network.Network|list[str|skrf.network.Netw
 # since that is mostly what I will be working with. 
 
 # Function to plot the s data in one subplot and the impedance data in another
+@instrumented('plot')
 def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.network.Network],
                            names = None,
                            nets_to_plot = 'all',
                            nets_to_fit = None,
                            imps_to_plot = 'all', #TODO: Add the ability to plot the impedance data to plot
-                           fit_range: str|list = 'all',
+                           fit_range: str|list = 'auto',
                            fig_size: tuple = (8, 10),
                            dpi: int = 150,
                            x_range = None,
                            s_y_range = None,
                            re_y_range = [-1, 3],
                            im_y_range = [-2, 2],
-                           main_colors = ['cyan', 'orange', 'violet', 'pink', 'yellow']):
+                           main_colors = ['cyan', 'orange', 'violet', 'pink', 'yellow'],
+                           derived_cache: NetworkQuantityCache = None,
+                           fast: bool = False):
+    import matplotlib.pyplot as plt
+    from matplotlib.lines import Line2D
     #TODO: Add docstrings
     #TODO: Add the ability to change the title in the future, figure out how I want to format this.
     # Get the colors 
@@ -515,12 +931,15 @@ def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.netw
     fit_colors = get_color_list(main_colors, 3)
     re_colors = get_color_list(main_colors, 5)
     imag_colors = get_color_list(main_colors, 3)
+    # One cache of the derived quantities for all of the panels of the figure
+    if derived_cache is None:
+        derived_cache = NetworkQuantityCache()
     
+    # Get the networks once, and pass the loaded networks to every panel so the files are only read once
+    nets = get_networks(networks)
     # if no names are passed through, then set the names to be the index of the networks
     if names is None:
         names = [i for i in range(len(nets))]
-    # Get the networks
-    nets = get_networks(networks)
     # Create the nets dictionary so that I can easily access and choose from the data
     nets_dict = dict(zip(names, nets))
     # if the nets_to_plot is set to all, then set it to the names
@@ -541,12 +960,12 @@ def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.netw
     
     # Now plot the S11 data on the first panel, but check if the fit is desired
     if nets_to_fit is not None:
-        _, cents_dict, qs_dict = plot_s_parameters(networks=networks,
+        _, cents_dict, qs_dict = plot_s_parameters(networks=nets,
                                                     names=names,
                                                     nets_to_plot=nets_to_plot,
                                                     s_to_plot='11',
                                                     nets_to_fit_S11=nets_to_fit,
-                                                    fit_range=[7.1, 10],
+                                                    fit_range=fit_range,
                                                     ax=ax[0],
                                                     colors=s_colors,
                                                     fit_colors=fit_colors,
@@ -554,12 +973,14 @@ def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.netw
                                                     x_range=x_range,
                                                     y_range=s_y_range,
                                                     show_legend=False,
+                                                    derived_cache=derived_cache,
+                                                    fast=fast,
                                                     show_plot=False,
                                                     x_label=None)
         
         # Create a custom legend for the s11 plot
-        s_legend_elements = [Line2D([0], [0], color=s_colors[i], lw=2, label=name) for i, name in enumerate(nets_to_plot)] + \
-                            [Line2D([0], [0], color=fit_colors[i], ls='--', lw=2, label=f'(Fit {name}\nCenter={cents_dict[name]:.2f} GHz \n Q={qs_dict[name]:.0f})') for i, name in enumerate(nets_to_fit)]
+        s_legend_elements = [Line2D([0], [0], color=s_colors[i % len(s_colors)], lw=2, label=name) for i, name in enumerate(nets_to_plot)] + \
+                            [Line2D([0], [0], color=fit_colors[i % len(fit_colors)], ls='--', lw=2, label=f'(Fit {name}\nCenter={cents_dict[name]:.2f} GHz \n Q={qs_dict[name]:.0f})') for i, name in enumerate(nets_to_fit)]
         ax[0].legend(handles=s_legend_elements, 
                      loc='center left', 
                      bbox_to_anchor=(1, 0.5), 
@@ -569,7 +990,7 @@ def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.netw
         
         # Now for the impedance data
         # For the real data
-        _ , imp_dict = plot_impedance(networks=networks,
+        _ , imp_dict = plot_impedance(networks=nets,
                                        names=names,
                                        imp_to_plot='real',
                                        x_range=x_range,
@@ -578,10 +999,12 @@ def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.netw
                                        title=None,
                                        colors=re_colors,
                                        show_legend=False,
+                                       derived_cache=derived_cache,
+                                       fast=fast,
                                        x_label=None)
         
         # For the imaginary data
-        plot_impedance(networks=networks,
+        plot_impedance(networks=nets,
                        names=names,
                        imp_to_plot='imag',
                        x_range=x_range,
@@ -589,24 +1012,26 @@ def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.netw
                        ax=ax[2],
                        title=None,
                        colors=imag_colors,
-                       show_legend=False)
+                       show_legend=False,
+                       derived_cache=derived_cache,
+                       fast=fast)
         
         # Now calculate the impedances at the center frequencies
         imp_cents_dict = {}
         for i, name in enumerate(nets_to_fit):
-            imp_cents_dict[name] = imp_dict[name][np.argmin(np.abs(get_freq(nets_dict[name], units='GHz') - cents_dict[name]))]
+            imp_cents_dict[name] = imp_dict[name][np.argmin(np.abs(derived_cache.freq(nets_dict[name], units='GHz') - cents_dict[name]))]
             
         # Now plot the center frequencies on the impedance plots
         for i, ax_ in enumerate(ax[1:]):
             for i, name in enumerate(names):
-                ax_.axvline(cents_dict[name], color=s_colors[i], linestyle='--', linewidth=2, alpha=0.5)
+                ax_.axvline(cents_dict[name], color=s_colors[i % len(s_colors)], linestyle='--', linewidth=2, alpha=0.5)
         
         # Now add the legends for the impedance plots
-        re_legend_elements = [Line2D([0], [0], color=re_colors[i], lw=2, label=name) for i, name in enumerate(nets_to_plot)] + \
-                             [Line2D([0], [0], color=s_colors[i], ls='--', lw=2, alpha=0.5, label=f'{cents_dict[name]:.2f} GHz \nZ={imp_cents_dict[name]*50:.2f} $\Omega$') for i, name in enumerate(nets_to_fit)]
+        re_legend_elements = [Line2D([0], [0], color=re_colors[i % len(re_colors)], lw=2, label=name) for i, name in enumerate(nets_to_plot)] + \
+                             [Line2D([0], [0], color=s_colors[i % len(s_colors)], ls='--', lw=2, alpha=0.5, label=f'{cents_dict[name]:.2f} GHz \nZ={imp_cents_dict[name]*50:.2f} $\Omega$') for i, name in enumerate(nets_to_fit)]
         # Now for the imaginary
-        im_legend_elements = [Line2D([0], [0], color=imag_colors[i], lw=2, label=name) for i, name in enumerate(nets_to_plot)] + \
-                             [Line2D([0], [0], color=s_colors[i], ls='--', lw=2, alpha=0.5, label=f'{cents_dict[name]:.2f} GHz \nZ={imp_cents_dict[name]*50:.2f} $\Omega$') for i, name in enumerate(nets_to_fit)]
+        im_legend_elements = [Line2D([0], [0], color=imag_colors[i % len(imag_colors)], lw=2, label=name) for i, name in enumerate(nets_to_plot)] + \
+                             [Line2D([0], [0], color=s_colors[i % len(s_colors)], ls='--', lw=2, alpha=0.5, label=f'{cents_dict[name]:.2f} GHz \nZ={imp_cents_dict[name]*50:.2f} $\Omega$') for i, name in enumerate(nets_to_fit)]
         # Now plot the legends
         ax[1].legend(handles=re_legend_elements, 
                      loc='center left', 
@@ -623,12 +1048,12 @@ def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.netw
 
     # Now if no fit is desired, then just plot all of the data
     else:
-        plot_s_parameters(networks=networks,
+        plot_s_parameters(networks=nets,
                           names=names,
                           nets_to_plot=nets_to_plot,
                           s_to_plot='11',
                           nets_to_fit_S11=nets_to_fit,
-                          fit_range=[7.1, 10],
+                          fit_range=fit_range,
                           ax=ax[0],
                           colors=s_colors,
                           fit_colors=fit_colors,
@@ -636,13 +1061,15 @@ def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.netw
                           x_range=x_range,
                           y_range=s_y_range,
                           show_legend=False,
+                          derived_cache=derived_cache,
+                          fast=fast,
                           show_plot=False,
                           x_label=None)
         
-        re_legend_elements = [Line2D([0], [0], color=re_colors[i], lw=2, label=name) for i, name in enumerate(nets_to_plot)]
-        im_legend_elements = [Line2D([0], [0], color=imag_colors[i], lw=2, label=name) for i, name in enumerate(nets_to_plot)]
+        re_legend_elements = [Line2D([0], [0], color=re_colors[i % len(re_colors)], lw=2, label=name) for i, name in enumerate(nets_to_plot)]
+        im_legend_elements = [Line2D([0], [0], color=imag_colors[i % len(imag_colors)], lw=2, label=name) for i, name in enumerate(nets_to_plot)]
         # Create a custom legend for the s11 plot
-        s_legend_elements = [Line2D([0], [0], color=s_colors[i], lw=2, label=name) for i, name in enumerate(nets_to_plot)]
+        s_legend_elements = [Line2D([0], [0], color=s_colors[i % len(s_colors)], lw=2, label=name) for i, name in enumerate(nets_to_plot)]
         ax[0].legend(handles=s_legend_elements, 
                      loc='center left', 
                      bbox_to_anchor=(1, 0.5), 
@@ -652,7 +1079,7 @@ def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.netw
         
         # Now plot the impedance data on the second and third panels
         # For the real data
-        _ , imp_dict = plot_impedance(networks=networks,
+        _ , imp_dict = plot_impedance(networks=nets,
                                        names=names,
                                        imp_to_plot='real',
                                        x_range=x_range,
@@ -661,10 +1088,12 @@ def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.netw
                                        title=None,
                                        colors=re_colors,
                                        show_legend=False,
+                                       derived_cache=derived_cache,
+                                       fast=fast,
                                        x_label=None)
         
         # For the imaginary data
-        plot_impedance(networks=networks,
+        plot_impedance(networks=nets,
                        names=names,
                        imp_to_plot='imag',
                        x_range=x_range,
@@ -672,11 +1101,13 @@ def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.netw
                        ax=ax[2],
                        title=None,
                        colors=imag_colors,
-                       show_legend=False)
+                       show_legend=False,
+                       derived_cache=derived_cache,
+                       fast=fast)
         
         # Get the legend info
-        re_legend_elements = [Line2D([0], [0], color=re_colors[i], lw=2, label=name) for i, name in enumerate(nets_to_plot)]
-        im_legend_elements = [Line2D([0], [0], color=imag_colors[i], lw=2, label=name) for i, name in enumerate(nets_to_plot)]
+        re_legend_elements = [Line2D([0], [0], color=re_colors[i % len(re_colors)], lw=2, label=name) for i, name in enumerate(nets_to_plot)]
+        im_legend_elements = [Line2D([0], [0], color=imag_colors[i % len(imag_colors)], lw=2, label=name) for i, name in enumerate(nets_to_plot)]
         # Create the legends
         # Real
         ax[1].legend(handles=re_legend_elements, 
@@ -691,4 +1122,5 @@ def plot_s11_and_impedance(networks: str|skrf.network.Network|list[str|skrf.netw
                      fontsize=10, 
                      frameon=False, 
                      title=r'$\bf{Im(Z)}$')
-    
\ No newline at end of file
+
+    return fig, ax
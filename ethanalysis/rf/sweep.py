@@ -0,0 +1,301 @@
+# Module for working with a whole parameter sweep as one set of arrays instead of a list of skrf networks
+import numpy as np
+import skrf
+from ethanalysis.rf.rf import get_networks, get_params_dict_from_touchstone, get_s_indices, complex_to_db, impedance_from_s
+from ethanalysis.rf.cache import NetworkCache
+
+# Scale factors for the frequency units
+_freq_units = {'Hz': 1, 'kHz': 1e3, 'MHz': 1e6, 'GHz': 1e9}
+
+# Function to check the dtype of stacked S-parameters
+def _check_s_dtype(dtype) -> np.dtype:
+    dtype = np.dtype(dtype)
+    if dtype not in (np.complex64, np.complex128):
+        raise ValueError('dtype must be np.complex64 or np.complex128')
+    return dtype
+
+# Function to copy networks into a preallocated S array, checking that they share the frequency grid
+def _fill_s(networks: list[skrf.network.Network],
+            f: np.ndarray,
+            s: np.ndarray,
+            start: int = 0):
+    for i, net in enumerate(networks):
+        if net.s.shape != s.shape[1:] or not np.array_equal(net.f, f):
+            raise ValueError(f'Network {start + i} ({net.name}) does not share the frequency grid and port count of the '
+                             'first network.')
+        # Casts to the dtype of s, one network at a time
+        s[i] = net.s
+
+# Function to turn a list of parameter dictionaries into columns
+def params_to_columns(params: list[dict]) -> dict[str, np.ndarray]:
+    """
+    Convert a list of parameter dictionaries (one per network) into a dictionary of columns. Columns where every
+    value can be converted to a float are float arrays, the rest are kept as string arrays. Missing values are nan
+    for float columns and '' for string columns.
+
+    Parameters
+    ----------
+    params : list[dict]
+        List of parameter dictionaries, as returned by get_params_dict_from_touchstone.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        Dictionary mapping each parameter name to an array with one value per network.
+    """
+    names = list(dict.fromkeys(name for par_dict in params for name in par_dict))
+    columns = {}
+    for name in names:
+        values = [par_dict.get(name) for par_dict in params]
+        try:
+            columns[name] = np.array([np.nan if value is None else float(value) for value in values])
+        except ValueError:
+            columns[name] = np.array(['' if value is None else str(value) for value in values])
+    return columns
+
+class SweepDataset:
+    """
+    Container for a parameter sweep of networks that share a frequency grid. The S-parameters of all N networks are
+    stacked into one contiguous complex array of shape (N, F, P, P), and the CST parameters are stored as columns,
+    so that quantities like the dB values or the impedance of a chosen S-parameter are computed for the whole sweep
+    in a single numpy operation.
+
+    The S-parameters can be stored as complex64 instead of complex128, which halves the memory of large sweeps. The
+    frequency array always stays float64, and the dB values and impedances are computed in the precision of the
+    S-parameters (float32/complex64), which is plenty for plotting and resonance fits.
+
+    Parameters
+    ----------
+    f : np.ndarray
+        Frequency array in Hz, shape (F,).
+    s : np.ndarray
+        Complex S-parameters, shape (N, F, P, P).
+    params : dict[str, np.ndarray], optional
+        Columns of the sweep parameters, each with one value per network, by default None
+    names : list, optional
+        Name of each network, by default None which uses the index.
+    dtype : type, optional
+        Either np.complex128 or np.complex64 to store the S-parameters as, by default None which keeps the dtype of s.
+    """
+    def __init__(self,
+                 f: np.ndarray,
+                 s: np.ndarray,
+                 params: dict[str, np.ndarray] = None,
+                 names: list = None,
+                 dtype: type = None):
+        self.f = np.ascontiguousarray(f, dtype=float)
+        self.s = np.ascontiguousarray(s, dtype=None if dtype is None else _check_s_dtype(dtype))
+        if self.s.ndim != 4 or self.s.shape[1] != len(self.f) or self.s.shape[2] != self.s.shape[3]:
+            raise ValueError(f'The S array must have shape (N, F, P, P) with F={len(self.f)}, got {self.s.shape}')
+        self.params = {} if params is None else {name: np.asarray(col) for name, col in params.items()}
+        for name, col in self.params.items():
+            if len(col) != len(self):
+                raise ValueError(f'The parameter column {name} has {len(col)} values for {len(self)} networks.')
+        self.names = list(range(len(self))) if names is None else list(names)
+        if len(self.names) != len(self):
+            raise ValueError('The length of the names array does not match the number of networks!')
+
+    # Constructors
+    @classmethod
+    def from_networks(cls,
+                      networks: list[skrf.network.Network],
+                      params: list[dict]|dict[str, np.ndarray] = None,
+                      names: list = None,
+                      dtype: type = np.complex128) -> 'SweepDataset':
+        """
+        Stack a list of networks into a SweepDataset. All of the networks must have the same frequency grid and
+        number of ports.
+
+        Parameters
+        ----------
+        networks : list[skrf.network.Network]
+            List of networks to stack.
+        params : list[dict]|dict[str, np.ndarray], optional
+            Either one parameter dictionary per network or already built columns, by default None
+        names : list, optional
+            Name of each network, by default None which uses the network names.
+        dtype : type, optional
+            Either np.complex128 or np.complex64 to store the S-parameters as, by default np.complex128
+
+        Returns
+        -------
+        SweepDataset
+            The stacked sweep.
+        """
+        if len(networks) == 0:
+            raise ValueError('Cannot build a SweepDataset from an empty list of networks.')
+        f = networks[0].f
+        s = np.empty((len(networks),) + networks[0].s.shape, dtype=_check_s_dtype(dtype))
+        _fill_s(networks, f, s)
+        if isinstance(params, list):
+            params = params_to_columns(params)
+        if names is None:
+            names = [net.name for net in networks]
+        return cls(f, s, params=params, names=names)
+
+    @classmethod
+    def from_files(cls,
+                   filepaths: list[str],
+                   max_workers: int = None,
+                   cache: NetworkCache = None,
+                   names: list = None,
+                   dtype: type = np.complex128,
+                   chunk_size: int = 256) -> 'SweepDataset':
+        """
+        Load touchstone files (from a CST sweep) into a SweepDataset, along with their CST parameters. Files without
+        CST parameters get missing values in the parameter columns. The files are loaded chunk_size at a time and
+        copied into the stacked array, so only one chunk of skrf networks (in complex128) is in memory at once.
+
+        Parameters
+        ----------
+        filepaths : list[str]
+            List of filepaths of the touchstone files.
+        max_workers : int, optional
+            Number of worker processes to load the files with, see get_networks. By default None
+        cache : NetworkCache, optional
+            Cache to load the files through, see get_networks. By default None
+        names : list, optional
+            Name of each network, by default None which uses the network names.
+        dtype : type, optional
+            Either np.complex128 or np.complex64 to store the S-parameters as, by default np.complex128
+        chunk_size : int, optional
+            Number of files loaded at a time, by default 256
+
+        Returns
+        -------
+        SweepDataset
+            The stacked sweep.
+        """
+        filepaths = list(filepaths)
+        if len(filepaths) == 0:
+            raise ValueError('Cannot build a SweepDataset from an empty list of networks.')
+        dtype = _check_s_dtype(dtype)
+        f, s, net_names = None, None, []
+        for start in range(0, len(filepaths), chunk_size):
+            nets = get_networks(filepaths[start:start + chunk_size], max_workers=max_workers, cache=cache)
+            if len(nets) != len(filepaths[start:start + chunk_size]):
+                raise ValueError('Some of the touchstone files could not be loaded.')
+            if s is None:
+                f = nets[0].f
+                s = np.empty((len(filepaths),) + nets[0].s.shape, dtype=dtype)
+            _fill_s(nets, f, s[start:start + len(nets)], start=start)
+            net_names.extend(net.name for net in nets)
+        params = []
+        for filepath in filepaths:
+            try:
+                params.append(get_params_dict_from_touchstone(filepath, cache=cache))
+            except (IndexError, ValueError):
+                params.append({})
+        return cls(f, s, params=params_to_columns(params), names=net_names if names is None else names)
+
+    # Basic container behaviour
+    def __len__(self) -> int:
+        return self.s.shape[0]
+
+    def __repr__(self) -> str:
+        return (f'SweepDataset({len(self)} networks, {self.n_ports} ports, {len(self.f)} points, {self.s.dtype}, '
+                f'parameters: {list(self.params)})')
+
+    def __getitem__(self, index) -> 'SweepDataset':
+        """Select networks with an integer, slice, integer array or boolean mask. Always returns a SweepDataset."""
+        if isinstance(index, (int, np.integer)):
+            index = [index]
+        rows = np.arange(len(self))[index]
+        return SweepDataset(self.f, self.s[index],
+                            params={name: col[index] for name, col in self.params.items()},
+                            names=[self.names[i] for i in rows])
+
+    @property
+    def n_ports(self) -> int:
+        return self.s.shape[2]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the frequency and S-parameter arrays in bytes."""
+        return self.f.nbytes + self.s.nbytes
+
+    def astype(self, dtype: type) -> 'SweepDataset':
+        """Return a copy of the sweep with the S-parameters stored as dtype, np.complex64 or np.complex128."""
+        return SweepDataset(self.f, self.s.astype(_check_s_dtype(dtype)), params=self.params, names=self.names)
+
+    def param(self, name: str) -> np.ndarray:
+        """Return the column of the parameter name, with one value per network."""
+        return self.params[name]
+
+    def sort_by(self, name: str, sort_by: str = 'ascending') -> 'SweepDataset':
+        """Return a copy of the sweep sorted by the parameter name, either 'ascending' or 'descending'."""
+        if sort_by == 'ascending':
+            sort_index = np.argsort(self.params[name], kind='stable')
+        elif sort_by == 'descending':
+            sort_index = np.argsort(self.params[name], kind='stable')[::-1]
+        else:
+            raise ValueError('sort_by must be ascending or descending')
+        return self[sort_index]
+
+    def to_networks(self) -> list[skrf.network.Network]:
+        """Convert the sweep back to a list of skrf networks (which always hold complex128)."""
+        frequency = skrf.Frequency.from_f(self.f, unit='hz')
+        return [skrf.Network(frequency=frequency, s=self.s[i], name=str(name)) for i, name in enumerate(self.names)]
+
+    # Vectorized quantities over the whole sweep
+    def freq(self, units: str = 'GHz') -> np.ndarray:
+        """
+        Return the shared frequency array in the desired units.
+
+        Parameters
+        ----------
+        units : str, optional
+            Either 'Hz', 'kHz', 'MHz', or 'GHz', by default 'GHz'
+
+        Returns
+        -------
+        np.ndarray
+            Frequency array, shape (F,).
+        """
+        if units not in _freq_units:
+            raise Exception('Invalid units string input! Try "Hz", "kHz", "MHz", or "GHz"')
+        return self.f / _freq_units[units]
+
+    def s_data(self,
+               s_to_get: str = '11',
+               scale: str = 'dB') -> np.ndarray:
+        """
+        Return one S-parameter for every network in the sweep.
+
+        Parameters
+        ----------
+        s_to_get : str, optional
+            S-parameter to get, for example '11' or '21', by default '11'
+        scale : str, optional
+            Either 'dB' or 'linear', by default 'dB'
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (N, F) in the precision of the sweep. Real in dB, complex when linear. The linear data is a
+            view into the sweep.
+        """
+        i, j = get_s_indices(s_to_get, self.n_ports)
+        s_params = self.s[:, :, i, j]
+        if scale == 'dB':
+            return complex_to_db(s_params)
+        elif scale == 'linear':
+            return s_params
+        else:
+            raise Exception('Invalid scale string input! Try "dB" or "linear"')
+
+    def impedance(self, s_to_get: str = '11') -> np.ndarray:
+        """
+        Return the normalized impedance calculated from one S-parameter for every network in the sweep.
+
+        Parameters
+        ----------
+        s_to_get : str, optional
+            S-parameter to calculate the impedance from, by default '11'
+
+        Returns
+        -------
+        np.ndarray
+            Complex array of shape (N, F).
+        """
+        return impedance_from_s(self.s_data(s_to_get, scale='linear'))
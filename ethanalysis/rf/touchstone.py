@@ -0,0 +1,284 @@
+# Module for reading touchstone files without going through skrf. These are lightweight readers that only touch
+# the parts of the file that are needed, which matters when working with thousands of files from a CST sweep.
+import os
+import re
+import fnmatch
+import warnings
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from ethanalysis.utils.instrument import add_bytes
+
+# Comment prefixes that skrf treats as keywords instead of plain comments. These are skipped so that the comment
+# lines returned here line up with skrf.Touchstone.comments
+_skrf_keyword_comments = ('! gamma', '! port', '! terminal data exported', '! modal data exported')
+
+# Function to read the leading comment block of a touchstone file
+def read_touchstone_comments(filepath: str) -> list[str]:
+    """
+    Read only the leading comment block of a touchstone file. The file is streamed line by line and reading stops at
+    the option line (starting with '#') or the first data line, so the frequency data is never parsed. The returned
+    lines match the lines of skrf.Touchstone(filepath).comments.split('\\n').
+
+    Parameters
+    ----------
+    filepath : str
+        String containing the filepath of the touchstone file.
+
+    Returns
+    -------
+    list[str]
+        List of the comment lines with the leading '!' removed.
+    """
+    comments = []
+    n_bytes = 0
+    with open(filepath, 'rb') as file:
+        for line in file:
+            n_bytes += len(line)
+            line = line.decode(errors='replace').strip()
+            # skip blank lines
+            if not line:
+                continue
+            # stop at the option line or the first line that is not a comment
+            if line[0] != '!':
+                break
+            if line.lower().startswith(_skrf_keyword_comments):
+                continue
+            comments.append(line[1:])
+    add_bytes(n_bytes)
+    return comments
+
+# Function to turn the CST parameter comment into a dictionary
+def parse_cst_parameters(comments: list[str]) -> dict:
+    """
+    Parse the design parameters that CST saves in the comment block of a touchstone file. The parameters are on the
+    fourth comment line in the form 'Parameters = {name1=value1; name2=value2}'.
+
+    Parameters
+    ----------
+    comments : list[str]
+        List of comment lines, as returned by read_touchstone_comments.
+
+    Returns
+    -------
+    dict
+        Dictionary containing the parameters and their values (as strings).
+    """
+    parameters = comments[3].split(' = ')[1][1:-1]
+    par_dict = dict((x.strip(), y.strip())
+                    for x, y in (element.split('=')
+                    for element in parameters.split('; '))
+                    )
+    return par_dict
+
+# Function to get the parameter dictionaries for every touchstone file in a directory
+def get_params_dicts_from_directory(directory: str,
+                                    pattern: str = '*.s*p',
+                                    max_workers: int = None) -> dict[str, dict]:
+    """
+    Scan a directory for touchstone files and read the CST parameters from each of them. Only the header of each
+    file is read. Files whose header does not contain CST parameters are left out of the output.
+
+    Parameters
+    ----------
+    directory : str
+        Directory containing the touchstone files.
+    pattern : str, optional
+        Filename pattern (fnmatch style) of the files to read, by default '*.s*p'
+    max_workers : int, optional
+        Number of threads to read the headers with. By default None, which reads the files one after another. Using
+        a few threads helps on network drives where each file open is slow.
+
+    Returns
+    -------
+    dict[str, dict]
+        Dictionary mapping the filepath of each touchstone file to its parameter dictionary, sorted by filepath.
+    """
+    filepaths = sorted(entry.path for entry in os.scandir(directory)
+                       if entry.is_file() and fnmatch.fnmatch(entry.name.lower(), pattern.lower()))
+
+    def _read(filepath):
+        try:
+            return parse_cst_parameters(read_touchstone_comments(filepath))
+        except (IndexError, ValueError):
+            return None
+
+    if max_workers is None or max_workers <= 1:
+        results = map(_read, filepaths)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_read, filepaths))
+    return {filepath: params for filepath, params in zip(filepaths, results) if params is not None}
+
+# Scale factors and names of the frequency units of the option line
+_option_units = {'hz': (1, 'Hz'), 'khz': (1e3, 'kHz'), 'mhz': (1e6, 'MHz'), 'ghz': (1e9, 'GHz')}
+
+@dataclass
+class TouchstoneData:
+    """
+    Arrays of a touchstone file, as returned by read_touchstone.
+
+    Attributes
+    ----------
+    f : np.ndarray
+        Frequency array in Hz, shape (F,).
+    s : np.ndarray
+        Complex S-parameters, shape (F, P, P).
+    z0 : float
+        Reference impedance of every port in Ohm.
+    unit : str
+        Frequency unit of the file, like 'GHz'.
+    name : str
+        Filename without the extension.
+    comments : list[str]
+        Comment lines of the header with the leading '!' removed, like read_touchstone_comments returns.
+    """
+    f: np.ndarray
+    s: np.ndarray
+    z0: float = 50.0
+    unit: str = 'GHz'
+    name: str = ''
+    comments: list[str] = field(default_factory=list)
+
+    def to_network(self):
+        """Return the data as a skrf.Network."""
+        import skrf
+        frequency = skrf.Frequency.from_f(self.f, unit='hz')
+        frequency.unit = self.unit
+        return skrf.Network(frequency=frequency, s=self.s, z0=self.z0, name=self.name)
+
+# Function to parse the option line of a touchstone file
+def _parse_option_line(line: str) -> tuple[float, str, str, float]:
+    tokens = line[1:].lower().split()
+    scale, unit = _option_units['ghz']
+    data_format, z0 = 'ma', 50.0
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in _option_units:
+            scale, unit = _option_units[token]
+        elif token in ('ri', 'ma', 'db'):
+            data_format = token
+        elif token == 'r' and i + 1 < len(tokens):
+            z0 = float(tokens[i + 1])
+            i += 1
+        elif token != 's':
+            raise ValueError(f'Only S-parameter touchstone files are supported, the option line is "{line}".')
+        i += 1
+    return scale, unit, data_format, z0
+
+# Function to read a touchstone file into arrays
+def read_touchstone(filepath: str) -> TouchstoneData:
+    """
+    Read the frequencies and S-parameters of a (version 1) touchstone file. The header is scanned line by line for
+    the comments and the option line, then the whole numeric block is decoded in one pass with np.fromstring and
+    reshaped into the complex S-matrix, which is several times faster than skrf.Network(file=...) for large files.
+    RI, MA and DB formats are supported, in any frequency unit.
+
+    Parameters
+    ----------
+    filepath : str
+        Filepath of the touchstone file, the extension (.sNp) gives the number of ports.
+
+    Returns
+    -------
+    TouchstoneData
+        The frequency array (Hz), S-parameters, reference impedance and header of the file. Use its to_network method
+        for a skrf.Network.
+
+    Raises
+    ------
+    ValueError
+        If the file is not one this reader handles: version 2 keywords, network data other than S-parameters, noise
+        parameters, or numbers that don't fill whole frequency points. load_touchstone_network falls back to skrf for
+        these.
+    """
+    match = re.search(r'\.s(\d+)p$', filepath, flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError(f'Can\'t tell the number of ports from the extension of {filepath}, expected .sNp.')
+    n_ports = int(match.group(1))
+    with open(filepath, 'rb') as file:
+        raw = file.read()
+
+    # Scan the header for the comments and the option line, up to the first data line
+    comments = []
+    option_line = '#'
+    start = 0
+    while start < len(raw):
+        end = raw.find(b'\n', start)
+        if end == -1:
+            end = len(raw)
+        line = raw[start:end].strip().decode(errors='replace')
+        if line:
+            if line[0] == '!':
+                if not line.lower().startswith(_skrf_keyword_comments):
+                    comments.append(line[1:])
+            elif line[0] == '#':
+                option_line = line
+            elif line[0] == '[':
+                raise ValueError(f'Touchstone 2.0 keywords are not supported ({line}).')
+            else:
+                break
+        start = end + 1
+    scale, unit, data_format, z0 = _parse_option_line(option_line)
+
+    # Decode the numeric block in one pass, dropping any comments at the ends of the data lines first
+    data = raw[start:]
+    if b'!' in data:
+        data = re.sub(rb'![^\n]*', b'', data)
+    try:
+        with warnings.catch_warnings():
+            # numpy only warns when it hits text that is not a number, make that an error
+            warnings.simplefilter('error', DeprecationWarning)
+            values = np.fromstring(data, sep=' ')
+    except (ValueError, DeprecationWarning) as e:
+        raise ValueError(f'Could not read the data of {filepath}: {e}') from None
+    n_values = 1 + 2 * n_ports**2
+    if values.size == 0 or values.size % n_values:
+        raise ValueError(f'The data of {filepath} does not fill whole frequency points of a {n_ports}-port file.')
+    values = values.reshape(-1, n_values)
+    f = values[:, 0] * scale
+    if np.any(np.diff(f) <= 0):
+        raise ValueError(f'The frequencies of {filepath} are not increasing, the file may contain noise parameters.')
+
+    # Build the complex S-matrix from the pairs of numbers
+    a, b = values[:, 1::2], values[:, 2::2]
+    if data_format == 'ri':
+        s = np.empty(a.shape, dtype=complex)
+        s.real, s.imag = a, b
+    elif data_format == 'ma':
+        s = a * np.exp(1j * np.deg2rad(b))
+    else:
+        s = 10**(a / 20) * np.exp(1j * np.deg2rad(b))
+    s = s.reshape(-1, n_ports, n_ports)
+    if n_ports == 2:
+        # Two port files list the columns of the S-matrix (11 21 12 22)
+        s = np.ascontiguousarray(s.transpose(0, 2, 1))
+    # Counted only once the file is read, so that the fallback of load_touchstone_network doesn't count it twice
+    add_bytes(len(raw))
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    return TouchstoneData(f=f, s=s, z0=z0, unit=unit, name=name, comments=comments)
+
+# Function to load a touchstone file as a skrf.Network with the fast reader
+def load_touchstone_network(filepath: str):
+    """
+    Load a touchstone file as a skrf.Network with read_touchstone, falling back to skrf.Network(file=filepath) for
+    the files it doesn't handle (see read_touchstone).
+
+    Parameters
+    ----------
+    filepath : str
+        Filepath of the touchstone file.
+
+    Returns
+    -------
+    skrf.network.Network
+        The network of the file.
+    """
+    try:
+        return read_touchstone(filepath).to_network()
+    except ValueError:
+        import skrf
+        network = skrf.Network(file=filepath)
+        add_bytes(os.path.getsize(filepath))
+        return network
@@ -0,0 +1,174 @@
+# Module for following a sweep directory while it is still being written (for example by a CST simulation farm).
+# A manifest of the files that were already processed is kept next to the results table, so every poll only loads
+# and fits the files that are new or changed since the last one, and appends their rows to the saved table.
+import os
+import json
+import time
+from typing import Iterator
+from ethanalysis.rf.cache import hash_file
+from ethanalysis.rf.pipeline import iter_touchstone_files, stream_sweep
+from ethanalysis.rf.results import records_to_table, write_results_table
+
+class SweepWatcher:
+    """
+    Incremental analysis of a sweep directory. Each call of poll lists the touchstone files, compares them against a
+    manifest of the processed files, runs process_touchstone_file on the new and changed files only, and appends
+    their rows to the results table (see write_results_table). The time of a poll is proportional to the number of
+    new files, not to the size of the sweep.
+
+    A file counts as unchanged if its size and modification time match the manifest, which only needs an os.stat
+    call. If they don't match, the contents are hashed, so a file that was only touched or copied over with the same
+    contents is not fit again. Files modified less than settle_seconds ago are left for a later poll, since CST may
+    still be writing them.
+
+    The manifest is saved after the rows are appended, so a crash in between processes the files again rather than
+    losing them. A changed file gets a new row and its old row stays in the table, use
+    table.drop_duplicates('filepath', keep='last') for the latest result of each file.
+
+    Parameters
+    ----------
+    source : str|list[str]
+        A directory, a glob pattern (like 'sweep/*.s2p'), or a list of filepaths.
+    results_path : str
+        Where to append the results table, a parquet directory or a .feather file, see write_results_table.
+    fit_range : list|str, optional
+        Frequency window (in GHz) to analyse and fit, see process_touchstone_file. By default 'all'
+    fit_method : str, optional
+        Either 'lmfit' or 'vectorized', see process_touchstone_file. By default 'lmfit'
+    pattern : str, optional
+        Filename pattern used when source is a directory, by default '*.s*p'
+    format : str, optional
+        Either 'parquet' or 'feather', by default None which picks it from the extension of results_path.
+    manifest_path : str, optional
+        JSON file of the manifest, by default None which puts it next to the results as '<results>.manifest.json'.
+    max_workers : int, optional
+        Number of worker processes per poll, see stream_sweep. By default None
+    settle_seconds : float, optional
+        Minimum age of the last modification of a file before it is processed, by default 2.0
+    """
+    def __init__(self,
+                 source: str|list[str],
+                 results_path: str,
+                 fit_range: list|str = 'all',
+                 fit_method: str = 'lmfit',
+                 pattern: str = '*.s*p',
+                 format: str = None,
+                 manifest_path: str = None,
+                 max_workers: int = None,
+                 settle_seconds: float = 2.0):
+        self.source = source
+        self.results_path = results_path
+        self.fit_range = fit_range
+        self.fit_method = fit_method
+        self.pattern = pattern
+        self.format = format
+        self.max_workers = max_workers
+        self.settle_seconds = settle_seconds
+        if manifest_path is None:
+            manifest_path = os.path.splitext(results_path.rstrip('/\\'))[0] + '.manifest.json'
+        self.manifest_path = manifest_path
+        self._load_manifest()
+
+    # Manifest handling
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as file:
+                manifest = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest = {}
+        # 'files' maps filepath -> (size, mtime_ns, hash) of the version that was processed
+        self._files = manifest.get('files', {})
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'files': self._files}, file)
+        os.replace(tmp_path, self.manifest_path)
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def pending(self) -> list[tuple[str, list]]:
+        """
+        Find the files that are new or changed since they were processed, without processing them.
+
+        Returns
+        -------
+        list[tuple[str, list]]
+            Filepath and manifest key (size, mtime_ns, hash) of each file to process, in the order of the files.
+        """
+        now = time.time_ns()
+        pending = []
+        for filepath in iter_touchstone_files(self.source, self.pattern):
+            filepath = os.path.abspath(filepath)
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                continue
+            key = self._files.get(filepath)
+            if key is not None and key[0] == stat.st_size and key[1] == stat.st_mtime_ns:
+                continue
+            if now - stat.st_mtime_ns < self.settle_seconds * 1e9:
+                continue
+            content_hash = hash_file(filepath)
+            if key is not None and key[2] == content_hash:
+                # Same contents with a new modification time, only the manifest needs updating
+                self._files[filepath] = [stat.st_size, stat.st_mtime_ns, content_hash]
+                continue
+            pending.append((filepath, [stat.st_size, stat.st_mtime_ns, content_hash]))
+        return pending
+
+    def poll(self) -> 'pd.DataFrame':
+        """
+        Process the new and changed files and append their rows to the results table.
+
+        Returns
+        -------
+        pd.DataFrame
+            Table of the rows that were added, see records_to_table. Empty if nothing changed.
+        """
+        pending = self.pending()
+        records = list(stream_sweep([filepath for filepath, _ in pending], fit_range=self.fit_range,
+                                    fit_method=self.fit_method, max_workers=self.max_workers))
+        table = records_to_table(records)
+        if records:
+            write_results_table(table, self.results_path, format=self.format)
+        for filepath, key in pending:
+            self._files[filepath] = key
+        self._save_manifest()
+        return table
+
+    def watch(self,
+              interval: float = 10.0,
+              max_polls: int = None,
+              verbose: bool = False) -> Iterator['pd.DataFrame']:
+        """
+        Poll the sweep every interval seconds and yield the rows added by each poll that found new or changed files.
+
+        Parameters
+        ----------
+        interval : float, optional
+            Seconds between the start of two polls, by default 10.0
+        max_polls : int, optional
+            Stop after this many polls, by default None which keeps watching until the loop is broken.
+        verbose : bool, optional
+            Print a line for every poll that added rows, by default False
+
+        Yields
+        ------
+        pd.DataFrame
+            Rows added by the poll, see poll.
+        """
+        n_polls = 0
+        while max_polls is None or n_polls < max_polls:
+            start = time.perf_counter()
+            table = self.poll()
+            n_polls += 1
+            if len(table):
+                if verbose:
+                    n_errors = int(table['error'].notna().sum())
+                    print(f'Processed {len(table)} files ({n_errors} failed) in {time.perf_counter() - start:.2f} s, '
+                          f'{len(self)} files in total')
+                yield table
+            if max_polls is None or n_polls < max_polls:
+                time.sleep(max(interval - (time.perf_counter() - start), 0))
@@ -1,2 +1,3 @@
 from ethanalysis.utils.colors import *
-from ethanalysis.utils.main import *
\ No newline at end of file
+from ethanalysis.utils.main import *
+from ethanalysis.utils.instrument import *
\ No newline at end of file
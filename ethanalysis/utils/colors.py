@@ -1,6 +1,3 @@
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-import matplotlib.colors as mcolors
 import numpy as np
 # library for using nice colors in plots
 # https://yeun.github.io/open-color/
@@ -260,6 +257,10 @@ def get_discrete_colormap(parameters: list|np.ndarray,
     list
         List of colors in the colormap and the sm (ScalarMappable) object.
     """
+    # matplotlib is only imported here so that the color lookups don't need it
+    import matplotlib.pyplot as plt
+    import matplotlib.cm as cm
+    import matplotlib.colors as mcolors
     if vmin is None:
         vmin = min(parameters)
     if vmax is None:
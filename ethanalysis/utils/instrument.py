@@ -0,0 +1,191 @@
+# Module for opt-in timing of the hot paths. The loading, derivation, fitting and plotting functions of ethanalysis are
+# wrapped with the instrumented decorator, which does nothing but check one list while no recording is active. Inside
+# a `with instrument() as recorder:` block every call of a wrapped function is timed, along with the bytes it read and
+# the function evaluations of its fits, and summarized per stage.
+#
+# Only calls in the current process are recorded, work done in process pool workers is timed as part of the call
+# that started the pool.
+import json
+import threading
+import time
+import functools
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+# Recorders of the active instrument() blocks. Empty when instrumentation is off.
+_recorders = []
+# Stack of the wrapped calls currently running in each thread
+_local = threading.local()
+
+class _Frame:
+    __slots__ = ('function', 'stage', 'child_seconds', 'bytes', 'nfev')
+
+    def __init__(self, function: str, stage: str):
+        self.function, self.stage = function, stage
+        self.child_seconds, self.bytes, self.nfev = 0.0, 0, 0
+
+def _stack() -> list[_Frame]:
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def is_instrumenting() -> bool:
+    """Return True inside an instrument() block, for work that is only worth doing when recording."""
+    return bool(_recorders)
+
+def add_bytes(n_bytes: int):
+    """Add bytes read to the innermost running instrumented call. Does nothing when instrumentation is off."""
+    if _recorders:
+        stack = _stack()
+        if stack:
+            stack[-1].bytes += int(n_bytes)
+
+def add_nfev(nfev: int):
+    """Add fit function evaluations to the innermost running instrumented call. Does nothing when instrumentation is off."""
+    if _recorders:
+        stack = _stack()
+        if stack:
+            stack[-1].nfev += int(nfev)
+
+class Recorder:
+    """
+    Totals of the instrumented calls made inside an instrument() block. Each call counts its own time (its total
+    time minus the time spent in the instrumented calls it made), so the stage totals add up without counting nested
+    calls twice, for example the fits made by a plotting function count as 'fit' and not as 'plot'.
+
+    Parameters
+    ----------
+    exporter : Callable[[dict], None], optional
+        Called with the event dictionary of every finished call, for example a JsonLinesExporter. By default None
+    """
+    def __init__(self, exporter: Callable[[dict], None] = None):
+        self.exporter = exporter
+        self.functions = {}
+        self.wall_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _add(self, event: dict):
+        with self._lock:
+            totals = self.functions.setdefault(event['function'], {'stage': event['stage'], 'calls': 0, 'seconds': 0.0,
+                                                                   'self_seconds': 0.0, 'bytes': 0, 'nfev': 0})
+            totals['calls'] += 1
+            for key in ('seconds', 'self_seconds', 'bytes', 'nfev'):
+                totals[key] += event[key]
+        if self.exporter is not None:
+            self.exporter(event)
+
+    def summary(self) -> dict:
+        """
+        Summarize the recorded calls.
+
+        Returns
+        -------
+        dict
+            Dictionary with 'wall_seconds' (of the whole block), 'stages' (the 'calls', 'seconds' (own time), 'bytes'
+            and 'nfev' of each stage, like 'load', 'derive', 'fit' and 'plot'), and 'functions' (the same per
+            function, with the total 'seconds' including nested calls and the own 'self_seconds').
+        """
+        with self._lock:
+            functions = {name: dict(totals) for name, totals in self.functions.items()}
+        stages = {}
+        for totals in functions.values():
+            stage = stages.setdefault(totals['stage'], {'calls': 0, 'seconds': 0.0, 'bytes': 0, 'nfev': 0})
+            stage['calls'] += totals['calls']
+            stage['seconds'] += totals['self_seconds']
+            stage['bytes'] += totals['bytes']
+            stage['nfev'] += totals['nfev']
+        return {'wall_seconds': self.wall_seconds, 'stages': stages, 'functions': functions}
+
+class JsonLinesExporter:
+    """
+    Exporter that writes every recorded call as one JSON line, appended to a file.
+
+    Parameters
+    ----------
+    path : str
+        Filepath of the JSON lines file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        with self._lock:
+            self._file.write(json.dumps(event) + '\n')
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> 'JsonLinesExporter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+@contextmanager
+def instrument(exporter: Callable[[dict], None] = None) -> Iterator[Recorder]:
+    """
+    Record the instrumented calls made inside the block.
+
+    Parameters
+    ----------
+    exporter : Callable[[dict], None], optional
+        Called with every finished call as a dictionary with the keys 'function', 'stage', 'timestamp' (start, in
+        seconds since the epoch), 'seconds', 'self_seconds', 'bytes', and 'nfev'. By default None
+
+    Yields
+    ------
+    Recorder
+        The recorder, call summary() on it (during or after the block) for the per-stage totals.
+    """
+    recorder = Recorder(exporter)
+    _recorders.append(recorder)
+    start = time.perf_counter()
+    try:
+        yield recorder
+    finally:
+        recorder.wall_seconds = time.perf_counter() - start
+        _recorders.remove(recorder)
+
+# Function to time the calls of a wrapped function
+def _record_call(function: Callable, name: str, stage: str, args: tuple, kwargs: dict):
+    stack = _stack()
+    frame = _Frame(name, stage)
+    stack.append(frame)
+    timestamp, start = time.time(), time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        if stack:
+            stack[-1].child_seconds += seconds
+        event = {'function': name, 'stage': stage, 'timestamp': timestamp, 'seconds': seconds,
+                 'self_seconds': seconds - frame.child_seconds, 'bytes': frame.bytes, 'nfev': frame.nfev}
+        for recorder in list(_recorders):
+            recorder._add(event)
+
+# Decorator to instrument a function
+def instrumented(stage: str, name: str = None) -> Callable[[Callable], Callable]:
+    """
+    Decorator that records the calls of a function under a stage (like 'load', 'derive', 'fit' or 'plot') while an
+    instrument() block is active. Otherwise the function is called straight away.
+
+    Parameters
+    ----------
+    stage : str
+        Stage the function belongs to.
+    name : str, optional
+        Name to record the function under, by default its qualified name.
+    """
+    def decorator(function: Callable) -> Callable:
+        function_name = name or function.__qualname__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _recorders:
+                return function(*args, **kwargs)
+            return _record_call(function, function_name, stage, args, kwargs)
+        return wrapper
+    return decorator
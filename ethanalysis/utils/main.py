@@ -4,7 +4,8 @@ import numpy as np
 # Create function to truncate the data to a specific x_range
 def truncate_data(x_data: np.ndarray,
                   y_data: np.ndarray,
-                  x_range: list)->(np.ndarray, np.ndarray):
+                  x_range: list,
+                  assume_sorted: bool = False)->(np.ndarray, np.ndarray):
     """
     Truncate the data to a specific x_range
     
@@ -16,6 +17,10 @@ def truncate_data(x_data: np.ndarray,
         y-axis data
     x_range : array
         x-axis range to truncate data to
+    assume_sorted : bool
+        If True, x_data must be sorted in ascending order (like a frequency grid). The range edges are then found with
+        a binary search (see get_range_slice), the upper endpoint is included, and the outputs are views of the inputs.
+        By default False, which finds the points closest to the range edges and leaves out the upper one.
         
     Returns
     -------
@@ -24,6 +29,9 @@ def truncate_data(x_data: np.ndarray,
     y_data_trunc : array
         truncated y-axis data
     """
+    if assume_sorted:
+        range_slice = get_range_slice(x_data, x_range)
+        return x_data[range_slice], y_data[range_slice]
     # Find the indices of the x_range
     x_min_idx = np.argmin(np.abs(x_data - x_range[0]))
     x_max_idx = np.argmin(np.abs(x_data - x_range[1]))
@@ -34,11 +42,91 @@ def truncate_data(x_data: np.ndarray,
     
     return x_data_trunc, y_data_trunc
 
+# Function to get the slice of a sorted array that falls inside a range
+def get_range_slice(x_data: np.ndarray,
+                    x_range: list) -> slice:
+    """
+    Get the slice of a sorted (ascending) array covering the points with x_range[0] <= x <= x_range[1]. The edges are
+    found with a binary search, so this is O(log n) and doesn't allocate any temporary arrays.
+    
+    Parameters
+    ----------
+    x_data : np.ndarray
+        x-axis data, sorted in ascending order
+    x_range : list
+        x-axis range of the form [min, max]
+        
+    Returns
+    -------
+    slice
+        Slice of the points inside the range. x_data[slice] is a view.
+    """
+    if len(x_range) != 2:
+        raise ValueError('x_range must be of the form [min, max]')
+    return slice(int(np.searchsorted(x_data, x_range[0], side='left')),
+                 int(np.searchsorted(x_data, x_range[1], side='right')))
+
+# Function to get the slices of a sorted array for many ranges at once
+def get_range_slices(x_data: np.ndarray,
+                     x_ranges: list|np.ndarray) -> list[slice]:
+    """
+    Same as get_range_slice for many ranges at once. All of the edges are found with a single call to np.searchsorted.
+    
+    Parameters
+    ----------
+    x_data : np.ndarray
+        x-axis data, sorted in ascending order
+    x_ranges : list|np.ndarray
+        Ranges of the form [[min, max], [min, max], ...], shape (N, 2)
+        
+    Returns
+    -------
+    list[slice]
+        Slice of the points inside each range.
+    """
+    x_ranges = np.asarray(x_ranges, dtype=float)
+    if x_ranges.ndim != 2 or x_ranges.shape[1] != 2:
+        raise ValueError('x_ranges must have the form [[min, max], [min, max], ...]')
+    starts = np.searchsorted(x_data, x_ranges[:, 0], side='left')
+    stops = np.searchsorted(x_data, x_ranges[:, 1], side='right')
+    return [slice(start, stop) for start, stop in zip(starts.tolist(), stops.tolist())]
+
+# Function to truncate data to many ranges at once
+def truncate_data_windows(x_data: np.ndarray,
+                          y_data: np.ndarray,
+                          x_ranges: list|np.ndarray) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Truncate the data to many x ranges at once. x_data must be sorted in ascending order. The outputs are views of the
+    inputs, so no data is copied.
+    
+    Parameters
+    ----------
+    x_data : np.ndarray
+        x-axis data, sorted in ascending order, shape (F,)
+    y_data : np.ndarray
+        y-axis data, shape (F,). It can also be (N, F) with one trace per range, in which case row i is truncated to
+        range i.
+    x_ranges : list|np.ndarray
+        Ranges of the form [[min, max], [min, max], ...], shape (N, 2)
+        
+    Returns
+    -------
+    list[tuple[np.ndarray, np.ndarray]]
+        List of (x_data_trunc, y_data_trunc) for each range.
+    """
+    range_slices = get_range_slices(x_data, x_ranges)
+    if np.ndim(y_data) == 2:
+        if len(y_data) != len(range_slices):
+            raise ValueError('y_data must have one row per range when it is 2D.')
+        return [(x_data[sl], y_data[i, sl]) for i, sl in enumerate(range_slices)]
+    return [(x_data[sl], y_data[sl]) for sl in range_slices]
+
 # create a function to find the x value where an extremum occurs in the y data
 def find_where_extremum(x_data: np.ndarray, 
                         y_data: np.ndarray,
                         extremum: str='min',
-                        range: str|list = 'all') -> (float, float, float):
+                        range: str|list = 'all',
+                        assume_sorted: bool = False) -> (float, float, float):
     """
     Finds the x value where the desired extremum occurs (min or max for now) for a given range.
     The output is a tuple of the extremum x value, the extremum y value, and the index of the extremum value.
@@ -53,6 +141,8 @@ def find_where_extremum(x_data: np.ndarray,
         string to determine what extremum to search for. 'min' or 'max' for now. 
     range : str|list
         range of data to search for the extremum. 'all' or a list of the form [min, max].
+    assume_sorted : bool
+        If True, x_data is sorted in ascending order and the range is found with a binary search, see truncate_data.
         
     Returns
     -------
@@ -67,7 +157,7 @@ def find_where_extremum(x_data: np.ndarray,
     if isinstance(range, list):
         # truncate the data to the range
         try:
-            x_data_trunc, y_data_trunc = truncate_data(x_data, y_data, range)
+            x_data_trunc, y_data_trunc = truncate_data(x_data, y_data, range, assume_sorted=assume_sorted)
         except ValueError:
             raise ValueError('The range is not valid. Improperly formatted list.')
     elif isinstance(range, str):
@@ -100,6 +190,139 @@ def find_where_extremum(x_data: np.ndarray,
         max_index = np.where(x_data == max_x)[0][0]
         return max_x, max_y, max_index
     
+# create a function to find the extremum of many traces at once
+def find_where_extrema(x_data: np.ndarray,
+                       y_data: np.ndarray,
+                       extremum: str = 'min',
+                       range: str|list|np.ndarray = 'all',
+                       assume_sorted: bool = False) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Batched version of find_where_extremum for a 2D array of traces, such as the S11 data of a whole sweep. The index
+    of each extremum is computed directly in the coordinates of the full trace, so the x data is never searched again.
+    Both ends of the range are included.
+    
+    Parameters
+    ----------
+    x_data : np.ndarray
+        x data, either shape (F,) shared by every trace or (N, F)
+    y_data : np.ndarray
+        y data to be searched, shape (N, F)
+    extremum : str
+        string to determine what extremum to search for. 'min' or 'max' for now.
+    range : str|list|np.ndarray
+        range of data to search for the extremum. 'all', a list of the form [min, max] used for every trace, or an
+        array of shape (N, 2) with one [min, max] row per trace.
+    assume_sorted : bool
+        If True, x_data is shape (F,) and sorted in ascending order, so the range edges are found with a binary search
+        instead of comparing every x value. By default False
+        
+    Returns
+    -------
+    np.ndarray
+        x values where the extremum occurs, shape (N,)
+    np.ndarray
+        extremum y values, shape (N,)
+    np.ndarray
+        indices of the extremum values in the full traces, shape (N,)
+    """
+    y_data = np.atleast_2d(y_data)
+    n_traces, n_points = y_data.shape
+    x_data = np.asarray(x_data)
+    if extremum == 'min':
+        arg_extremum, fill = np.argmin, np.inf
+    elif extremum == 'max':
+        arg_extremum, fill = np.argmax, -np.inf
+    else:
+        raise ValueError('The extremum is not valid. Try \'min\' or \'max\'.')
+    
+    # format the data for if there is a range
+    if isinstance(range, str):
+        if range != 'all':
+            raise ValueError('The range is not valid. The only string allowed is \'all\'.')
+        index = arg_extremum(y_data, axis=1)
+    else:
+        x_ranges = np.asarray(range, dtype=float)
+        if x_ranges.shape == (2,) and assume_sorted:
+            # one shared window: search the slice and add its start to get the index in the full trace
+            range_slice = get_range_slice(x_data, x_ranges)
+            if range_slice.stop <= range_slice.start:
+                raise ValueError('The range is not valid. No data inside the range.')
+            index = range_slice.start + arg_extremum(y_data[:, range_slice], axis=1)
+        else:
+            if x_ranges.shape == (2,):
+                x_ranges = np.broadcast_to(x_ranges, (n_traces, 2))
+            elif x_ranges.shape != (n_traces, 2):
+                raise ValueError('The range is not valid. Use \'all\', [min, max], or an (N, 2) array of [min, max] rows.')
+            if assume_sorted:
+                # compare column numbers against the window edges instead of comparing every x value
+                columns = np.arange(n_points)
+                starts = np.searchsorted(x_data, x_ranges[:, 0], side='left')
+                stops = np.searchsorted(x_data, x_ranges[:, 1], side='right')
+                mask = (columns >= starts[:, None]) & (columns < stops[:, None])
+            else:
+                mask = (x_data >= x_ranges[:, :1]) & (x_data <= x_ranges[:, 1:])
+            if not np.all(mask.any(axis=1)):
+                raise ValueError('The range is not valid. No data inside the range of at least one trace.')
+            index = arg_extremum(np.where(mask, y_data, fill), axis=1)
+    
+    rows = np.arange(n_traces)
+    x_extremum = x_data[index] if x_data.ndim == 1 else x_data[rows, index]
+    return x_extremum, y_data[rows, index], index
+    
+# Function to reduce the number of points of traces for plotting while keeping the peaks and dips
+def minmax_decimate(x_data: np.ndarray,
+                    y_data: np.ndarray,
+                    n_bins: int) -> (np.ndarray, np.ndarray):
+    """
+    Reduce traces to about 2*n_bins points for plotting. The points are split into n_bins bins and the minimum and
+    maximum of each bin are kept (in their original order), so sharp features like resonance dips look the same as in
+    the full trace when n_bins is about the width of the plot in pixels. Traces that already have 2*n_bins points or
+    fewer are returned unchanged.
+    
+    Parameters
+    ----------
+    x_data : np.ndarray
+        x data, shape (F,) shared by every trace or the same shape as y_data
+    y_data : np.ndarray
+        y data, shape (F,) for one trace or (N, F) for many traces
+    n_bins : int
+        Number of bins, for example the width of the axes in pixels
+        
+    Returns
+    -------
+    np.ndarray
+        decimated x data, shape (M,) or (N, M)
+    np.ndarray
+        decimated y data, shape (M,) or (N, M)
+    """
+    y_2d = np.atleast_2d(y_data)
+    n_traces, n_points = y_2d.shape
+    x_2d = np.broadcast_to(x_data, y_2d.shape)
+    n_bins = max(int(n_bins), 1)
+    if n_points <= 2 * n_bins:
+        if np.ndim(y_data) == 1:
+            return x_data, y_data
+        return x_2d.copy(), y_data
+    # Equal sized bins, the leftover points at the end go in one more (smaller) bin
+    bin_size = n_points // n_bins
+    n_full = n_bins * bin_size
+    binned = y_2d[:, :n_full].reshape(n_traces, n_bins, bin_size)
+    offsets = np.arange(n_bins) * bin_size
+    min_index = offsets + np.argmin(binned, axis=2)
+    max_index = offsets + np.argmax(binned, axis=2)
+    if n_full < n_points:
+        rest = y_2d[:, n_full:]
+        min_index = np.concatenate([min_index, n_full + np.argmin(rest, axis=1)[:, None]], axis=1)
+        max_index = np.concatenate([max_index, n_full + np.argmax(rest, axis=1)[:, None]], axis=1)
+    # Keep the first and last points so the trace covers the full x range, then put everything back in order
+    ends = np.broadcast_to(np.array([0, n_points - 1]), (n_traces, 2))
+    index = np.sort(np.concatenate([ends, min_index, max_index], axis=1), axis=1)
+    rows = np.arange(n_traces)[:, None]
+    x_decimated, y_decimated = x_2d[rows, index], y_2d[rows, index]
+    if np.ndim(y_data) == 1:
+        return x_decimated[0], y_decimated[0]
+    return x_decimated, y_decimated
+    
 def sort_lists(list1: list, 
                sorting_list: list,
                sort_by='ascending') -> (list, list):
@@ -16,6 +16,9 @@ setup(
         'numpy',
         'pandas'
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
     classifiers=[
         'Development Status :: 1 - Planning',
         'Intended Audience :: Science/Research',
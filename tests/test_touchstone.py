@@ -0,0 +1,71 @@
+# Tests that the native touchstone reader matches skrf, and that the files it doesn't handle fall back to skrf
+import numpy as np
+import pytest
+import skrf
+from ethanalysis.rf.touchstone import read_touchstone, load_touchstone_network, parse_cst_parameters
+
+# Function to make a random network with a non-uniform frequency grid
+def random_network(n_ports: int, n_points: int = 51, seed: int = 0) -> skrf.Network:
+    rng = np.random.default_rng(seed)
+    f = np.sort(rng.uniform(1, 10, n_points))
+    s = rng.normal(size=(n_points, n_ports, n_ports)) + 1j * rng.normal(size=(n_points, n_ports, n_ports))
+    return skrf.Network(frequency=skrf.Frequency.from_f(f, unit='ghz'), s=s, z0=50, name='random')
+
+@pytest.mark.parametrize('data_format', ['ri', 'ma', 'db'])
+@pytest.mark.parametrize('n_ports', [1, 2, 4])
+def test_read_touchstone_matches_skrf(tmp_path, n_ports, data_format):
+    network = random_network(n_ports)
+    network.write_touchstone('random', dir=str(tmp_path), form=data_format, write_z0=False)
+    filepath = str(tmp_path / f'random.s{n_ports}p')
+    reference = skrf.Network(filepath)
+    data = read_touchstone(filepath)
+    assert data.s.shape == reference.s.shape
+    np.testing.assert_allclose(data.f, reference.f)
+    np.testing.assert_allclose(data.s, reference.s, rtol=1e-9, atol=1e-12)
+    loaded = load_touchstone_network(filepath)
+    np.testing.assert_allclose(loaded.s, reference.s, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(loaded.z0, reference.z0)
+    assert loaded.frequency.unit == reference.frequency.unit
+    assert loaded.name == reference.name
+
+def test_two_port_column_order(tmp_path):
+    # Two port files list 11 21 12 22, so S21 and S12 must not be swapped
+    filepath = tmp_path / 'order.s2p'
+    filepath.write_text('# Hz S RI R 50\n'
+                        '1 0.11 0 0.21 0 0.12 0 0.22 0\n'
+                        '2 0.11 0 0.21 0 0.12 0 0.22 0\n')
+    data = read_touchstone(str(filepath))
+    np.testing.assert_allclose(data.s[0].real, [[0.11, 0.12], [0.21, 0.22]])
+    np.testing.assert_allclose(data.s, skrf.Network(str(filepath)).s)
+
+def test_units_inline_comments_and_cst_header(tmp_path):
+    filepath = tmp_path / 'cst.s1p'
+    filepath.write_text('! TOUCHSTONE file generated by CST Studio Suite\n!\n! Date and Time: now\n'
+                        '! Parameters = {L=10; W=3}\n!\n# MHz S DB R 75\n'
+                        '100 -3 45 ! first point\n200 -6 90\n')
+    data = read_touchstone(str(filepath))
+    np.testing.assert_allclose(data.f, [100e6, 200e6])
+    assert data.z0 == 75 and data.unit == 'MHz'
+    np.testing.assert_allclose(data.s, skrf.Network(str(filepath)).s)
+    assert parse_cst_parameters(data.comments) == {'L': '10', 'W': '3'}
+
+# Two port S-data followed by noise parameters, with 2 or 9 noise lines (9 fills whole S-data rows by accident)
+@pytest.mark.parametrize('n_noise', [2, 9])
+def test_noise_parameters_fall_back_to_skrf(tmp_path, n_noise):
+    filepath = tmp_path / 'noise.s2p'
+    lines = ['# GHz S MA R 50'] + [f'{f} 0.9 -10 0.1 20 0.1 20 0.8 -5' for f in (1, 2, 3)]
+    lines += [f'{1 + 0.1 * k:.1f} 1.5 0.3 40 0.2' for k in range(n_noise)]
+    filepath.write_text('\n'.join(lines) + '\n')
+    with pytest.raises(ValueError):
+        read_touchstone(str(filepath))
+    network = load_touchstone_network(str(filepath))
+    np.testing.assert_allclose(network.s, skrf.Network(str(filepath)).s)
+
+def test_version_2_falls_back_to_skrf(tmp_path):
+    filepath = tmp_path / 'v2.s1p'
+    filepath.write_text('[Version] 2.0\n# GHz S RI R 50\n[Number of Ports] 1\n[Number of Frequencies] 2\n'
+                        '[Network Data]\n1 0.1 0.2\n2 0.3 0.4\n[End]\n')
+    with pytest.raises(ValueError):
+        read_touchstone(str(filepath))
+    network = load_touchstone_network(str(filepath))
+    np.testing.assert_allclose(network.s, skrf.Network(str(filepath)).s)